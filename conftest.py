@@ -0,0 +1 @@
+# Makes the `src` package importable from the tests, which are run from the root of the repository
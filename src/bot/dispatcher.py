@@ -0,0 +1,176 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+from src.utils.rate_limit import TokenBucket
+
+WORKERS = 4
+MAX_QUEUE_SIZE = 100
+ENQUEUE_TIMEOUT = 0.5  # [s] time a handler waits for space in a full queue before the request is rejected
+# Requests a single chat can make per minute, and the burst allowed on top of it
+MESSAGES_PER_MINUTE = 6
+BURST = 3
+
+# Results of Dispatcher.submit
+QUEUED = "queued"
+RATE_LIMITED = "rate_limited"
+QUEUE_FULL = "queue_full"
+CLOSED = "closed"
+
+
+class DispatcherMetrics:
+    """Counters and latencies of a dispatcher, the latency is measured from the submission to the end of the job"""
+
+    def __init__(self, window: int = 1000):
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.queue_full = 0
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def add_latency(self, latency: float, failed: bool = False):
+        with self._lock:
+            self.processed += 1
+            self.failed += int(failed)
+            self.latencies.append(latency)
+
+    def snapshot(self) -> dict:
+        # Imported on first use, so that it is not part of the start of the bot
+        import numpy as np
+
+        with self._lock:
+            latencies = np.array(self.latencies)
+            snapshot = {
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "failed": self.failed,
+                "rate_limited": self.rate_limited,
+                "queue_full": self.queue_full,
+            }
+        for name, percentile in [("latency_p50", 50), ("latency_p95", 95), ("latency_max", 100)]:
+            snapshot[name] = float(np.percentile(latencies, percentile)) if len(latencies) else 0.0
+        return snapshot
+
+
+class Dispatcher:
+    """
+    Runs the bot's jobs on a pool of worker threads, so that the handlers of the bot return immediately.
+
+    Jobs go through a bounded queue: when it is full, submitting waits up to `enqueue_timeout` and is then rejected,
+    which pushes back on the callers instead of piling up work. Each chat is rate limited by its own token bucket.
+    On shutdown no new jobs are accepted, the queued ones are finished and the workers are joined.
+    """
+
+    def __init__(
+        self,
+        handler: Callable,
+        workers: int = WORKERS,
+        max_queue_size: int = MAX_QUEUE_SIZE,
+        messages_per_minute: float = MESSAGES_PER_MINUTE,
+        burst: float = BURST,
+        enqueue_timeout: float = ENQUEUE_TIMEOUT,
+    ):
+        """
+        Args:
+            handler: function called by the workers with the chat id and the payload of a job
+            workers: number of worker threads
+            max_queue_size: maximum number of jobs waiting for a worker
+            messages_per_minute: sustained number of jobs a chat can submit per minute
+            burst: number of jobs a chat can submit at once
+            enqueue_timeout: time to wait for a free place in the queue [s]
+        """
+        self.handler = handler
+        self.workers = workers
+        self.messages_per_minute = messages_per_minute
+        self.burst = burst
+        self.enqueue_timeout = enqueue_timeout
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.metrics = DispatcherMetrics()
+
+        self._chat_buckets = {}
+        self._chat_lock = threading.Lock()
+        self._threads = []
+        self._closed = threading.Event()
+
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def get_metrics(self) -> dict:
+        metrics = self.metrics.snapshot()
+        metrics["queue_depth"] = self.queue_depth()
+        return metrics
+
+    def _allow(self, chat_id) -> bool:
+        with self._chat_lock:
+            if chat_id not in self._chat_buckets:
+                self._chat_buckets[chat_id] = TokenBucket(self.messages_per_minute / 60, self.burst)
+            bucket = self._chat_buckets[chat_id]
+        return bucket.try_acquire()
+
+    def start(self):
+        self._closed.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"dispatcher-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, chat_id, payload=None) -> str:
+        """
+        Queues a job for the chat.
+
+        Returns:
+            status: QUEUED, or why the job was rejected: RATE_LIMITED, QUEUE_FULL or CLOSED
+        """
+        if self._closed.is_set():
+            return CLOSED
+        if not self._allow(chat_id):
+            self.metrics.count("rate_limited")
+            return RATE_LIMITED
+
+        try:
+            self.queue.put((chat_id, payload, time.monotonic()), timeout=self.enqueue_timeout)
+        except queue.Full:
+            self.metrics.count("queue_full")
+            return QUEUE_FULL
+
+        self.metrics.count("submitted")
+        return QUEUED
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+
+            chat_id, payload, submitted_at = job
+            failed = False
+            try:
+                self.handler(chat_id, payload)
+            except Exception as e:
+                failed = True
+                print(f"Error handling the request of chat {chat_id}: {e}")
+            finally:
+                self.metrics.add_latency(time.monotonic() - submitted_at, failed=failed)
+                self.queue.task_done()
+
+    def shutdown(self, timeout: float = None):
+        """Stops accepting jobs, finishes the queued ones and stops the workers"""
+        self._closed.set()
+        for _ in self._threads:
+            # The stop markers are queued after the pending jobs, so these are still handled
+            self.queue.put(None)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
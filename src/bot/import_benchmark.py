@@ -0,0 +1,64 @@
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import List, Tuple
+
+# Modules the bot process imports on start, measured in fresh interpreters as after a restart
+ENTRY_POINTS = ["src.bot.publisher", "src.inference.predict"]
+# Budget of the import of an entry point [s], so that the bot is back to polling quickly after a crash
+IMPORT_BUDGET = 1.0
+RUNS = 5
+
+_MEASURE_SCRIPT = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def measure_import(module: str) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    Imports the module in a new interpreter.
+
+    Returns:
+        duration: time of the import [s]
+        imports: modules imported with it and their cumulative import time [s], slowest first
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _MEASURE_SCRIPT.format(module=module)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative [us] | package, nested imports are indented
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        imports.append((name.strip(), int(cumulative) / 1e6))
+
+    return float(result.stdout.strip()), sorted(imports, key=lambda item: -item[1])
+
+
+def run_benchmark(modules: List[str], runs: int = RUNS, budget: float = IMPORT_BUDGET, top: int = 10) -> bool:
+    """Prints the median import time of each module and its slowest imports. Returns whether all are in budget"""
+    in_budget = True
+    for module in modules:
+        measures = [measure_import(module) for _ in range(runs)]
+        median = statistics.median(duration for duration, _ in measures)
+        status = "ok" if median <= budget else "over budget"
+        in_budget = in_budget and median <= budget
+
+        print(f"{module}: {median * 1000:.0f} ms (median of {runs}, budget {budget * 1000:.0f} ms, {status})")
+        for name, cumulative in measures[-1][1][:top]:
+            print(f"    {cumulative * 1000:8.1f} ms  {name}")
+    return in_budget
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the cold import time of the bot entry points")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="budget of each import [s]")
+    args = parser.parse_args()
+
+    sys.exit(0 if run_benchmark(args.modules, args.runs, args.budget) else 1)
@@ -1,22 +1,62 @@
 import os
+import signal
+import threading
 from datetime import datetime
 import time
+from typing import TYPE_CHECKING
 
-import numpy as np
-import pandas as pd
-import telebot
+from src.bot.dispatcher import QUEUE_FULL, QUEUED, Dispatcher
+from src.inference.prediction_service import PredictionService
 
-from src.inference.predict import Predictor
+if TYPE_CHECKING:
+    # Only for the annotations, pandas alone takes most of the import time of the bot
+    import numpy as np
+    import pandas as pd
 
-
-BOT_TOKEN = os.environ["BOT_TOKEN"]
-bot = telebot.TeleBot(BOT_TOKEN)
+CLUB = "berghain"
 chat_id = "33014672"
 
-pred = Predictor(club_name="berghain")
+# Created on first use, so that importing the module is fast and does not need the environment
+_bot = None
+_predictor = None
+_lazy_lock = threading.Lock()
+
+
+def get_bot():
+    """
+    Returns the bot of the process, created with the token of the environment variable BOT_TOKEN.
+    TELEGRAM_API_URL sets the url of the Bot API, e.g. of a local fake server for tests. It is formatted with the
+    token and the method name.
+    """
+    global _bot
+    with _lazy_lock:
+        if _bot is None:
+            import telebot
+
+            api_url = os.environ.get("TELEGRAM_API_URL")
+            if api_url:
+                telebot.apihelper.API_URL = api_url
+            bot = telebot.TeleBot(os.environ["BOT_TOKEN"])
+            bot.register_message_handler(send_welcome, commands=["start", "hello"])
+            bot.register_message_handler(handle_message, func=lambda message: True)
+            _bot = bot
+        return _bot
+
 
+def get_predictor():
+    """Returns the predictor of the process, the inference stack is imported on the first prediction"""
+    global _predictor
+    with _lazy_lock:
+        if _predictor is None:
+            from src.inference.predict import Predictor
+
+            _predictor = Predictor(club_name=CLUB)
+        return _predictor
+
+
+def generate_text(predicted_hours: "np.ndarray", artists_data: "pd.DataFrame", features: dict) -> str:
+    import pandas as pd
 
-def generate_text(predicted_hours: np.array, artists_data: pd.DataFrame, features: dict) -> str:
     if predicted_hours is not None:
         reply = ""
         if predicted_hours >= 5:
@@ -83,35 +123,70 @@ def generate_text(predicted_hours: np.array, artists_data: pd.DataFrame, feature
     return reply
 
 
-@bot.message_handler(commands=["start", "hello"])
 def send_welcome(message):
-    bot.reply_to(message, "Howdy, how are you doing?")
+    get_bot().reply_to(message, "Howdy, how are you doing?")
 
 
-def send_prediction(chat_id_to_send):
-    try:
-        predicted_hours, features, artists_data = pred.predict(date=datetime.today().date())
+def render_reply(predicted_hours: "np.ndarray", features: dict, artists_data: "pd.DataFrame") -> str:
+    """Renders the reply of a prediction, the artists are listed by followers"""
+    if artists_data is not None:
+        artists_data = artists_data.sort_values("followers", ascending=False).reset_index(drop=True)
+    return generate_text(predicted_hours, artists_data, features)
+
 
-        artists_data.sort_values("followers", ascending=False, inplace=True)
-        artists_data.reset_index(drop=True, inplace=True)
+# Tonight's reply is cached and precomputed, so that messages are answered without scraping or inference
+prediction_service = PredictionService(lambda date_selected: get_predictor().predict(date=date_selected), render_reply)
 
-        reply = generate_text(predicted_hours, artists_data, features)
 
-        bot.send_message(chat_id_to_send, reply, parse_mode="HTML")
+def send_prediction(chat_id_to_send, payload=None):
+    try:
+        reply = prediction_service.get_reply(datetime.today().date())
+
+        get_bot().send_message(chat_id_to_send, reply, parse_mode="HTML")
     except Exception as e:
         print(f"Error during prediction: {e}")
-        bot.send_message(chat_id_to_send, "An error occurred while generating the prediction.")
+        get_bot().send_message(chat_id_to_send, "An error occurred while generating the prediction.")
+
+
+# The predictions are sent by a pool of workers, so that a slow request does not block the other chats
+dispatcher = Dispatcher(send_prediction)
 
 
-@bot.message_handler(func=lambda message: True)
 def handle_message(message):
-    send_prediction(message.chat.id)
+    status = dispatcher.submit(message.chat.id)
+    if status == QUEUE_FULL:
+        get_bot().reply_to(message, "Too many requests right now, please try again in a minute.")
+    elif status != QUEUED:
+        print(f"Request of chat {message.chat.id} not handled: {status}")
+
+
+def stop(signum, frame):
+    """Stops polling, the main loop then shuts down the workers"""
+    global running
+    running = False
+    get_bot().stop_polling()
 
 
 if __name__ == "__main__":
-    while True:
-        try:
-            bot.polling()
-        except Exception as e:
-            print(f"Polling error: {e}")
-            time.sleep(15)
+    from src.inference.model_registry import get_model_registry
+
+    running = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    prediction_service.start_scheduler()
+    get_model_registry().start_watching()
+    dispatcher.start()
+    try:
+        while running:
+            try:
+                get_bot().polling()
+            except Exception as e:
+                print(f"Polling error: {e}")
+                time.sleep(15)
+    finally:
+        # The queued requests are still answered before exiting
+        dispatcher.shutdown(timeout=60)
+        prediction_service.stop_scheduler()
+        get_model_registry().stop_watching()
+        print(f"Dispatcher metrics: {dispatcher.get_metrics()}")
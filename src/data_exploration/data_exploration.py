@@ -1,11 +1,9 @@
-from datetime import datetime
-from typing import List
-
 import pandas as pd
 import matplotlib.pyplot as plt
 
 from src.utils.metadata_utils import (
     get_google_trends_data,
+    get_important_dates,
     get_weather_data,
     temperature_trend,
     HOUR,
@@ -14,36 +12,6 @@ from src.utils.bh_data_parser import BHParser
 from src.utils.telegram_data_parser import queue_estimates
 
 
-def get_important_dates(years_list: List):
-    """Returns list of dates that have a high affluence."""
-    important_dates_csd = ["2021-7-24", "2022-7-23", "2023-7-22"]
-    important_dates_easter = [
-        "2021-4-2",
-        "2021-4-3",
-        "2021-4-4",
-        "2021-4-5",
-        "2022-4-15",
-        "2022-4-16",
-        "2022-4-17",
-        "2022-4-18",
-        "2023-4-7",
-        "2023-4-8",
-        "2023-4-9",
-        "2023-4-10",
-    ]
-
-    important_dates = important_dates_csd + important_dates_easter
-    important_dates = [datetime.strptime(date, "%Y-%m-%d") for date in important_dates]
-
-    nye = [datetime.strptime(f"{year}-12-31", "%Y-%m-%d") for year in years_list]
-    christmas = [datetime.strptime(f"{year}-12-24", "%Y-%m-%d") for year in years_list]
-
-    important_dates += nye
-    important_dates += christmas
-
-    return important_dates
-
-
 def get_features_historical(start_date=None, end_date=None, weather=False, followers=True, trends=False):
     # Follower data from saved files
     if followers:
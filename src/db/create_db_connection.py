@@ -1,14 +1,69 @@
 import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import sqlalchemy as sa
 
+# Defaults of the connection pool, they can be overwritten in the database configuration
+POOL_OPTIONS = {"pool_size": 5, "max_overflow": 10, "pool_pre_ping": True, "pool_recycle": 3600, "pool_timeout": 30}
+
+# Database used for local runs, when no MySQL server is configured or reachable.
+# It is attached as the schema "clubs", so the same queries work on both backends
+SQLITE_PATH = os.path.join("data", "clubs.sqlite")
+
+# Engines of the current process, keyed on the connection url and the pool options
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class PoolMetrics:
+    """Usage metrics of an engine's connection pool"""
+
+    def __init__(self):
+        self.checked_out = 0
+        self.checkouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._lock = threading.Lock()
+
+    def on_checkout(self, *args):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def on_checkin(self, *args):
+        with self._lock:
+            self.checked_out -= 1
+
+    def add_wait_time(self, wait_time: float):
+        with self._lock:
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "avg_wait_time": self.total_wait_time / self.checkouts if self.checkouts else 0.0,
+                "max_wait_time": self.max_wait_time,
+            }
+
+
 def load_db_config(path):
     """ Load the database configuration from a JSON file. """
     with open(path, "r") as file:
         config = json.load(file)
     return config
 
+
 def create_connection(config):
     """ Create a database connection using the provided configuration. """
+    if config["drivername"].startswith("sqlite"):
+        return create_sqlite_connection(config.get("database_path", SQLITE_PATH))
+
     connection_string = sa.engine.url.URL.create(
         drivername=config["drivername"],
         username=config["username"],
@@ -17,11 +72,79 @@ def create_connection(config):
         port=config["port"],
         database=config["database"]
     )
-    engine = sa.create_engine(connection_string)
+    pool_options = {option: config.get(option, default) for option, default in POOL_OPTIONS.items()}
+    engine = sa.create_engine(connection_string, **pool_options)
     return engine
 
+
+def create_sqlite_connection(path: str = SQLITE_PATH):
+    """ Create a connection to a local SQLite database, attached as the schema "clubs". """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    engine = sa.create_engine("sqlite://", pool_pre_ping=True)
+
+    @sa.event.listens_for(engine, "connect")
+    def attach_clubs(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"ATTACH DATABASE '{path}' AS clubs")
+
+    return engine
+
+
+def get_engine(config_path: str = "config/db_config.json", fallback_to_sqlite: bool = False):
+    """
+    Returns the engine of the process for the given configuration, it is created on the first call.
+
+    The local SQLite database is used instead of the configured server only when asked for: with the environment
+    variable BERGHAIN_DB set to "sqlite", or with fallback_to_sqlite set, if the server can not be reached (or its
+    driver is not installed). Otherwise connection errors are raised, so that the scraper, the trainer and the bot
+    never end up writing to different databases.
+    """
+    config = load_db_config(config_path)
+    if os.environ.get("BERGHAIN_DB") == "sqlite":
+        config = {"drivername": "sqlite"}
+
+    key = json.dumps(config, sort_keys=True)
+    with _engines_lock:
+        if key not in _engines:
+            try:
+                engine = create_connection(config)
+                if fallback_to_sqlite and engine.dialect.name != "sqlite":
+                    with engine.connect():
+                        pass
+            except (ImportError, sa.exc.OperationalError) as e:
+                if not fallback_to_sqlite:
+                    raise
+                print(f"Could not connect to the database, falling back to SQLite: {e}")
+                engine = create_sqlite_connection()
+
+            engine.pool_metrics = PoolMetrics()
+            sa.event.listen(engine, "checkout", engine.pool_metrics.on_checkout)
+            sa.event.listen(engine, "checkin", engine.pool_metrics.on_checkin)
+            _engines[key] = engine
+
+        return _engines[key]
+
+
+@contextmanager
+def session_scope(engine):
+    """
+    Provides a connection in a transaction, committed at the end of the block and rolled back on errors.
+    The time spent waiting for a connection of the pool is recorded in the engine's pool metrics.
+    """
+    start = time.monotonic()
+    with engine.begin() as connection:
+        if hasattr(engine, "pool_metrics"):
+            engine.pool_metrics.add_wait_time(time.monotonic() - start)
+        yield connection
+
+
+def get_pool_metrics(engine) -> dict:
+    """ Returns the pool metrics of an engine created with get_engine. """
+    metrics = engine.pool_metrics.snapshot()
+    metrics["pool_status"] = engine.pool.status()
+    return metrics
+
+
 if __name__ == "__main__":
 	config_path = "config/db_config.json"
-	config = load_db_config(config_path)
-	engine = create_connection(config)
-
+	engine = get_engine(config_path)
+	print(get_pool_metrics(engine))
@@ -0,0 +1,339 @@
+import glob
+import importlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Version of the feature definitions. Every version is materialized in its own folder, so it has to be increased
+# whenever a definition below changes, the new version is then rebuilt from scratch
+FEATURE_VERSION = 1
+
+# Features of a night, by source
+FEATURE_DEFINITIONS = {
+    "followers": ["followers", "followers_max", "followers_mean", "artists", "followers_top3"],
+    "weather": ["temperature", "precipitation"],
+    "calendar": ["temperature_trend", "important_date", "weekday"],
+    "labels": ["max_waiting_time"],
+}
+COLUMNS = ["club", "night"] + [feature for features in FEATURE_DEFINITIONS.values() for feature in features]
+
+# Nights before the end of the refreshed range that are recomputed on every refresh, because their labels and weather
+# can still come in late
+REFRESH_OVERLAP_DAYS = 7
+
+# Nights without lineup are looked up again after this time [s], the program of upcoming nights is published over time
+MISSING_NIGHT_CHECK_INTERVAL = 6 * 3600
+
+# Weather data older than this is read from the local exports, newer data from the API
+WEATHER_API_DAYS = 2
+
+# Parser class of each club, imported on first use so that reading the store does not load the scraping stack
+PARSERS = {"berghain": "src.utils.bh_data_parser.BHParser"}
+CITIES = {"berghain": "Berlin"}
+
+
+class FeatureStore:
+    """
+    Materialized features of a club, one row per event night.
+
+    The rows hold the followers of the night's lineup, the weather, the seasonal temperature, the important-date flag
+    and the label (maximum waiting time from the queue estimates). They are computed from the raw sources by
+    `refresh`, which only recomputes the nights that are missing or recent, and saved as a parquet file per version
+    of the feature definitions. Training and inference read the same rows, a night is a dictionary lookup once the
+    store is loaded. Single nights computed on demand are written as their own small parquet file next to it, and
+    merged into it by the next refresh.
+
+    The night of an event is the date it starts on: the prediction for a date is the one of the night before.
+    """
+
+    def __init__(self, club: str = "berghain", root: str = "data", version: int = FEATURE_VERSION, parser=None):
+        """
+        Args:
+            club: name of the club, lowercase
+            root: data folder
+            version: version of the feature definitions to read and write
+            parser: club parser used for the follower data, by default a new one
+        """
+        self.club = club.lower()
+        self.version = version
+        self.path = os.path.join(root, self.club, "features", f"v{version}")
+        self.path_features = os.path.join(self.path, "features.parquet")
+        self.path_meta = os.path.join(self.path, "meta.json")
+        self.path_nights = os.path.join(self.path, "nights")
+        self._parser = parser
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._features = None
+        self._rows = None
+        # Time of the last lookup of the nights without lineup
+        self._checked_at = {}
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            module_name, class_name = PARSERS[self.club].rsplit(".", 1)
+            self._parser = getattr(importlib.import_module(module_name), class_name)()
+        return self._parser
+
+    @staticmethod
+    def night_for_date(date_selected: date) -> date:
+        """The events are listed to start on the evening of the previous day"""
+        return date_selected - timedelta(days=1)
+
+    def meta(self) -> dict:
+        if not os.path.exists(self.path_meta):
+            return {}
+        with open(self.path_meta, "r") as json_file:
+            return json.load(json_file)
+
+    def load(self) -> pd.DataFrame:
+        """Returns the materialized features, sorted by night"""
+        with self._lock:
+            if self._features is None:
+                features = pd.DataFrame(columns=COLUMNS)
+                if self.meta().get("definitions") == FEATURE_DEFINITIONS:
+                    parts = [self.path_features] if os.path.exists(self.path_features) else []
+                    parts += sorted(glob.glob(os.path.join(self.path_nights, "*.parquet")))
+                    if parts:
+                        features = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+                        features["night"] = pd.to_datetime(features.night).dt.date
+                        # The single nights are newer than the rows of the features file
+                        features = features.drop_duplicates("night", keep="last")
+                self._set_features(features)
+            return self._features
+
+    def _set_features(self, features: pd.DataFrame):
+        self._features = features.sort_values("night").reset_index(drop=True)
+        self._rows = dict(zip(self._features.night, self._features.to_dict("records")))
+
+    def read(self, start_date: date = None, end_date: date = None, labeled: bool = False) -> pd.DataFrame:
+        """
+        Returns the features of the nights between start_date and end_date, both included.
+
+        Args:
+            start_date: first night, from the beginning if not set
+            end_date: last night, until the end if not set
+            labeled: only return the nights that have a label
+        """
+        features = self.load()
+        selected = np.ones(len(features), dtype=bool)
+        if start_date is not None:
+            selected &= (features.night >= start_date).to_numpy()
+        if end_date is not None:
+            selected &= (features.night <= end_date).to_numpy()
+        if labeled:
+            selected &= features.max_waiting_time.notna().to_numpy()
+        return features[selected].reset_index(drop=True)
+
+    def get_night(self, night: date, compute_missing: bool = True) -> Optional[dict]:
+        """
+        Returns the features of a night. If it is not materialized yet and compute_missing is set, only this night
+        is computed and added to the store.
+        """
+        self.load()
+        row = self._rows.get(night)
+        # Nights without lineup are checked again, the program of upcoming nights is published over time
+        if compute_missing and (row is None or pd.isna(row["followers"])) and self._check_due(night):
+            row = self._compute_night(night)
+        return row
+
+    def _check_due(self, night: date) -> bool:
+        """Whether the lineup of a night is looked up, at most once per MISSING_NIGHT_CHECK_INTERVAL"""
+        now = time.monotonic()
+        with self._lock:
+            checked_at = self._checked_at.get(night)
+            if checked_at is not None and now - checked_at < MISSING_NIGHT_CHECK_INTERVAL:
+                return False
+            self._checked_at[night] = now
+            return True
+
+    def _compute_night(self, night: date) -> Optional[dict]:
+        """Computes a single night and writes it to the store, unless its lineup is still unknown"""
+        with self._refresh_lock:
+            # Scrapes the month of the night if it is not in the follower store yet
+            self.parser.get_followers_at_date(night + timedelta(days=1))
+            computed = self.compute([night])
+
+            previous = self._rows.get(night)
+            if previous is not None and computed.followers.isna().all():
+                return previous
+            computed = computed.assign(max_waiting_time=np.nan if previous is None else previous["max_waiting_time"])
+            self.save_night(computed)
+            return self._rows.get(night)
+
+    def get_features_at_date(self, date_selected: date, compute_missing: bool = True) -> Optional[dict]:
+        """Returns the features used to predict the given date, i.e. the ones of the night before"""
+        return self.get_night(self.night_for_date(date_selected), compute_missing=compute_missing)
+
+    def refresh(
+        self, start_date: date = None, end_date: date = None, full: bool = False, labels: bool = True
+    ) -> pd.DataFrame:
+        """
+        Computes the nights that are missing from the store or recent, and saves them.
+
+        Args:
+            start_date: first night to compute, by default the first night of the follower data
+            end_date: last night to compute, by default the last night of the follower data
+            full: recompute all the nights in the range
+            labels: whether the labels of all the nights are updated. They are not needed for predictions
+
+        Returns:
+            features: all the materialized features
+        """
+        with self._refresh_lock:
+            return self._refresh(start_date, end_date, full, labels)
+
+    def _refresh(self, start_date: date, end_date: date, full: bool, labels: bool) -> pd.DataFrame:
+        features = self.load()
+        followers_by_date = self.parser.gather_artist_data()
+
+        if start_date is None or end_date is None:
+            if followers_by_date.empty:
+                return features
+            start_date = start_date or followers_by_date.date.min()
+            end_date = end_date or followers_by_date.date.max()
+
+        # Event nights of the range, plus the explicitly requested ones
+        nights = set(
+            followers_by_date.date[(followers_by_date.date >= start_date) & (followers_by_date.date <= end_date)]
+        )
+        if start_date == end_date:
+            nights.add(start_date)
+
+        if not full and not features.empty:
+            recent_from = end_date - timedelta(days=REFRESH_OVERLAP_DAYS)
+            nights = {night for night in nights if night not in self._rows or night >= recent_from}
+        if not nights and not labels:
+            return features
+
+        if nights:
+            nights = sorted(nights)
+            print(f"Computing the features of {len(nights)} nights for {self.club}")
+            computed = self.compute(nights, followers_by_date)
+
+            # Keeping the labels of the nights that were materialized before
+            previous_labels = {night: self._rows[night]["max_waiting_time"] for night in nights if night in self._rows}
+            computed["max_waiting_time"] = computed.night.map(previous_labels).astype(float)
+            features = pd.concat([features[~features.night.isin(nights)], computed], ignore_index=True)
+
+        if labels:
+            # Joining the labels is cheap, so they are updated for all the nights, also the ones that were materialized
+            # without labels
+            labels_by_night = self.compute_labels()
+            labels_by_night = dict(zip(labels_by_night.night, labels_by_night.max_waiting_time))
+            features["max_waiting_time"] = features.night.map(labels_by_night).astype(float)
+
+        self.save(features)
+        return self._features
+
+    def compute(self, nights: List[date], followers_by_date: pd.DataFrame = None) -> pd.DataFrame:
+        """Computes the features of the given nights from the raw sources, the labels are left empty"""
+        from src.utils.metadata_utils import get_important_dates, temperature_on_day
+
+        if followers_by_date is None:
+            followers_by_date = self.parser.gather_artist_data()
+
+        features = pd.DataFrame({"club": self.club, "night": nights})
+
+        followers = followers_by_date.reindex(columns=["date"] + FEATURE_DEFINITIONS["followers"])
+        features = features.merge(followers.rename(columns={"date": "night"}), on="night", how="left")
+
+        features = features.merge(self.compute_weather(nights), on="night", how="left")
+
+        important_dates = {
+            important_date.date() for important_date in get_important_dates(range(nights[0].year, nights[-1].year + 1))
+        }
+        features["temperature_trend"] = [temperature_on_day(night) for night in nights]
+        features["important_date"] = features.night.isin(important_dates).astype(int)
+        features["weekday"] = [night.weekday() for night in nights]
+        features["max_waiting_time"] = np.nan
+
+        return features[COLUMNS]
+
+    def compute_weather(self, nights: List[date]) -> pd.DataFrame:
+        """Weather of the nights, from the local exports for old nights and from the API for recent ones"""
+        from src.utils.metadata_utils import get_weather_data
+
+        limit_api = date.today() - timedelta(days=WEATHER_API_DAYS)
+        ranges = [
+            (nights[0], min(nights[-1], limit_api - timedelta(days=1))),
+            (max(nights[0], limit_api), nights[-1]),
+        ]
+
+        weather = []
+        for start_date, end_date in ranges:
+            if start_date <= end_date:
+                weather.append(get_weather_data(CITIES[self.club], start_date, end_date))
+        weather = pd.concat(weather, ignore_index=True) if weather else pd.DataFrame(columns=["date"])
+
+        weather = weather.reindex(columns=["date"] + FEATURE_DEFINITIONS["weather"]).rename(columns={"date": "night"})
+        weather["night"] = pd.to_datetime(weather.night).dt.date
+        return weather[weather.night.isin(nights)]
+
+    @staticmethod
+    def compute_labels() -> pd.DataFrame:
+        """Maximum waiting time of each night, from the queue estimates of the text sources"""
+        # Imported here, reading the messages is only needed to build the training data
+        from src.utils.telegram_data_parser import queue_estimates
+
+        labels = queue_estimates()
+        labels["night"] = pd.to_datetime(labels.date).dt.date
+        return labels.groupby("night", as_index=False).max_waiting_time.mean()
+
+    def save(self, features: pd.DataFrame):
+        """Saves the features atomically, together with the definitions they were computed with"""
+        os.makedirs(self.path, exist_ok=True)
+        features = features.sort_values("night").reset_index(drop=True)
+
+        features.to_parquet(f"{self.path_features}.tmp", index=False)
+        os.replace(f"{self.path_features}.tmp", self.path_features)
+        self._save_meta(len(features))
+
+        # The single nights were loaded with the features, they are part of the file now
+        for path_night in glob.glob(os.path.join(self.path_nights, "*.parquet")):
+            os.remove(path_night)
+
+        with self._lock:
+            self._set_features(features)
+
+    def save_night(self, night_features: pd.DataFrame):
+        """Saves the row of a single night in its own file, without rewriting the features file"""
+        night = night_features.night.iloc[0]
+        features = self.load()
+        if self.meta().get("definitions") != FEATURE_DEFINITIONS:
+            # Nothing valid is stored yet, the night is saved as the features file together with the definitions
+            self.save(pd.concat([features[features.night != night], night_features], ignore_index=True))
+            return
+
+        os.makedirs(self.path_nights, exist_ok=True)
+        path_night = os.path.join(self.path_nights, f"{night.isoformat()}.parquet")
+        night_features.to_parquet(f"{path_night}.tmp", index=False)
+        os.replace(f"{path_night}.tmp", path_night)
+
+        with self._lock:
+            features = self._features
+            self._set_features(pd.concat([features[features.night != night], night_features], ignore_index=True))
+
+    def _save_meta(self, nights: int):
+        meta = {
+            "version": self.version,
+            "definitions": FEATURE_DEFINITIONS,
+            "nights": nights,
+            "refreshed_at": datetime.now().isoformat(),
+        }
+        with open(f"{self.path_meta}.tmp", "w") as json_file:
+            json.dump(meta, json_file)
+        os.replace(f"{self.path_meta}.tmp", self.path_meta)
+
+
+if __name__ == "__main__":
+    store = FeatureStore(club="berghain")
+    store.refresh()
+    print(store.read(labeled=True).tail())
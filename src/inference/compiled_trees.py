@@ -0,0 +1,273 @@
+import json
+from typing import List, Union
+
+import numpy as np
+import pandas as pd
+
+from src.inference.feature_schema import FeatureSchema
+
+COMPILED_FILENAME = "compiled.npz"
+COMPILED_FORMAT = 1
+# Largest difference to the original model allowed by the parity check
+PARITY_TOLERANCE = 1e-5
+
+
+class CompiledTreeEnsemble:
+    """
+    Tree ensemble evaluated with NumPy only, for fast predictions without loading XGBoost or scikit-learn.
+
+    The nodes of all the trees are stored in flat arrays. A prediction moves every (row, tree) pair one level down per
+    step, all at once, until all of them are on a leaf (leaves point to themselves). The feature scaling of the model
+    artifact is part of it, so it takes the same raw features.
+
+    Supported are XGBoost regressors with the squared error objective and random forest regressors, with or without a
+    StandardScaler in front.
+    """
+
+    def __init__(
+        self,
+        schema: FeatureSchema,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        default_left: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        max_depth: int,
+        comparison: str,
+        aggregation: str,
+        base_score: float = 0.0,
+        mean: np.ndarray = None,
+        scale: np.ndarray = None,
+    ):
+        """
+        Args:
+            schema: features of the model
+            feature, threshold, left, right, default_left, value: per node, the feature of the split, its threshold,
+                the children (the node itself for leaves), the side taken by missing values and the leaf value
+            roots: first node of every tree
+            max_depth: number of steps from a root to the deepest leaf
+            comparison: "<" (XGBoost) or "<=" (scikit-learn), true means going to the left child
+            aggregation: "sum" (boosting, plus base_score) or "mean" (random forest) of the leaf values of the trees
+            base_score: added to the sum of the leaf values
+            mean, scale: feature scaling applied before the trees, (x - mean) / scale, None for none
+        """
+        self.schema = schema
+        self.feature = feature.astype(np.int32)
+        self.threshold = threshold.astype(np.float64)
+        self.left = left.astype(np.int32)
+        self.right = right.astype(np.int32)
+        self.default_left = default_left.astype(bool)
+        self.value = value.astype(np.float64)
+        self.roots = roots.astype(np.int32)
+        self.max_depth = int(max_depth)
+        self.comparison = comparison
+        self.aggregation = aggregation
+        self.base_score = float(base_score)
+        self.mean = mean
+        self.scale = scale
+
+    @property
+    def features(self) -> List[str]:
+        return self.schema.features
+
+    def predict(self, X: Union[pd.DataFrame, dict, list]) -> np.ndarray:
+        """Predicts the rows of X, with the same inputs as ModelArtifact.predict"""
+        X = self.schema.validate(X)
+        if self.mean is not None:
+            X = (X - self.mean) / self.scale
+        # Both libraries compare the features as float32
+        X = X.astype(np.float32)
+
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.max_depth):
+            values = X[rows, self.feature[nodes]]
+            if self.comparison == "<":
+                go_left = values < self.threshold[nodes]
+            else:
+                go_left = values <= self.threshold[nodes]
+            go_left = np.where(np.isnan(values), self.default_left[nodes], go_left)
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        leaf_values = self.value[nodes]
+        if self.aggregation == "sum":
+            return (leaf_values.sum(axis=1) + self.base_score).astype(np.float32)
+        return leaf_values.mean(axis=1)
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            format=COMPILED_FORMAT,
+            schema=json.dumps(self.schema.to_dict()),
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            default_left=self.default_left,
+            value=self.value,
+            roots=self.roots,
+            max_depth=self.max_depth,
+            comparison=self.comparison,
+            aggregation=self.aggregation,
+            base_score=self.base_score,
+            **({} if self.mean is None else {"mean": self.mean, "scale": self.scale}),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledTreeEnsemble":
+        with np.load(path, allow_pickle=False) as content:
+            if int(content["format"]) != COMPILED_FORMAT:
+                raise ValueError(f"Unknown format {int(content['format'])} of the compiled model {path}")
+            return cls(
+                schema=FeatureSchema.from_dict(json.loads(str(content["schema"]))),
+                feature=content["feature"],
+                threshold=content["threshold"],
+                left=content["left"],
+                right=content["right"],
+                default_left=content["default_left"],
+                value=content["value"],
+                roots=content["roots"],
+                max_depth=int(content["max_depth"]),
+                comparison=str(content["comparison"]),
+                aggregation=str(content["aggregation"]),
+                base_score=float(content["base_score"]),
+                mean=content["mean"] if "mean" in content else None,
+                scale=content["scale"] if "scale" in content else None,
+            )
+
+    def check_parity(self, reference, X: pd.DataFrame, tolerance: float = PARITY_TOLERANCE) -> float:
+        """
+        Compares the predictions with the ones of the original model, on the rows of X and, if the original model
+        accepts missing values, on copies of them with each feature missing in turn.
+
+        Args:
+            reference: original model, with the same predict interface (e.g. the ModelArtifact it was compiled from)
+            X: rows with the features
+            tolerance: largest allowed absolute difference
+
+        Returns:
+            max_difference: largest absolute difference between the predictions
+
+        Raises:
+            ValueError: if the difference is above the tolerance
+        """
+        X = X[self.features].astype(float)
+        max_difference = float(np.max(np.abs(self.predict(X) - reference.predict(X)), initial=0.0))
+
+        X_missing = pd.concat([X.assign(**{feature: np.nan}) for feature in self.features], ignore_index=True)
+        try:
+            reference_missing = reference.predict(X_missing)
+        except ValueError:
+            # The model does not accept missing values, so it is never given any
+            pass
+        else:
+            difference = float(np.max(np.abs(self.predict(X_missing) - reference_missing), initial=0.0))
+            max_difference = max(max_difference, difference)
+
+        if not max_difference <= tolerance:
+            raise ValueError(f"The compiled model differs from the original one by up to {max_difference}")
+        return max_difference
+
+
+def _depth(left: np.ndarray, right: np.ndarray, root: int) -> int:
+    depth, level = 0, np.array([root])
+    while True:
+        level = level[left[level] != level]
+        if len(level) == 0:
+            return depth
+        level = np.concatenate([left[level], right[level]])
+        depth += 1
+
+
+def _xgboost_trees(booster) -> dict:
+    model = json.loads(booster.save_raw(raw_format="json"))["learner"]
+    if model["objective"]["name"] != "reg:squarederror":
+        raise TypeError(f"Objective {model['objective']['name']} is not supported")
+    if model["gradient_booster"]["name"] != "gbtree":
+        raise TypeError(f"Booster {model['gradient_booster']['name']} is not supported")
+
+    trees = model["gradient_booster"]["model"]["trees"]
+    if any(any(tree.get("split_type", [])) for tree in trees):
+        raise TypeError("Categorical splits are not supported")
+
+    nodes = {"feature": [], "threshold": [], "left": [], "right": [], "default_left": [], "value": [], "roots": []}
+    offset = 0
+    for tree in trees:
+        left = np.array(tree["left_children"])
+        is_leaf = left == -1
+        index = np.arange(len(left)) + offset
+        conditions = np.array(tree["split_conditions"], dtype=np.float32).astype(np.float64)
+
+        nodes["roots"].append(offset)
+        nodes["feature"].append(np.where(is_leaf, 0, tree["split_indices"]))
+        # XGBoost stores the leaf values in the split conditions
+        nodes["threshold"].append(np.where(is_leaf, 0.0, conditions))
+        nodes["value"].append(np.where(is_leaf, conditions, 0.0))
+        nodes["left"].append(np.where(is_leaf, index, left + offset))
+        nodes["right"].append(np.where(is_leaf, index, np.array(tree["right_children"]) + offset))
+        nodes["default_left"].append(np.array(tree["default_left"], dtype=bool))
+        offset += len(left)
+
+    nodes = {key: np.concatenate(value) if key != "roots" else np.array(value) for key, value in nodes.items()}
+    # Written as "[5E-1]" by the newer versions of XGBoost
+    base_score = float(model["learner_model_param"]["base_score"].strip("[]"))
+    return {**nodes, "comparison": "<", "aggregation": "sum", "base_score": base_score}
+
+
+def _forest_trees(forest) -> dict:
+    nodes = {"feature": [], "threshold": [], "left": [], "right": [], "default_left": [], "value": [], "roots": []}
+    offset = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+        index = np.arange(tree.node_count) + offset
+
+        nodes["roots"].append(offset)
+        nodes["feature"].append(np.where(is_leaf, 0, tree.feature))
+        nodes["threshold"].append(np.where(is_leaf, 0.0, tree.threshold))
+        nodes["value"].append(np.where(is_leaf, tree.value[:, 0, 0], 0.0))
+        nodes["left"].append(np.where(is_leaf, index, tree.children_left + offset))
+        nodes["right"].append(np.where(is_leaf, index, tree.children_right + offset))
+        # Only set by the versions of scikit-learn that accept missing values
+        missing_go_to_left = getattr(tree, "missing_go_to_left", np.ones(tree.node_count))
+        nodes["default_left"].append(np.asarray(missing_go_to_left, dtype=bool))
+        offset += tree.node_count
+
+    nodes = {key: np.concatenate(value) if key != "roots" else np.array(value) for key, value in nodes.items()}
+    return {**nodes, "comparison": "<=", "aggregation": "mean"}
+
+
+def compile_artifact(artifact) -> CompiledTreeEnsemble:
+    """
+    Compiles the model of an artifact (see model_artifact).
+
+    Raises:
+        TypeError: if the model or its feature transform is not supported
+    """
+    import xgboost as xgb
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.preprocessing import StandardScaler
+
+    steps = [step for _, step in artifact.pipeline.steps]
+    estimator, transforms = steps[-1], steps[:-1]
+
+    mean, scale = None, None
+    if transforms:
+        if len(transforms) > 1 or not isinstance(transforms[0], StandardScaler):
+            raise TypeError(f"Feature transform {[type(step).__name__ for step in transforms]} is not supported")
+        n_features = len(artifact.features)
+        mean = transforms[0].mean_ if transforms[0].mean_ is not None else np.zeros(n_features)
+        scale = transforms[0].scale_ if transforms[0].scale_ is not None else np.ones(n_features)
+
+    if isinstance(estimator, (xgb.Booster, xgb.XGBRegressor)):
+        booster = estimator.get_booster() if isinstance(estimator, xgb.XGBRegressor) else estimator
+        trees = _xgboost_trees(booster)
+    elif isinstance(estimator, RandomForestRegressor):
+        trees = _forest_trees(estimator)
+    else:
+        raise TypeError(f"Model {type(estimator).__name__} is not supported")
+
+    max_depth = max(_depth(trees["left"], trees["right"], root) for root in trees["roots"])
+    return CompiledTreeEnsemble(artifact.schema, max_depth=max_depth, mean=mean, scale=scale, **trees)
@@ -0,0 +1,69 @@
+import numbers
+from typing import List, Union
+
+import numpy as np
+import pandas as pd
+
+
+class FeatureSchema:
+    """
+    Names and order of the input features of a model.
+
+    Every input is checked against it before a prediction: all the features must be present and numeric, and they are
+    put in the order the model was trained on, whatever the order of the input.
+    """
+
+    def __init__(self, features: List[str], dtype: str = "float64"):
+        self.features = list(features)
+        self.dtype = np.dtype(dtype)
+
+    def to_dict(self) -> dict:
+        return {"features": self.features, "dtype": self.dtype.name}
+
+    @classmethod
+    def from_dict(cls, schema: dict) -> "FeatureSchema":
+        return cls(schema["features"], schema.get("dtype", "float64"))
+
+    def validate(self, X: Union[pd.DataFrame, dict, list]) -> np.ndarray:
+        """
+        Returns the feature matrix of the input, with the columns in the order of the schema.
+
+        Args:
+            X: DataFrame with (at least) the features as columns, a dict of feature -> value for a single row or a
+                list of such dicts
+
+        Returns:
+            X: array of shape (rows, features)
+        """
+        if isinstance(X, dict):
+            # Single row, e.g. a prediction of the bot, read without building a DataFrame
+            missing = [feature for feature in self.features if feature not in X]
+            if missing:
+                raise ValueError(f"Missing features {missing}, the model expects {self.features}")
+            not_numeric = [
+                feature for feature in self.features if not (X[feature] is None or isinstance(X[feature], numbers.Real))
+            ]
+            if not_numeric:
+                raise TypeError(f"Features {not_numeric} are not numeric")
+            row = [np.nan if X[feature] is None else X[feature] for feature in self.features]
+            return np.array([row], dtype=self.dtype)
+
+        if isinstance(X, list):
+            X = pd.DataFrame.from_records(X)
+
+        missing = [feature for feature in self.features if feature not in X.columns]
+        if missing:
+            raise ValueError(f"Missing features {missing}, the model expects {self.features}")
+
+        X = X[self.features]
+        # None is read as object, it is a missing value like NaN
+        X = X.infer_objects()
+        not_numeric = [
+            feature
+            for feature, dtype in X.dtypes.items()
+            if not (pd.api.types.is_numeric_dtype(dtype) or X[feature].isna().all())
+        ]
+        if not_numeric:
+            raise TypeError(f"Features {not_numeric} are not numeric")
+
+        return X.to_numpy(dtype=self.dtype, na_value=np.nan)
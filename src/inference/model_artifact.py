@@ -0,0 +1,84 @@
+import os
+from typing import List, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+
+from src.inference.feature_schema import FeatureSchema
+from src.inference.model_backends import ModelBackend, XGBoostBackend, get_backend, get_backend_by_name
+
+ARTIFACT_FORMAT = 2
+
+
+class ModelArtifact:
+    """
+    A trained model together with its feature transform (e.g. the scaler) and its feature schema.
+
+    The artifact is saved by the trainer and loaded as a whole by the predictor, so the features are transformed
+    exactly the same way in training and inference. The transform and the schema are saved in the artifact file, the
+    model next to it in the native format of its backend (see model_backends).
+    """
+
+    def __init__(self, pipeline: Pipeline, schema: FeatureSchema, backend: ModelBackend = None):
+        self.pipeline = pipeline
+        self.schema = schema
+        self.backend = backend if backend is not None else get_backend(self.estimator)
+
+    @classmethod
+    def from_estimator(cls, estimator, features: List[str], transform=None) -> "ModelArtifact":
+        """
+        Args:
+            estimator: fitted estimator
+            features: features of the estimator, in the order of its input
+            transform: fitted feature transform applied before the estimator (e.g. a StandardScaler), None for none
+        """
+        steps = ([("transform", transform)] if transform is not None else []) + [("model", estimator)]
+        return cls(Pipeline(steps), FeatureSchema(features))
+
+    @property
+    def features(self) -> List[str]:
+        return self.schema.features
+
+    @property
+    def estimator(self):
+        return self.pipeline.steps[-1][1]
+
+    def predict(self, X: Union[pd.DataFrame, dict, list]) -> np.ndarray:
+        """Validates and orders the features, transforms them and runs the model. See FeatureSchema.validate"""
+        X = self.schema.validate(X)
+        # Same as Pipeline.predict, without its checks on every call
+        for _, step in self.pipeline.steps[:-1]:
+            X = step.transform(X)
+        return self.backend.predict(self.estimator, X)
+
+    def save(self, path: str):
+        self.backend.save(self.estimator, os.path.join(os.path.dirname(path), self.backend.filename))
+        content = {
+            "format": ARTIFACT_FORMAT,
+            "schema": self.schema.to_dict(),
+            "transform": self.pipeline.steps[:-1],
+            "backend": self.backend.name,
+        }
+        joblib.dump(content, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ModelArtifact":
+        content = joblib.load(path)
+        if content.get("format") == 1:
+            # Whole pipeline pickled in the artifact
+            return cls(content["pipeline"], FeatureSchema.from_dict(content["schema"]))
+        if content.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(f"Unknown format {content.get('format')} of the model artifact {path}")
+
+        backend = get_backend_by_name(content["backend"])
+        estimator = backend.load(os.path.join(os.path.dirname(path), backend.filename))
+        pipeline = Pipeline(content["transform"] + [("model", estimator)])
+        return cls(pipeline, FeatureSchema.from_dict(content["schema"]), backend)
+
+    @classmethod
+    def from_booster(cls, path: str, features: List[str]) -> "ModelArtifact":
+        """Wraps a booster saved without transform, the features are used as they are"""
+        backend = XGBoostBackend()
+        return cls(Pipeline([("model", backend.load(path))]), FeatureSchema(features), backend)
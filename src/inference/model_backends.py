@@ -0,0 +1,99 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+import joblib
+import numpy as np
+import xgboost as xgb
+from sklearn.base import BaseEstimator
+
+
+class ModelBackend(ABC):
+    """
+    Saving, loading and predicting of one family of estimators, in its native format.
+
+    The loaded model is whatever is fastest to predict with for the family, not necessarily the estimator that was
+    saved (e.g. a bare Booster for an XGBRegressor).
+    """
+
+    name = None
+    filename = None
+
+    @abstractmethod
+    def handles(self, estimator) -> bool:
+        """Whether the estimator belongs to the family of the backend"""
+
+    @abstractmethod
+    def save(self, estimator, path: str):
+        """Saves the estimator to path, in the native format of the family"""
+
+    @abstractmethod
+    def load(self, path: str):
+        """Loads the model saved to path"""
+
+    @abstractmethod
+    def predict(self, model, X: np.ndarray) -> np.ndarray:
+        """Predicts all the rows of X in one call"""
+
+
+class XGBoostBackend(ModelBackend):
+    """XGBoost models, saved as UBJSON and predicted in place, without building a DMatrix"""
+
+    name = "xgboost"
+    filename = "model.ubj"
+
+    def handles(self, estimator) -> bool:
+        return isinstance(estimator, (xgb.XGBModel, xgb.Booster))
+
+    def save(self, estimator, path: str):
+        booster = estimator.get_booster() if isinstance(estimator, xgb.XGBModel) else estimator
+        booster.save_model(path)
+
+    def load(self, path: str) -> xgb.Booster:
+        booster = xgb.Booster()
+        booster.load_model(path)
+        return booster
+
+    def predict(self, model, X: np.ndarray) -> np.ndarray:
+        # The estimator itself before the model is saved, the booster once it is loaded
+        booster = model.get_booster() if isinstance(model, xgb.XGBModel) else model
+        return booster.inplace_predict(X)
+
+
+class SklearnBackend(ModelBackend):
+    """
+    Other scikit-learn estimators (random forest, KNN), saved uncompressed with joblib so that their arrays are memory
+    mapped on load instead of copied
+    """
+
+    name = "sklearn"
+    filename = "estimator.joblib"
+
+    def handles(self, estimator) -> bool:
+        return isinstance(estimator, BaseEstimator)
+
+    def save(self, estimator, path: str):
+        joblib.dump(estimator, path)
+
+    def load(self, path: str) -> BaseEstimator:
+        return joblib.load(path, mmap_mode="r")
+
+    def predict(self, model: BaseEstimator, X: np.ndarray) -> np.ndarray:
+        return model.predict(X)
+
+
+# Checked in order, the first backend that handles an estimator is used
+BACKENDS: List[ModelBackend] = [XGBoostBackend(), SklearnBackend()]
+
+
+def get_backend(estimator) -> ModelBackend:
+    for backend in BACKENDS:
+        if backend.handles(estimator):
+            return backend
+    raise TypeError(f"No model backend for {type(estimator).__name__}")
+
+
+def get_backend_by_name(name: str) -> ModelBackend:
+    for backend in BACKENDS:
+        if backend.name == name:
+            return backend
+    raise ValueError(f"Unknown model backend {name}")
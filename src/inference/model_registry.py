@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from glob import glob
+from typing import TYPE_CHECKING, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.inference.compiled_trees import COMPILED_FILENAME, CompiledTreeEnsemble, compile_artifact
+
+if TYPE_CHECKING:
+    # Imported when a model is loaded, it brings in scikit-learn and XGBoost
+    from src.inference.model_artifact import ModelArtifact
+
+ARTIFACT_FILENAME = "model.joblib"
+# Bare booster of the versions saved before the artifacts
+MODEL_FILENAME = "xgboost_model.model"
+CURRENT_FILENAME = "CURRENT"
+# Minimum time between two checks of the current pointer of a club [s]
+CHECK_INTERVAL = 30
+
+# Registries of the current process, keyed on the models folder
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+class LoadedModel:
+    """A model version in memory, together with its features and metadata"""
+
+    def __init__(self, club: str, version: str, model: Union["ModelArtifact", CompiledTreeEnsemble], metadata: dict):
+        self.club = club
+        self.version = version
+        self.model = model
+        self.metadata = metadata
+        self.features = model.features
+
+    @property
+    def compiled(self) -> bool:
+        return isinstance(self.model, CompiledTreeEnsemble)
+
+    def predict(self, X) -> np.ndarray:
+        """Predicts the rows of X, a DataFrame or dicts with the features. See ModelArtifact.predict"""
+        return self.model.predict(X)
+
+
+def hash_training_data(data: pd.DataFrame) -> str:
+    """Content hash of the training data, stored with the model to know what it was trained on"""
+    return hashlib.sha256(pd.util.hash_pandas_object(data, index=False).values.tobytes()).hexdigest()
+
+
+class ModelRegistry:
+    """
+    Versions of the trained models of each club, with an explicit pointer to the current one.
+
+    Every version is a folder `models/<club>/<version>/` with the model artifact (feature transform, model and feature
+    schema) and `metadata.json` (features, metrics, hash of the training data). The file `models/<club>/CURRENT` holds
+    the name of the version in use, it is replaced atomically, so readers see either the old or the new version.
+    Folders without metadata (trained before the registry existed) are still loaded, and without a pointer the newest
+    version is used.
+
+    When the model can be compiled (see compiled_trees), the compiled copy is saved too and served instead of the
+    original, which is then never loaded.
+
+    The models are loaded on first use and kept in memory per club. `get` checks the pointer at most every
+    `check_interval` seconds and swaps in the new version once it is loaded, so a retrained model is picked up without
+    a restart.
+    """
+
+    def __init__(self, root: str = "models", check_interval: float = CHECK_INTERVAL, use_compiled: bool = True):
+        self.root = root
+        self.check_interval = check_interval
+        self.use_compiled = use_compiled
+
+        self._models = {}
+        self._last_check = {}
+        self._lock = threading.Lock()
+        self._club_locks = {}
+
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def club_path(self, club: str) -> str:
+        return os.path.join(self.root, club)
+
+    def model_path(self, club: str, version: str) -> Optional[str]:
+        """Returns the path of the artifact of a version, or of its booster if it has none. None if it has neither"""
+        for filename in (ARTIFACT_FILENAME, MODEL_FILENAME):
+            path = os.path.join(self.club_path(club), version, filename)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def versions(self, club: str) -> List[str]:
+        """Returns the versions of a club, sorted from the oldest to the newest"""
+        paths = glob(os.path.join(self.club_path(club), "*", ARTIFACT_FILENAME))
+        paths += glob(os.path.join(self.club_path(club), "*", MODEL_FILENAME))
+        return sorted({os.path.basename(os.path.dirname(path)) for path in paths})
+
+    def current_version(self, club: str) -> Optional[str]:
+        """Returns the version the pointer is set to, else the newest version, None if the club has no model"""
+        path_current = os.path.join(self.club_path(club), CURRENT_FILENAME)
+        if os.path.exists(path_current):
+            with open(path_current, "r") as current_file:
+                version = current_file.read().strip()
+            if self.model_path(club, version) is not None:
+                return version
+            print(f"The current model of {club} ({version}) does not exist, using the newest one")
+
+        versions = self.versions(club)
+        return versions[-1] if versions else None
+
+    def set_current(self, club: str, version: str):
+        """Points the club to a version, e.g. to roll back"""
+        if self.model_path(club, version) is None:
+            raise FileNotFoundError(f"No model {version} for {club}")
+
+        path_current = os.path.join(self.club_path(club), CURRENT_FILENAME)
+        with open(f"{path_current}.tmp", "w") as current_file:
+            current_file.write(version)
+        os.replace(f"{path_current}.tmp", path_current)
+
+    def register(
+        self,
+        club: str,
+        model,
+        features: List[str],
+        metrics: dict = None,
+        training_data: pd.DataFrame = None,
+        set_current: bool = True,
+        transform=None,
+        export_compiled: bool = True,
+    ) -> str:
+        """
+        Saves a trained model as a new version, in the native format of its family (see model_backends).
+
+        Args:
+            club: name of the club
+            model: fitted estimator
+            features: features of the model, in the order of its input
+            metrics: evaluation metrics to keep with the model
+            training_data: data the model was trained on, its hash is stored and the compiled model is checked on it
+            set_current: whether the new version becomes the current one
+            transform: fitted feature transform the model was trained after (e.g. a StandardScaler), None for none
+            export_compiled: whether to also save the compiled model, if it is supported and the training data is given
+
+        Returns:
+            version: name of the new version
+        """
+        from src.inference.model_artifact import ModelArtifact
+
+        version = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        path_version = os.path.join(self.club_path(club), version)
+        os.makedirs(path_version, exist_ok=True)
+
+        artifact = ModelArtifact.from_estimator(model, features, transform)
+        artifact.save(os.path.join(path_version, ARTIFACT_FILENAME))
+        # Still written on its own for the tools that read it
+        with open(os.path.join(path_version, "features.json"), "w") as json_file:
+            json.dump(features, json_file)
+
+        parity = None
+        if export_compiled and training_data is not None:
+            parity = self.export_compiled(artifact, path_version, training_data)
+
+        metadata = {
+            "version": version,
+            "created_at": datetime.now().isoformat(),
+            "features": features,
+            "schema": artifact.schema.to_dict(),
+            "pipeline": [type(step).__name__ for _, step in artifact.pipeline.steps],
+            "backend": artifact.backend.name,
+            "compiled": parity is not None,
+            "compiled_max_difference": parity,
+            "metrics": metrics or {},
+            "training_data_hash": None if training_data is None else hash_training_data(training_data),
+            "training_rows": None if training_data is None else len(training_data),
+        }
+        with open(os.path.join(path_version, "metadata.json"), "w") as json_file:
+            json.dump(metadata, json_file, indent=2)
+
+        if set_current:
+            self.set_current(club, version)
+        return version
+
+    @staticmethod
+    def export_compiled(artifact: "ModelArtifact", path_version: str, check_data: pd.DataFrame) -> Optional[float]:
+        """
+        Compiles the model and saves it if its predictions match the ones of the artifact on the check data.
+
+        Returns:
+            max_difference: largest difference of the predictions on the check data, None if it was not saved
+        """
+        try:
+            compiled = compile_artifact(artifact)
+            max_difference = compiled.check_parity(artifact, check_data)
+        except (TypeError, ValueError) as e:
+            print(f"The model is served without compiling it: {e}")
+            return None
+
+        compiled.save(os.path.join(path_version, COMPILED_FILENAME))
+        return max_difference
+
+    def metadata(self, club: str, version: str) -> dict:
+        path_version = os.path.join(self.club_path(club), version)
+        path_metadata = os.path.join(path_version, "metadata.json")
+        if os.path.exists(path_metadata):
+            with open(path_metadata, "r") as json_file:
+                return json.load(json_file)
+
+        with open(os.path.join(path_version, "features.json"), "r") as json_file:
+            return {"version": version, "features": json.load(json_file), "metrics": {}, "training_data_hash": None}
+
+    def load(self, club: str, version: str = None) -> Optional[LoadedModel]:
+        """Loads a version of the club's model, the current one by default. Returns None if there is no model"""
+        version = version or self.current_version(club)
+        if version is None:
+            return None
+
+        metadata = self.metadata(club, version)
+        path_compiled = os.path.join(self.club_path(club), version, COMPILED_FILENAME)
+        if self.use_compiled and os.path.exists(path_compiled):
+            return LoadedModel(club, version, CompiledTreeEnsemble.load(path_compiled), metadata)
+
+        # Loads XGBoost and scikit-learn, only needed for the models that are not compiled
+        from src.inference.model_artifact import ModelArtifact
+
+        path_model = self.model_path(club, version)
+        if path_model.endswith(ARTIFACT_FILENAME):
+            model = ModelArtifact.load(path_model)
+        else:
+            model = ModelArtifact.from_booster(path_model, metadata["features"])
+        return LoadedModel(club, version, model, metadata)
+
+    def _club_lock(self, club: str) -> threading.Lock:
+        with self._lock:
+            return self._club_locks.setdefault(club, threading.Lock())
+
+    def get(self, club: str) -> Optional[LoadedModel]:
+        """
+        Returns the current model of the club, loading it on first use and swapping it when the pointer changed.
+        Returns None if the club has no model.
+        """
+        loaded = self._models.get(club)
+        if loaded is not None and time.monotonic() - self._last_check.get(club, 0) < self.check_interval:
+            return loaded
+
+        # Only one thread loads the model of a club, the others keep being served the resident one
+        club_lock = self._club_lock(club)
+        if loaded is not None and not club_lock.acquire(blocking=False):
+            return loaded
+        if loaded is None:
+            club_lock.acquire()
+
+        try:
+            self._last_check[club] = time.monotonic()
+            loaded = self._models.get(club)
+            version = self.current_version(club)
+            if version is None:
+                if loaded is None:
+                    print(f"No model found for {club} in {self.club_path(club)}")
+                return loaded
+
+            if loaded is None or loaded.version != version:
+                new_model = self.load(club, version)
+                if loaded is not None:
+                    print(f"Swapping the model of {club}: {loaded.version} -> {version}")
+                # Replacing the reference is atomic, running predictions keep the model they started with
+                self._models[club] = new_model
+                loaded = new_model
+            return loaded
+        except Exception as e:
+            print(f"Could not load the model of {club}: {e}")
+            return self._models.get(club)
+        finally:
+            club_lock.release()
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            for club in list(self._models):
+                self._last_check[club] = 0
+                self.get(club)
+
+    def start_watching(self, interval: float = CHECK_INTERVAL):
+        """Checks the resident clubs for new versions in the background, so that requests never wait for a load"""
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+
+def get_model_registry(root: str = "models") -> ModelRegistry:
+    """Returns the registry of the process for the models folder, so that the resident models are shared"""
+    with _registries_lock:
+        if root not in _registries:
+            _registries[root] = ModelRegistry(root)
+        return _registries[root]
@@ -1,63 +1,129 @@
-import os
-from datetime import datetime
-from glob import glob
+from datetime import datetime, timedelta
+from typing import List, Optional
 
 import numpy as np
-import json
-import xgboost as xgb
+import pandas as pd
 
-from src.utils.bh_data_parser import BHParser
-from src.utils.metadata_utils import get_weather_data
+from src.features.feature_store import FeatureStore
+from src.inference.model_registry import LoadedModel, ModelRegistry, get_model_registry
+from src.utils.follower_store import FollowerStore
 
 
 class Predictor:
-    def __init__(self, club_name):
+    def __init__(self, club_name, registry: ModelRegistry = None):
         self.club_name = club_name
-        self.model = self.load_model()
-
-    def load_model(self):
-        path = f"models/{self.club_name}/*"
-        model_paths = glob(os.path.join(path))
-
-        model_paths.sort()
-        model_dir = model_paths[-1]
-        model_path = os.path.join(model_dir, "xgboost_model.model")
-
-        # Load the XGBoost model
-        model = xgb.Booster()
-        model.load_model(model_path)
-
-        with open(os.path.join(model_dir, "features.json"), "r") as json_file:
-            self.required_features = json.load(json_file)
-
-        return model
+        # The model is loaded on first use and swapped when a new version becomes current
+        self.registry = registry if registry is not None else get_model_registry()
+
+        # Same precomputed rows as the training data
+        self.feature_store = FeatureStore(club=club_name)
+        self.follower_store = FollowerStore.for_club(club_name)
+
+    @property
+    def bh_parser(self):
+        """
+        Parser of the feature store, created on first use since it is only needed to scrape missing data. Kept for the
+        lifetime of the predictor, so that the in-memory follower cache is reused between calls
+        """
+        return self.feature_store.parser
+
+    def load_model(self) -> Optional[LoadedModel]:
+        """Returns the current model of the club, None if there is none"""
+        return self.registry.get(self.club_name)
+
+    @property
+    def model(self):
+        """Model artifact of the current version, or its compiled copy. None if there is no model"""
+        loaded = self.load_model()
+        return None if loaded is None else loaded.model
+
+    @property
+    def required_features(self) -> List[str]:
+        loaded = self.load_model()
+        return [] if loaded is None else loaded.features
 
     # Predict using the loaded model
     def predict(self, date):
-        features, artists_data = self.get_features_at_date(date)
-        if features["features_matrix"]:
-            predictions = self.model.predict(features["features_matrix"])
+        # The same version is used for the whole prediction, even if it is swapped in the meantime
+        loaded = self.load_model()
+        if loaded is None:
+            return None, None, None
+
+        features, artists_data = self.get_features_at_date(date, loaded.features)
+        if features is not None:
+            # Same feature schema, order and transform as in training
+            predictions = loaded.predict(features["features_dict"])
             return predictions, features, artists_data
         else:
             return None, None, None
 
-    def get_features_at_date(self, date):
-        bh_parser = BHParser(club_name="Berghain", club_page_url="https://www.berghain.berlin/en/program/archive")
-
+    def predict_many(self, dates) -> pd.DataFrame:
+        """
+        Predicts many dates at once.
+
+        The follower data of the missing months is scraped once per month, the features of all the nights are
+        computed in bulk by the feature store and the model is run once on a single feature matrix.
+
+        Args:
+            dates: dates to predict, each one is the prediction for the night before
+
+        Returns:
+            predictions: one row per date with the night, the predicted hours (NaN for nights without lineup) and the
+                features
+        """
+        loaded = self.load_model()
+        dates = sorted(set(dates))
+        if not dates:
+            return pd.DataFrame(columns=["date", "night", "predicted_hours"] + list(self.required_features))
+        nights = [self.feature_store.night_for_date(date) for date in dates]
+
+        months = sorted({(night.year, night.month) for night in nights})
+        missing_months = [month for month in months if not self.follower_store.has_month(*month)]
+        if missing_months:
+            self.bh_parser.migrate_csv_data()
+            missing_months = [month for month in missing_months if not self.follower_store.has_month(*month)]
+        for year, month in missing_months:
+            self.bh_parser.extract_and_save_month(year, month)
+
+        self.feature_store.refresh(start_date=nights[0], end_date=nights[-1], labels=False)
+        features = self.feature_store.read(start_date=nights[0], end_date=nights[-1])
+
+        predictions = pd.DataFrame({"date": dates, "night": nights})
+        predictions = predictions.merge(features, on="night", how="left")
+
+        has_lineup = predictions.followers.notna().to_numpy()
+        predictions["predicted_hours"] = np.nan
+        if has_lineup.any() and loaded is not None:
+            predictions.loc[has_lineup, "predicted_hours"] = loaded.predict(predictions.loc[has_lineup])
+
+        columns = ["date", "night", "predicted_hours"]
+        return predictions[columns + [column for column in predictions.columns if column not in columns]]
+
+    def predict_range(self, start_date, end_date) -> pd.DataFrame:
+        """Predicts all the dates between start_date and end_date, both included. See predict_many"""
+        dates = [start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+        return self.predict_many(dates)
+
+    def get_features_at_date(self, date, required_features: List[str] = None):
+        required_features = self.required_features if required_features is None else required_features
         features = {}
-        features_dict = {}
-
-        followers, artists_data = bh_parser.get_followers_at_date(date)
-        weather = get_weather_data(city="Berlin", start_date=date)
 
-        features_dict["followers"] = followers
-        features_dict["temperature"] = weather.temperature.min()
-        features_dict["precipitation"] = weather.precipitation.max()
-
-        features_matrix = np.array([features_dict[feature] for feature in features_dict if feature in self.required_features]).reshape(1, -1)
+        # The events are listed to start on the evening of the previous day
+        night = self.feature_store.night_for_date(date)
+        row = self.feature_store.get_night(night)
+        followers = None if row is None or pd.isna(row["followers"]) else row["followers"]
+        artists_data = self.follower_store.read(start_date=night, end_date=night)
+
+        features_dict = {
+            "followers": followers,
+            "temperature": row["temperature"] if row is not None else np.nan,
+            "precipitation": row["precipitation"] if row is not None else np.nan,
+        }
+        for feature in required_features:
+            if feature not in features_dict:
+                features_dict[feature] = row.get(feature, np.nan) if row is not None else np.nan
 
         if followers:
-            features["features_matrix"] = xgb.DMatrix(features_matrix)
             features["features_dict"] = features_dict
             return features, artists_data
         else:
@@ -69,3 +135,6 @@ if __name__ == "__main__":
 
     prediction, features, artists_data = pred.predict(datetime(2025, 3, 2).date())
     prediction, features, artists_data = pred.predict(datetime(2023, 8, 26).date())
+
+    predictions = pred.predict_range(datetime(2024, 1, 1).date(), datetime(2024, 12, 31).date())
+    print(predictions.dropna(subset=["predicted_hours"])[["date", "predicted_hours"]])
@@ -0,0 +1,162 @@
+import threading
+import time
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta
+from typing import Callable, List
+
+# Time a prediction is served from the cache before it is recomputed [s]
+PREDICTION_TTL = 15 * 60
+# Times of the day at which tonight's prediction is precomputed, before the doors open
+PRECOMPUTE_TIMES = ["12:00", "18:00", "22:00"]
+
+
+class PredictionService:
+    """
+    Serves the predictions of a night and their rendered replies from a cache.
+
+    - Predictions are cached per date for `ttl` seconds. Once expired, the cached one is still served while a single
+      background computation replaces it, so that replies never wait for scraping or inference if a value exists.
+    - Concurrent requests for a date that is not cached share one computation (single flight).
+    - A scheduler thread precomputes today's prediction at the given times of the day.
+    """
+
+    def __init__(
+        self,
+        predict_fun: Callable,
+        render_fun: Callable,
+        ttl: float = PREDICTION_TTL,
+        precompute_times: List[str] = None,
+    ):
+        """
+        Args:
+            predict_fun: function of a date returning (predicted_hours, features, artists_data)
+            render_fun: function of (predicted_hours, features, artists_data) returning the text of the reply
+            ttl: time to live of the cached predictions [s]
+            precompute_times: times of the day ("HH:MM") at which today's prediction is recomputed by the scheduler
+        """
+        self.predict_fun = predict_fun
+        self.render_fun = render_fun
+        self.ttl = ttl
+        self.precompute_times = PRECOMPUTE_TIMES if precompute_times is None else precompute_times
+
+        self._cache = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._scheduler = None
+
+    def compute(self, date_selected: date) -> dict:
+        predicted_hours, features, artists_data = self.predict_fun(date_selected)
+        return {
+            "date": date_selected,
+            "predicted_hours": predicted_hours,
+            "features": features,
+            "artists_data": artists_data,
+            "reply": self.render_fun(predicted_hours, features, artists_data),
+            "computed_at": time.time(),
+        }
+
+    def _start_computation(self, date_selected: date):
+        """
+        Returns the in-flight computation of the date, starting it if there is none.
+
+        Returns:
+            future: the computation
+            owner: whether the caller started it and has to run it
+        """
+        with self._lock:
+            future = self._in_flight.get(date_selected)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._in_flight[date_selected] = future
+            return future, True
+
+    def _run_computation(self, date_selected: date, future: Future):
+        try:
+            prediction = self.compute(date_selected)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[date_selected]
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._cache[date_selected] = prediction
+            del self._in_flight[date_selected]
+        future.set_result(prediction)
+
+    def refresh(self, date_selected: date = None) -> dict:
+        """Recomputes the prediction of the date, or waits for the computation that is already running"""
+        date_selected = date_selected or datetime.today().date()
+        future, owner = self._start_computation(date_selected)
+        if owner:
+            self._run_computation(date_selected, future)
+        return future.result()
+
+    def get(self, date_selected: date = None) -> dict:
+        """
+        Returns the prediction of the date (today by default), from the cache if possible.
+
+        Returns:
+            prediction: dictionary with the keys date, predicted_hours, features, artists_data, reply and computed_at
+        """
+        date_selected = date_selected or datetime.today().date()
+        with self._lock:
+            prediction = self._cache.get(date_selected)
+
+        if prediction is None:
+            return self.refresh(date_selected)
+
+        if time.time() - prediction["computed_at"] > self.ttl:
+            # The stale prediction is served while it is recomputed in the background
+            future, owner = self._start_computation(date_selected)
+            if owner:
+                threading.Thread(target=self._run_computation, args=(date_selected, future), daemon=True).start()
+        return prediction
+
+    def get_reply(self, date_selected: date = None) -> str:
+        return self.get(date_selected)["reply"]
+
+    def invalidate(self, date_selected: date = None):
+        with self._lock:
+            if date_selected is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(date_selected, None)
+
+    def seconds_until_next_precompute(self, now: datetime = None) -> float:
+        now = now or datetime.now()
+        candidates = []
+        for time_str in self.precompute_times:
+            hour, minute = map(int, time_str.split(":"))
+            scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if scheduled <= now:
+                scheduled += timedelta(days=1)
+            candidates.append(scheduled)
+        return (min(candidates) - now).total_seconds()
+
+    def _run_scheduler(self):
+        while not self._stop.wait(self.seconds_until_next_precompute()):
+            try:
+                self.refresh()
+                print(f"Precomputed the prediction of {datetime.today().date()}")
+            except Exception as e:
+                print(f"Error during the precomputation: {e}")
+
+    def start_scheduler(self, precompute_now: bool = True):
+        """Starts the thread precomputing today's prediction, optionally right away"""
+        if self._scheduler is not None:
+            return
+        self._stop.clear()
+        if precompute_now:
+            threading.Thread(target=self.refresh, daemon=True).start()
+        self._scheduler = threading.Thread(target=self._run_scheduler, daemon=True)
+        self._scheduler.start()
+
+    def stop_scheduler(self):
+        self._stop.set()
+        if self._scheduler is not None:
+            self._scheduler.join()
+            self._scheduler = None
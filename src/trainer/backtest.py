@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import List
+
+import matplotlib
+
+# Plots are only written to files, so that backtests run on machines without display
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import mean_absolute_error, mean_squared_error
+
+N_FOLDS = 5
+MIN_TRAIN_FRACTION = 0.5  # Part of the nights that is always in the training data of the first fold
+
+
+def rolling_origin_folds(nights: pd.Series, n_folds: int = N_FOLDS, min_train_fraction: float = MIN_TRAIN_FRACTION):
+    """
+    Splits the event nights in time-ordered folds with a rolling origin.
+
+    The nights after the first `min_train_fraction` of them are cut in n_folds consecutive test blocks. Every fold
+    trains on all the nights before its test block, so a model is never evaluated on nights older than the ones it
+    was trained on.
+
+    Args:
+        nights: date of each row
+        n_folds: number of folds
+        min_train_fraction: fraction of the nights in the training data of the first fold
+
+    Returns:
+        folds: list of (train indices, test indices) of the rows
+    """
+    unique_nights = np.sort(pd.unique(nights))
+    start_test = int(len(unique_nights) * min_train_fraction)
+    if len(unique_nights) - start_test < n_folds or start_test == 0:
+        raise ValueError(f"Not enough nights ({len(unique_nights)}) for {n_folds} folds")
+
+    nights = np.asarray(nights)
+    folds = []
+    for test_nights in np.array_split(unique_nights[start_test:], n_folds):
+        train_index = np.flatnonzero(nights < test_nights[0])
+        test_index = np.flatnonzero((nights >= test_nights[0]) & (nights <= test_nights[-1]))
+        folds.append((train_index, test_index))
+    return folds
+
+
+def _fit_fold(estimator, X: np.ndarray, y: np.ndarray, train_index: np.ndarray, test_index: np.ndarray):
+    """Fits the fold's model and predicts its test nights. Runs in the worker processes"""
+    model = clone(estimator)
+    model.fit(X[train_index], y[train_index])
+    return model.predict(X[test_index])
+
+
+class Backtester:
+    """
+    Rolling-origin backtest of a model over the event nights.
+
+    The fold models are fitted in parallel. The metrics of each fold, the predictions and a plot are written to
+    `output_dir`, so that runs can be compared without looking at a screen, e.g. in CI.
+    """
+
+    def __init__(
+        self,
+        estimator,
+        features: List[str],
+        target: str = "max_waiting_time",
+        n_folds: int = N_FOLDS,
+        min_train_fraction: float = MIN_TRAIN_FRACTION,
+        n_jobs: int = -1,
+    ):
+        """
+        Args:
+            estimator: scikit-learn compatible estimator, cloned for every fold
+            features: columns used as input, in this order
+            target: column to predict
+            n_folds: number of folds
+            min_train_fraction: fraction of the nights in the training data of the first fold
+            n_jobs: number of folds fitted in parallel, -1 for all the cores
+        """
+        self.estimator = estimator
+        self.features = features
+        self.target = target
+        self.n_folds = n_folds
+        self.min_train_fraction = min_train_fraction
+        self.n_jobs = n_jobs
+
+    def run(self, data: pd.DataFrame, output_dir: str = None, name: str = None) -> dict:
+        """
+        Backtests the estimator on the data.
+
+        Args:
+            data: one row per night with the column `date`, the features and the target
+            output_dir: folder the results are written to, nothing is written if not set
+            name: name of the run in the summary, by default the class of the estimator
+
+        Returns:
+            summary: metrics over all the folds, with the per fold metrics under `folds`
+        """
+        data = data.sort_values("date").reset_index(drop=True)
+        X = data[self.features].to_numpy(dtype=float)
+        y = data[self.target].to_numpy(dtype=float)
+        folds = rolling_origin_folds(data.date, self.n_folds, self.min_train_fraction)
+
+        fold_predictions = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_fold)(self.estimator, X, y, train_index, test_index) for train_index, test_index in folds
+        )
+
+        metrics, predictions = [], []
+        for fold, ((train_index, test_index), y_pred) in enumerate(zip(folds, fold_predictions)):
+            y_test = y[test_index]
+            metrics.append(
+                {
+                    "fold": fold,
+                    "train_nights": len(train_index),
+                    "test_nights": len(test_index),
+                    "train_end": str(data.date[train_index[-1]]),
+                    "test_start": str(data.date[test_index[0]]),
+                    "test_end": str(data.date[test_index[-1]]),
+                    "rmse": float(np.sqrt(mean_squared_error(y_test, y_pred))),
+                    "mae": float(mean_absolute_error(y_test, y_pred)),
+                }
+            )
+            predictions.append(
+                pd.DataFrame({"fold": fold, "date": data.date[test_index], "true": y_test, "predicted": y_pred})
+            )
+
+        metrics = pd.DataFrame(metrics)
+        predictions = pd.concat(predictions, ignore_index=True)
+        errors = predictions.predicted - predictions.true
+        summary = {
+            "name": name or type(self.estimator).__name__,
+            "features": self.features,
+            "target": self.target,
+            "nights": len(data),
+            "rmse": float(np.sqrt(np.mean(errors**2))),
+            "mae": float(np.mean(np.abs(errors))),
+            "rmse_mean_folds": float(metrics.rmse.mean()),
+            "rmse_std_folds": float(metrics.rmse.std(ddof=0)),
+            "folds": metrics.to_dict("records"),
+        }
+
+        if output_dir is not None:
+            self.save(output_dir, summary, metrics, predictions)
+        return summary
+
+    @staticmethod
+    def save(output_dir: str, summary: dict, metrics: pd.DataFrame, predictions: pd.DataFrame):
+        os.makedirs(output_dir, exist_ok=True)
+        metrics.to_csv(os.path.join(output_dir, "folds.csv"), index=False)
+        predictions.to_csv(os.path.join(output_dir, "predictions.csv"), index=False)
+        with open(os.path.join(output_dir, "summary.json"), "w") as json_file:
+            json.dump(summary, json_file, indent=2)
+
+        plt.style.use("ggplot")
+        fig, ax = plt.subplots(figsize=(12, 5))
+        ax.plot(predictions.date, predictions.true, ".", label="True")
+        for fold, fold_predictions in predictions.groupby("fold"):
+            ax.plot(fold_predictions.date, fold_predictions.predicted, label=f"Fold {fold}")
+        ax.set_ylabel("Max waiting time [h]")
+        ax.set_title(f"{summary['name']}: RMSE {summary['rmse'] * 60:.1f} minutes")
+        ax.legend()
+        fig.savefig(os.path.join(output_dir, "predictions.png"), bbox_inches="tight")
+        plt.close(fig)
+
+        print(f"Backtest of {summary['name']}: RMSE {summary['rmse'] * 60:.2f} minutes, written to {output_dir}")
+
+
+if __name__ == "__main__":
+    from src.trainer.train_model import Trainer
+
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the models, without display")
+    parser.add_argument("--club", type=str, default="berghain")
+    parser.add_argument("--models", type=str, nargs="+", default=["xgboost", "random_forest", "knn"])
+    parser.add_argument("--folds", type=int, default=N_FOLDS)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    args = parser.parse_args()
+
+    output_root = os.path.join("reports", "backtests", args.club, datetime.now().strftime("%Y_%m_%d_%H_%M"))
+    summaries = []
+    data = None
+    for model_name in args.models:
+        trainer = Trainer(metrics=["rmse"], loss="reg:squarederror", model=model_name, club=args.club)
+        data = trainer.load_data(refresh=data is None) if data is None else data
+        labeled = data[data.max_waiting_time != 0]
+
+        backtester = Backtester(trainer.model, trainer.features, n_folds=args.folds, n_jobs=args.n_jobs)
+        summaries.append(backtester.run(labeled, os.path.join(output_root, model_name), name=model_name))
+
+    comparison = pd.DataFrame(summaries)[["name", "nights", "rmse", "mae", "rmse_mean_folds", "rmse_std_folds"]]
+    comparison.to_csv(os.path.join(output_root, "comparison.csv"), index=False)
+    print(comparison.sort_values("rmse").to_string(index=False))
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Optional
+
+import numpy as np
+import xgboost as xgb
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import ParameterGrid, train_test_split
+
+from src.utils.persistent_cache import PersistentCache
+
+FACTOR = 3  # Fraction of the candidates kept after every round, and growth of their training data
+MIN_SAMPLES = 30  # Training samples of the candidates in the first round
+MAX_CANDIDATES = 256  # Configurations sampled from grids that are larger than this
+VALIDATION_FRACTION = 0.2
+EARLY_STOPPING_ROUNDS = 10
+TRIAL_CACHE_VERSION = 2  # Changed when the trials change, so that the cached results are not reused
+
+
+def _run_trial(estimator, params: dict, X_train, y_train, X_val, y_val) -> dict:
+    """Fits a configuration and scores it on the validation data. Runs in the worker processes"""
+    start = time.monotonic()
+    model = clone(estimator).set_params(**params)
+    # The parallelism is across trials, a single trial uses one core
+    if "n_jobs" in model.get_params():
+        model.set_params(n_jobs=1)
+
+    try:
+        if isinstance(model, xgb.XGBRegressor):
+            model.set_params(early_stopping_rounds=EARLY_STOPPING_ROUNDS)
+            model.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
+            best_iteration = int(model.best_iteration)
+        else:
+            model.fit(X_train, y_train)
+            best_iteration = None
+        mse = float(mean_squared_error(y_val, model.predict(X_val)))
+    except Exception as e:
+        # Invalid combinations of the grid (e.g. a metric a tree algorithm does not support) are skipped
+        return {"mse": math.inf, "best_iteration": None, "error": str(e), "duration": time.monotonic() - start}
+
+    return {"mse": mse, "best_iteration": best_iteration, "error": None, "duration": time.monotonic() - start}
+
+
+class SuccessiveHalvingSearch:
+    """
+    Hyperparameter search by successive halving, with the trials of a round run in parallel.
+
+    All candidates are first trained on the most recent nights of the training data and scored on the nights after them
+    (the validation split). Only the best 1/factor of them go to the next round, which trains on factor times more
+    nights, until one candidate is left or the whole training data is used. XGBoost trials stop early on the validation
+    split. The best configuration is refitted on all the data, validation split included.
+
+    Every trial result is cached on disk, keyed on the estimator, the configuration, the number of samples and the
+    data, so a re-run only runs the trials it has not seen. The search stops at the end of the running batch of trials
+    when the wall-clock budget is used up, and returns the best configuration found so far.
+    """
+
+    def __init__(
+        self,
+        estimator,
+        param_grid: dict,
+        factor: int = FACTOR,
+        min_samples: int = MIN_SAMPLES,
+        max_candidates: int = MAX_CANDIDATES,
+        n_jobs: int = -1,
+        time_budget: Optional[float] = None,
+        cache_path: Optional[str] = os.path.join("data", "cache", "hyperparameter_trials.sqlite"),
+        random_state: int = 42,
+    ):
+        """
+        Args:
+            estimator: estimator whose parameters are searched
+            param_grid: grid of parameters, as for GridSearchCV
+            factor: the best 1/factor candidates go to the next round, which has factor times more samples
+            min_samples: number of training samples in the first round
+            max_candidates: larger grids are sampled down to this number of configurations
+            n_jobs: number of trials run in parallel, -1 for all the cores
+            time_budget: wall-clock budget of the search [s], None for no limit
+            cache_path: location of the trial cache, None to disable it
+            random_state: seed of the candidate sampling
+        """
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.factor = factor
+        self.min_samples = min_samples
+        self.max_candidates = max_candidates
+        self.n_jobs = n_jobs
+        self.time_budget = time_budget
+        self.cache = None if cache_path is None else PersistentCache(cache_path, ttl=None)
+        self.random_state = random_state
+
+        self.results_ = []
+        self.best_params_ = None
+        self.best_score_ = None
+        self.best_estimator_ = None
+
+    def candidates(self) -> list:
+        candidates = list(ParameterGrid(self.param_grid))
+        if len(candidates) > self.max_candidates:
+            rng = np.random.default_rng(self.random_state)
+            candidates = [candidates[i] for i in sorted(rng.choice(len(candidates), self.max_candidates, False))]
+        return candidates
+
+    def _trial_key(self, params: dict, n_samples: int, data_hash: str) -> str:
+        description = [
+            TRIAL_CACHE_VERSION,
+            type(self.estimator).__name__,
+            self.estimator.get_params(),
+            params,
+            n_samples,
+            data_hash,
+        ]
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _run_round(self, parallel: Parallel, candidates: list, n_samples: int, data: tuple, data_hash: str, deadline):
+        """Runs the trials of a round that are not cached, in batches so that the budget is checked in between"""
+        X_train, y_train, X_val, y_val = data
+        results = [None] * len(candidates)
+        pending = []
+        for i, params in enumerate(candidates):
+            key = self._trial_key(params, n_samples, data_hash)
+            cached = None if self.cache is None else self.cache.get(key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append((i, key))
+
+        batch_size = max(1, parallel.n_jobs if parallel.n_jobs > 0 else os.cpu_count() or 1) * 2
+        for start in range(0, len(pending), batch_size):
+            if deadline is not None and time.monotonic() > deadline:
+                print(f"Time budget used up, {len(pending) - start} trials of the round are skipped")
+                break
+            batch = pending[start : start + batch_size]
+            outputs = parallel(
+                delayed(_run_trial)(
+                    self.estimator, candidates[i], X_train[-n_samples:], y_train[-n_samples:], X_val, y_val
+                )
+                for i, _ in batch
+            )
+            for (i, key), output in zip(batch, outputs):
+                results[i] = output
+                if self.cache is not None:
+                    self.cache.set(key, output)
+
+        return results
+
+    def fit(self, X, y):
+        """
+        Searches the parameters on the training data X, y, whose last rows are held out for validation.
+        The best configuration is then refitted on all of X, y.
+
+        Returns:
+            self
+        """
+        X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+        # The rows are in time order, the most recent ones are used for validation
+        X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=VALIDATION_FRACTION, shuffle=False)
+        data = (X_train, y_train, X_val, y_val)
+        data_hash = hashlib.sha256(X.tobytes() + y.tobytes()).hexdigest()
+
+        deadline = None if self.time_budget is None else time.monotonic() + self.time_budget
+        candidates = self.candidates()
+        n_samples = min(self.min_samples, len(X_train))
+        self.results_ = []
+
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            while True:
+                print(f"Round with {len(candidates)} candidates on {n_samples} samples")
+                results = self._run_round(parallel, candidates, n_samples, data, data_hash, deadline)
+                scored = [
+                    (result["mse"], params, result)
+                    for params, result in zip(candidates, results)
+                    if result and result["error"] is None
+                ]
+                self.results_ += [{"params": params, "n_samples": n_samples, **result} for _, params, result in scored]
+                scored.sort(key=lambda item: item[0])
+
+                if not scored:
+                    break
+                self.best_score_, self.best_params_, best_result = scored[0]
+
+                out_of_time = deadline is not None and time.monotonic() > deadline
+                if len(scored) == 1 or n_samples >= len(X_train) or out_of_time:
+                    break
+                candidates = [params for _, params, _ in scored[: max(1, len(scored) // self.factor)]]
+                n_samples = min(n_samples * self.factor, len(X_train))
+
+        if self.best_params_ is None:
+            raise RuntimeError("No trial of the search finished")
+
+        params = dict(self.best_params_)
+        if isinstance(self.estimator, xgb.XGBRegressor) and best_result["best_iteration"] is not None:
+            # Refitted with the number of rounds found by early stopping, there is no validation split left to stop on
+            params.update(n_estimators=best_result["best_iteration"] + 1, early_stopping_rounds=None)
+        self.best_estimator_ = clone(self.estimator).set_params(**params).fit(X, y)
+
+        print(f"Best parameters: {self.best_params_}, validation RMSE: {math.sqrt(self.best_score_):.3f}")
+        return self
@@ -1,19 +1,26 @@
-import functools as ft
-import json
+import os
+import time
+
+import matplotlib
+
+# Plots are written to files, training runs on machines without display
+matplotlib.use("Agg")
+
 import matplotlib.pyplot as plt
 import numpy as np
-import os
-import pandas as pd
 import xgboost as xgb
 
-from datetime import datetime
-from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.metrics import mean_squared_error
 
-from src.data_exploration.data_exploration import get_features_historical, get_targets
+from src.features.feature_store import FeatureStore
+from src.inference.model_registry import ModelRegistry
+from src.trainer.hyperparameter_search import SuccessiveHalvingSearch
+
+TEST_FRACTION = 0.2  # Most recent nights held out for testing
 
 
 class Trainer:
@@ -24,6 +31,8 @@ class Trainer:
         self.loss = loss
         self.params = {}
         self.club = club
+        # Fitted by prepare_data when the features are scaled, saved with the model
+        self.scaler = None
 
         self.params[xgb.XGBRegressor] = {
             "objective": self.loss,  # Regression task
@@ -92,38 +101,43 @@ class Trainer:
 
         self.features = ["followers", "precipitation", "temperature"]
 
-    def load_data(self, weather: bool = False, followers: bool = True, trends: bool = False):
-        followers_by_date, weather_data_by_date, trends_data, temperature = get_features_historical(
-            weather=weather, followers=followers, trends=trends
-        )
-        messages_time = get_targets()
+    def load_data(self, refresh: bool = True):
+        """
+        Reads the labeled nights from the feature store, the same rows the predictor reads.
 
-        # temperature
-        self.data = ft.reduce(
-            lambda left, right: pd.merge(left, right, on="date"),
-            [followers_by_date, messages_time, weather_data_by_date],
-        )
+        Args:
+            refresh: compute the nights that are missing from the store or recent before reading
+        """
+        feature_store = FeatureStore(club=self.club)
+        if refresh:
+            feature_store.refresh()
+
+        data = feature_store.read(labeled=True).dropna(subset=self.features)
+        self.data = data.rename(columns={"night": "date"})
 
         return self.data
 
     def prepare_data(self, data, target, scale_features=False):
-        data = data[data.max_waiting_time != 0]
+        # The most recent nights are the test set, as in production the model predicts nights after its training data
+        data = data[data.max_waiting_time != 0].sort_values("date")
         X = data.drop(target, axis=1)[self.features]
         y = data[target]
 
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_FRACTION, shuffle=False)
 
+        self.scaler = None
         if scale_features is True:
-            scaler = StandardScaler()
-            X_train = scaler.fit_transform(X_train)
-            X_test = scaler.transform(X_test)
+            # Fitted on arrays, as the model artifact passes arrays in the order of the features
+            self.scaler = StandardScaler()
+            X_train = self.scaler.fit_transform(X_train.to_numpy(dtype=float))
+            X_test = self.scaler.transform(X_test.to_numpy(dtype=float))
 
         dtrain = xgb.DMatrix(data=X_train, label=y_train)
         dtest = xgb.DMatrix(data=X_test, label=y_test)
 
         return X_train, X_test, y_train, y_test, dtrain, dtest
 
-    def train(self, dtrain):
+    def train(self, X_train, y_train):
         # Train the model
         self.model.fit(X_train, y_train)
 
@@ -132,68 +146,85 @@ class Trainer:
     def evaluate(self, model, X, dtest, y_test, subset):
         # Make predictions on the test set
         y_pred = model.predict(X)
-
-        plt.style.use("ggplot")
-        plt.title(f"Subset: {subset}")
-        plt.plot(y_pred, label="Pred")
-        plt.plot(y_test.values, label="True")
-        plt.legend()
-        plt.show()
+        self.plot_predictions(y_pred, y_test, f"Subset: {subset}", f"evaluate_{subset}.png")
 
         # Calculate and print the root mean squared error (RMSE)
         rmse = np.sqrt(mean_squared_error(y_test, y_pred))
         print(f"Root Mean Squared Error on {subset}: {rmse*60:.2f} minutes")
 
-    def save_model(self, best_estimator):
-        """Saves the models and the list of features"""
+    def plot_predictions(self, y_pred, y_true, title: str, filename: str):
+        """Saves the plot of the predictions against the true values to reports/<club>/"""
+        path_reports = os.path.join("reports", self.club)
+        os.makedirs(path_reports, exist_ok=True)
 
-        current_datetime = datetime.now().strftime("%Y_%m_%d_%H_%M")
-        model_filename = "xgboost_model.model"
-        save_dir = os.path.join("models", self.club, current_datetime)
-        os.makedirs(save_dir, exist_ok=True)
-        best_estimator.save_model(os.path.join(save_dir, model_filename))
-
-        # Save the feature file
-        with open(os.path.join(save_dir, "features.json"), "w") as json_file:
-            json.dump(self.features, json_file)
-
-    def parameter_search(self, X_train, X_test, y_test, y_train, save, *args, **kwargs):
+        plt.style.use("ggplot")
+        fig, ax = plt.subplots()
+        ax.set_title(title)
+        ax.plot(np.asarray(y_pred), label="Pred")
+        ax.plot(np.asarray(y_true), label="True")
+        ax.legend()
+        fig.savefig(os.path.join(path_reports, filename), bbox_inches="tight")
+        plt.close(fig)
+
+    def save_model(self, best_estimator, metrics: dict = None):
+        """
+        Registers the model as the current version, together with the scaler of prepare_data, the features, the
+        metrics and the hash of the training data. Tree ensembles are also exported compiled for the bot, after checking
+        that they predict the same as the model on the training data
+        """
+        version = ModelRegistry().register(
+            self.club,
+            best_estimator,
+            self.features,
+            metrics=metrics,
+            training_data=getattr(self, "data", None),
+            transform=self.scaler,
+        )
+        print(f"Saved model {version} for {self.club}")
+
+    def parameter_search(
+        self, X_train, X_test, y_test, y_train, save, time_budget: float = None, n_jobs: int = -1, *args, **kwargs
+    ):
+        """
+        Searches the parameters of the model by successive halving, see SuccessiveHalvingSearch.
+
+        Args:
+            time_budget: wall-clock budget of the search [s], None for no limit
+            n_jobs: number of trials run in parallel, -1 for all the cores
+        """
         param_grid = self.param_grid[type(self.model)]
 
-        # Perform grid search using cross-validation
-        grid_search = GridSearchCV(
-            estimator=self.model, param_grid=param_grid, scoring="neg_mean_squared_error", cv=2, verbose=10
-        )
-        grid_search.fit(X_train, y_train)
+        search = SuccessiveHalvingSearch(self.model, param_grid, n_jobs=n_jobs, time_budget=time_budget, **kwargs)
+        search.fit(X_train, y_train)
 
-        best_params = grid_search.best_params_
-        best_estimator = grid_search.best_estimator_
-        print(best_params)
-
-        if save:
-            self.save_model(best_estimator)
+        best_params = search.best_params_
+        best_estimator = search.best_estimator_
 
         # Make predictions on the test set using the best estimator
+        start = time.perf_counter()
         y_pred = best_estimator.predict(X_test)
-
-        plt.style.use("ggplot")
-        plt.plot(y_pred, label="Pred")
-        plt.plot(y_test.values, label="True")
-        plt.legend()
-        plt.show()
+        # Batch inference time, to compare the model families before deploying one
+        predict_us_per_row = (time.perf_counter() - start) / len(y_pred) * 1e6
+        self.plot_predictions(y_pred, y_test, "Best estimator", "parameter_search.png")
 
         # Calculate and print the root mean squared error (RMSE)
         rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-        print(f"Root Mean Squared Error: {rmse*60:.2f} minutes")
+        print(f"Root Mean Squared Error: {rmse*60:.2f} minutes, inference {predict_us_per_row:.1f} us per night")
+
+        if save:
+            self.save_model(
+                best_estimator,
+                metrics={"rmse": float(rmse), "predict_us_per_row": predict_us_per_row, "params": best_params},
+            )
 
 
 if __name__ == "__main__":
     trainer = Trainer(loss="reg:squarederror", metrics=["msq"], model="xgboost", club="berghain")
-    data = trainer.load_data(weather=True)
+    data = trainer.load_data()
     X_train, X_test, y_train, y_test, dtrain, dtest = trainer.prepare_data(
         data, target="max_waiting_time", scale_features=True
     )
-    model = trainer.train(dtrain)
+    model = trainer.train(X_train, y_train)
     trainer.evaluate(model, X_test, dtest, y_test, subset="test")
     trainer.evaluate(model, X_train, dtrain, y_train, subset="train")
-    trainer.parameter_search(X_train, X_test, y_test, y_train, save=True)
+    trainer.parameter_search(X_train, X_test, y_test, y_train, save=True, time_budget=600)
@@ -1,8 +1,9 @@
 import argparse
+import hashlib
 import os
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from glob import glob
 from typing import List
 import logging
 
@@ -11,19 +12,23 @@ import pandas as pd
 from bs4 import BeautifulSoup
 
 from src.utils.club_data_parser import ClubParser
+from src.utils.scrape_manifest import ScrapeManifest
 
 
 class BHParser(ClubParser):
     def __init__(self, club_name: str = "Berghain", club_page_url="https://www.berghain.berlin/en/program/archive"):
         ClubParser.__init__(self, club_name=club_name, club_page_url=club_page_url)
         self.locations = ["Berghain", "Italorama Bar", "Panorama Bar", "Säule"]
+        self.manifest = ScrapeManifest(os.path.join(self.store.root, "_manifest.json"))
 
-    def extract_content_from_page(self, url_to_parse: str):
+    def extract_content_from_page(self, url_to_parse: str, html_content: bytes = None):
         """
         Parses the url for a club's website and returns the DJ's followers and meta data.
+        If the html content of the page was already requested, it can be passed directly.
         """
 
-        html_content = self.request_website(url_to_parse)
+        if html_content is None:
+            html_content = self.request_website(url_to_parse)
 
         soup = BeautifulSoup(html_content, "html.parser")
         links = soup.select("a")
@@ -57,30 +62,63 @@ class BHParser(ClubParser):
 
                 artist_data["date"] = date_object
                 artist_data["name"] = artist
-                artist_data["followers"], artist_data["soundcloud_url"] = self.parse_followers(artist)
                 artist_data["location"] = party_location
 
                 historical_data.append(artist_data)
 
+        # The artists' followers are looked up concurrently, each artist only once per page
+        artist_names = list(dict.fromkeys(artist_data["name"] for artist_data in historical_data))
+        followers = dict(zip(artist_names, self.engine.map(self.parse_followers, artist_names)))
+
+        for artist_data in historical_data:
+            artist_data["followers"], artist_data["soundcloud_url"] = followers[artist_data["name"]]
+
         return pd.DataFrame(historical_data)
 
-    def extract_and_save_all(self, year_list: List[int] = None) -> pd.DataFrame:
+    def extract_and_save_month(self, year: int, month: int) -> pd.DataFrame:
+        """
+        Extracts and saves the data of a single month of the archive.
+
+        Months that are final in the manifest are loaded from disk. The other months are requested, but the
+        followers are only looked up again if the content of the archive page changed since the last run.
+        """
+        month_frmt = (str(month)).zfill(2)
+        saved_at = self.store.month_mtime(year, month)
+
+        if self.manifest.get(year, month) is None and saved_at is not None:
+            # Data saved before the manifest existed: the modification time tells when it was fetched
+            self.manifest.record(year, month, None, None, fetched_at=datetime.fromtimestamp(saved_at))
+
+        if self.manifest.is_final(year, month) and saved_at is not None:
+            return self.load_data(year, month_frmt)
+
+        print(f"Currently processing {year}/{month}")
+        url_to_parse = f"{self.club_page_url}/{year}/{month_frmt}/"
+        html_content = self.request_website(url_to_parse)
+        if html_content is None:
+            return pd.DataFrame()
+        content_hash = hashlib.sha256(html_content).hexdigest()
+
+        entry = self.manifest.get(year, month)
+        if entry is not None and entry["content_hash"] == content_hash and saved_at is not None:
+            data_month = self.load_data(year, month_frmt)
+        else:
+            data_month = self.extract_content_from_page(url_to_parse, html_content=html_content)
+            self.save_data(data_month, year, month_frmt)
+
+        self.manifest.record(year, month, content_hash, len(data_month))
+        return data_month
+
+    def extract_and_save_all(self, year_list: List[int] = None, max_months_in_parallel: int = 4) -> pd.DataFrame:
         """
-        Extracts and saves the
+        Extracts and saves the data of all months of the given years.
+        The months are processed concurrently, each one is saved to its own partition and checkpointed in the
+        manifest as soon as it is done, so that an interrupted run can be resumed.
         """
-        data = []
-        for year in year_list:
-            existing_data = glob(os.path.join("data", self.club_name, self.sc_folder_name) + f"*/{year}*.csv")
-            existing_months = [int(i[-6:-4]) for i in existing_data]
-
-            for month in range(1, 13):
-                # if month in existing_months: continue
-                print(f"Currently processing {year}/{month}")
-                month_frmt = (str(month)).zfill(2)
-                url_to_parse = f"{self.club_page_url}/{year}/{month_frmt}/"
-                data_month = self.extract_content_from_page(url_to_parse)
-                self.save_data(data_month, year, month_frmt)
-                data.append(data_month)
+        self.migrate_csv_data()
+        months = [(year, month) for year in year_list for month in range(1, 13)]
+        with ThreadPoolExecutor(max_workers=max_months_in_parallel) as executor:
+            data = list(executor.map(lambda year_month: self.extract_and_save_month(*year_month), months))
 
         data = pd.concat(data)
 
@@ -96,15 +134,16 @@ class BHParser(ClubParser):
         date_selected = date_selected - timedelta(days=1)
 
         month_frmt = (str(date_selected.month)).zfill(2)
-        location_dates_data = os.path.join("data", self.club_name, self.sc_folder_name, f"{date_selected.year}_{month_frmt}.csv")
-        if not os.path.exists(location_dates_data):
+        self.migrate_csv_data()
+        if not self.store.has_month(date_selected.year, date_selected.month):
             url_to_parse = f"{self.club_page_url}/{date_selected.year}/{month_frmt}/"
             data_month = self.extract_content_from_page(url_to_parse)
             self.save_data(data_month, date_selected.year, month_frmt)
+            data_month["date"] = pd.to_datetime(data_month.date).dt.date
         else:
-            data_month = pd.read_csv(location_dates_data, index_col=0, parse_dates=["date"])
+            data_month = self.store.read(start_date=date_selected, end_date=date_selected)
 
-        index_today = data_month.date == pd.to_datetime(date_selected)
+        index_today = data_month.date == date_selected
         artists_data = data_month[index_today]
 
         if not "soundcloud_url" in artists_data.columns:
@@ -117,15 +156,17 @@ class BHParser(ClubParser):
             followers = artists_data.followers.sum()
             return followers, artists_data
 
-    def generate_path(self, year: int, month: int):
-        return os.path.join("data", self.club_name, self.sc_folder_name, f"{year}_{month}.csv")
-
     def save_data(self, data_month: pd.DataFrame, year: int, month_frmt: str):
         """
-        Saves the data at the corresponding path
+        Saves the data in the month's partition of the follower store
+        """
+        self.store.write_month(data_month, year, int(month_frmt))
+
+    def load_data(self, year: int, month_frmt: str) -> pd.DataFrame:
+        """
+        Loads the data saved in the month's partition of the follower store
         """
-        path = self.generate_path(year, month_frmt)
-        data_month.to_csv(path)
+        return self.store.read_month(year, int(month_frmt))
 
 
 if __name__ == "__main__":
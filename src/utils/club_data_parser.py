@@ -1,14 +1,23 @@
-from datetime import datetime
 import glob
 import os
 import pandas as pd
 
 from abc import ABC
-from urllib.request import urlopen
 
-import requests
 from bs4 import BeautifulSoup
 
+from src.utils.follower_store import FollowerStore
+from src.utils.persistent_cache import PersistentCache
+from src.utils.scraping_engine import ScrapingEngine
+
+# Time to live of a cached follower count, after which the artist is looked up again
+FOLLOWER_CACHE_TTL = 30 * 24 * 3600
+# Number of most followed artists summed up per evening
+TOP_K_ARTISTS = 3
+
+# Aggregated follower data of the current process, keyed on the store files and their modification times
+_followers_by_date_cache = {}
+
 
 class ClubParser(ABC):
     """
@@ -20,21 +29,30 @@ class ClubParser(ABC):
     information from the club's website and looking up artists' data on SoundCloud.
     """
 
-    def __init__(self, club_name=str, club_page_url=str):
+    def __init__(
+        self,
+        club_name=str,
+        club_page_url=str,
+        follower_cache_ttl: float = FOLLOWER_CACHE_TTL,
+        engine: ScrapingEngine = None,
+    ):
         self.sc_folder_name = "soundcloud_followers"
         self.club_name = club_name.lower()
         self.path_to_data = os.path.join("data", self.club_name, self.sc_folder_name)
+        self.store = FollowerStore.for_club(self.club_name)
         self.club_page_url = club_page_url
+        self.follower_cache = PersistentCache(
+            os.path.join("data", self.club_name, "soundcloud_cache.sqlite"), ttl=follower_cache_ttl
+        )
+        # Shared by all requests of the parser: pooled session, rate limits and retries
+        self.engine = engine if engine is not None else ScrapingEngine()
 
     def request_website(self, url: str):
         """Requests the website"""
-        try:
-            response = requests.get(url)
-            response.raise_for_status()  # Raise an exception for HTTP errors (e.g., 404)
-            return response.content
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching content: {e}")
+        response = self.engine.get(url)
+        if response is None:
             return None
+        return response.content
 
     @staticmethod
     def preprocess_artist_name(artist: str) -> str:
@@ -44,19 +62,38 @@ class ClubParser(ABC):
         """
         Given an artist name extracted from the club's website, it looks for the artist's soundcloud page and
         extracts the number of followers.
+        Successful lookups are cached on the normalized artist name, so that resident artists are only
+        requested once per cache ttl.
 
         Args:
             artist: name of the artist
 
         Returns:
             followers: number of followers
+            url: url of the artist's soundcloud page
         """
 
-        # artist = self.preprocess_artist_name(artist)
+        cache_key = self.preprocess_artist_name(artist)
+        cached = self.follower_cache.get(cache_key)
+        if cached is not None:
+            return cached["followers"], cached["soundcloud_url"]
+
+        followers, url = self._request_followers(artist)
+
+        # Failed lookups are not cached, they might be due to a temporary network error
+        if url:
+            self.follower_cache.set(cache_key, {"followers": followers, "soundcloud_url": url})
+
+        return followers, url
+
+    def _request_followers(self, artist: str):
+        """Looks up the artist's soundcloud page and extracts the number of followers"""
 
         # url_to_parse = f"https://soundcloud.com/search/people?q={artist}" TODO: use the search for people
         url_to_parse = f"https://soundcloud.com/search?q={artist}"
         html_content = self.request_website(url_to_parse)
+        if html_content is None:
+            return 0, ""
         soup = BeautifulSoup(html_content, "html.parser")
 
         links = soup.select("a")
@@ -64,9 +101,8 @@ class ClubParser(ABC):
         artist_tag = artist_tag.replace("/", "")
 
         try:
-            page = urlopen(f"https://soundcloud.com/{artist_tag}")
-            html_bytes = page.read()
-            html = html_bytes.decode("utf-8")
+            page = self.engine.get(f"https://soundcloud.com/{artist_tag}")
+            html = page.content.decode("utf-8")
 
             index_start = html.find('follower_count" content="') + len('follower_count" content="')
             index_end = html.find('">\n<link rel="canonical')
@@ -77,39 +113,85 @@ class ClubParser(ABC):
 
         return followers, page.url
 
-    def gather_artist_data(self, path_to_data: str = None) -> pd.DataFrame:
+    def gather_artist_data(
+        self, path_to_data: str = None, top_k: int = TOP_K_ARTISTS, use_cache: bool = True
+    ) -> pd.DataFrame:
         """
-        Load data previously saved data
+        Load data previously saved data and aggregate it by evening.
+
+        The aggregation is cached in memory and on disk. The cache is keyed on the files of the follower store and
+        their modification times, so it is recomputed as soon as new data is saved.
 
         Args:
-            path_to_data: path to the folder with the csv files. If not set, the default path is used
+            path_to_data: path to the folder of the follower store. If not set, the default path is used
+            top_k: number of most followed artists whose followers are summed up in `followers_top<k>`
+            use_cache: whether a previously cached aggregation can be returned
 
         Returns:
-            followers_by_date: data of the followers number grouped by evening.
+            followers_by_date: data of the followers number grouped by evening. Besides the total `followers` it
+                contains the max, mean, number of artists, top k sum and the sum per location.
         """
 
-        if path_to_data is None:
-            path_to_data = self.path_to_data
-        files = glob.glob(os.path.join(path_to_data, "*.csv"))
-        files = [file_name for file_name in files if "test" not in file_name]
+        store = self.store if path_to_data is None else FollowerStore(path_to_data)
+        self.migrate_csv_data()
 
-        data = []
-        followers_by_date = []
+        cache_key = (store.root, top_k, tuple(sorted((path, os.path.getmtime(path)) for path in store.files())))
+        path_cache = os.path.join("data", self.club_name, "cache", "followers_by_date.pkl")
+        if use_cache:
+            if cache_key in _followers_by_date_cache:
+                return _followers_by_date_cache[cache_key].copy()
+            if os.path.exists(path_cache):
+                cached = pd.read_pickle(path_cache)
+                if cached["key"] == cache_key:
+                    _followers_by_date_cache[cache_key] = cached["data"]
+                    return cached["data"].copy()
 
-        for path in files:
-            df = pd.read_csv(path)
-            data.append(df)
+        data = store.read(columns=["date", "location", "followers"])
+        followers_by_date = self.aggregate_followers(data, top_k)
 
-        data = pd.concat(data)
+        _followers_by_date_cache[cache_key] = followers_by_date
+        os.makedirs(os.path.dirname(path_cache), exist_ok=True)
+        pd.to_pickle({"key": cache_key, "data": followers_by_date}, path_cache)
 
-        for date in data.date.unique():
-            followers = data[data.date == date].followers.sum()
-            followers_by_date.append({"date": datetime.strptime(date, '%Y-%m-%d').date(), "followers": followers})
+        return followers_by_date.copy()
+
+    @staticmethod
+    def aggregate_followers(data: pd.DataFrame, top_k: int = TOP_K_ARTISTS) -> pd.DataFrame:
+        """
+        Aggregates the artists' followers by evening in a single pass over the data.
 
-        followers_by_date = pd.DataFrame(followers_by_date)
+        Args:
+            data: follower data with the columns date, location and followers
+            top_k: number of most followed artists whose followers are summed up
 
-        followers_by_date.sort_values("date", inplace=True)
-        return followers_by_date
+        Returns:
+            followers_by_date: one row per evening, sorted by date
+        """
+        grouped = data.groupby("date", sort=True).followers
+        followers_by_date = grouped.agg(["sum", "max", "mean", "count"])
+        followers_by_date.columns = ["followers", "followers_max", "followers_mean", "artists"]
+
+        # Sorting once, the top k of each evening are then the first k rows of its group
+        data_sorted = data.sort_values(["date", "followers"], ascending=[True, False])
+        followers_by_date[f"followers_top{top_k}"] = (
+            data_sorted.groupby("date").head(top_k).groupby("date").followers.sum()
+        )
+
+        followers_location = data.pivot_table(
+            index="date", columns="location", values="followers", aggfunc="sum", fill_value=0
+        )
+        followers_location.columns = [
+            f"followers_{str(location).lower().replace(' ', '_')}" for location in followers_location.columns
+        ]
+        followers_by_date = followers_by_date.join(followers_location)
+
+        return followers_by_date.reset_index()
+
+    def migrate_csv_data(self):
+        """Moves the data saved as per-month csv files into the follower store, if the store is still empty"""
+        if not self.store.files() and glob.glob(os.path.join(self.path_to_data, "*.csv")):
+            migrated = self.store.migrate_csv(self.path_to_data)
+            print(f"Migrated {migrated} months of follower data to {self.store.root}")
 
     def extract_content_from_page(self, url: str):
         """
@@ -0,0 +1,152 @@
+import argparse
+import glob
+import os
+import re
+import time
+from datetime import date
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCHEMA = pa.schema(
+    [
+        ("date", pa.date32()),
+        ("name", pa.string()),
+        ("location", pa.string()),
+        ("followers", pa.int64()),
+        ("soundcloud_url", pa.string()),
+    ]
+)
+
+
+class FollowerStore:
+    """
+    Columnar store of the artists' follower data.
+
+    The data is saved as parquet files partitioned by year and month (`year=2024/month=3/part-<ns>.parquet`).
+    Files starting with `_` or `.` in the root folder (e.g. the scrape manifest) are ignored when reading.
+    Reads filter on the date column, so that only the partitions and row groups in the requested range are read,
+    and the files are memory mapped instead of being parsed.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @classmethod
+    def for_club(cls, club_name: str) -> "FollowerStore":
+        """Store the club parser writes to, for readers that do not need a parser"""
+        return cls(os.path.join("data", club_name.lower(), "soundcloud_followers_store"))
+
+    def partition_path(self, year: int, month: int) -> str:
+        return os.path.join(self.root, f"year={int(year)}", f"month={int(month)}")
+
+    def has_month(self, year: int, month: int) -> bool:
+        return len(glob.glob(os.path.join(self.partition_path(year, month), "*.parquet"))) > 0
+
+    def month_mtime(self, year: int, month: int) -> Optional[float]:
+        """Returns when the month was last written, None if it is not in the store"""
+        parts = glob.glob(os.path.join(self.partition_path(year, month), "*.parquet"))
+        if not parts:
+            return None
+        return max(os.path.getmtime(part) for part in parts)
+
+    def files(self) -> List[str]:
+        return glob.glob(os.path.join(self.root, "year=*", "month=*", "*.parquet"))
+
+    @staticmethod
+    def to_table(data: pd.DataFrame) -> pa.Table:
+        """Converts the scraped data to the typed schema of the store"""
+        data = data.reindex(columns=SCHEMA.names)
+        data["date"] = pd.to_datetime(data["date"]).dt.date
+        data["followers"] = data["followers"].fillna(0).astype("int64")
+        for column in ["name", "location", "soundcloud_url"]:
+            data[column] = data[column].astype("string")
+        return pa.Table.from_pandas(data, schema=SCHEMA, preserve_index=False)
+
+    def write_month(self, data_month: pd.DataFrame, year: int, month: int):
+        """
+        Writes the data of a month as a new part of its partition.
+        The new part is written atomically, the parts it supersedes are removed afterwards.
+        """
+        partition = self.partition_path(year, month)
+        os.makedirs(partition, exist_ok=True)
+        previous_parts = glob.glob(os.path.join(partition, "*.parquet"))
+
+        # Files starting with a dot are ignored by readers, so a part is only visible once it is complete
+        name = f"part-{time.time_ns()}.parquet"
+        path_tmp = os.path.join(partition, f".{name}.tmp")
+        pq.write_table(self.to_table(data_month), path_tmp)
+        os.replace(path_tmp, os.path.join(partition, name))
+
+        for part in previous_parts:
+            os.remove(part)
+
+    def read(self, start_date: date = None, end_date: date = None, columns: List[str] = None) -> pd.DataFrame:
+        """
+        Reads the data between start_date and end_date, both included.
+
+        Args:
+            start_date: first date to read, if not set the data is read from the beginning
+            end_date: last date to read, if not set the data is read until the end
+            columns: columns to read, all by default
+
+        Returns:
+            data: dataframe with the dates as datetime.date
+        """
+        columns = SCHEMA.names if columns is None else columns
+        if not self.files():
+            return pd.DataFrame({column: pd.Series(dtype="object") for column in columns})
+
+        # Filters on the partition keys prune whole directories, the ones on the date column prune row groups
+        filters = []
+        if start_date is not None:
+            filters += [("year", ">=", start_date.year), ("date", ">=", start_date)]
+        if end_date is not None:
+            filters += [("year", "<=", end_date.year), ("date", "<=", end_date)]
+        if start_date is not None and end_date is not None and (start_date.year, start_date.month) == (
+            end_date.year,
+            end_date.month,
+        ):
+            filters += [("month", "=", start_date.month)]
+
+        table = pq.read_table(
+            self.root, columns=columns, filters=filters or None, memory_map=True, partitioning="hive"
+        )
+        return table.to_pandas()
+
+    def read_month(self, year: int, month: int) -> pd.DataFrame:
+        return pq.read_table(self.partition_path(year, month), schema=SCHEMA, memory_map=True).to_pandas()
+
+    def migrate_csv(self, path_to_csv: str) -> int:
+        """
+        One-shot migration of the per-month csv files (`<year>_<month>.csv`) to the store.
+
+        Returns:
+            migrated: number of migrated months
+        """
+        migrated = 0
+        for path in sorted(glob.glob(os.path.join(path_to_csv, "*.csv"))):
+            match = re.fullmatch(r"(\d{4})_(\d{1,2})\.csv", os.path.basename(path))
+            if match is None:
+                continue
+            year, month = int(match.group(1)), int(match.group(2))
+
+            data_month = pd.read_csv(path, index_col=0)
+            if "date" not in data_month.columns:
+                data_month = pd.DataFrame(columns=SCHEMA.names)
+            self.write_month(data_month, year, month)
+            migrated += 1
+
+        return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrates the per-month follower csv files to the parquet store")
+    parser.add_argument("--club", type=str, default="berghain")
+    args = parser.parse_args()
+
+    store = FollowerStore(os.path.join("data", args.club, "soundcloud_followers_store"))
+    migrated = store.migrate_csv(os.path.join("data", args.club, "soundcloud_followers"))
+    print(f"Migrated {migrated} months")
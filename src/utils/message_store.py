@@ -0,0 +1,100 @@
+import glob
+import json
+import os
+import time
+from datetime import datetime
+from typing import Callable
+
+import pandas as pd
+
+COLUMNS = ["id", "timestamp", "text", "prediction", "match_type", "confidence"]
+
+
+class MessageStore:
+    """
+    Incremental store of the messages of a source (telegram, reddit) together with their queue estimates.
+
+    New messages are appended as parquet parts, the store is never rewritten. A high-water mark (timestamp of the
+    newest message and the ids of the messages with that timestamp) tells which messages are new, so that only
+    these need to be estimated.
+    """
+
+    def __init__(self, source: str, root: str = "data/berghain"):
+        self.source = source
+        self.path = os.path.join(root, source, "messages")
+        self.path_watermark = os.path.join(root, source, "watermark.json")
+
+    def watermark(self) -> dict:
+        """Returns the high-water mark, with timestamp None if the store is empty"""
+        if not os.path.exists(self.path_watermark):
+            return {"timestamp": None, "ids": []}
+        with open(self.path_watermark, "r") as json_file:
+            watermark = json.load(json_file)
+        watermark["timestamp"] = datetime.fromisoformat(watermark["timestamp"])
+        return watermark
+
+    def load(self) -> pd.DataFrame:
+        parts = sorted(glob.glob(os.path.join(self.path, "*.parquet")))
+        if not parts:
+            return pd.DataFrame(columns=COLUMNS)
+        return pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+
+    def select_new(self, messages: pd.DataFrame) -> pd.DataFrame:
+        """Returns the messages that are newer than the high-water mark"""
+        watermark = self.watermark()
+        if watermark["timestamp"] is None:
+            return messages
+
+        timestamp = pd.Timestamp(watermark["timestamp"])
+        is_new = (messages.timestamp > timestamp) | (
+            (messages.timestamp == timestamp) & ~messages.id.isin(watermark["ids"])
+        )
+        return messages[is_new]
+
+    def append(self, messages: pd.DataFrame):
+        """Appends the messages as a new part and moves the high-water mark forward"""
+        if messages.empty:
+            return
+        messages = messages[COLUMNS]
+
+        os.makedirs(self.path, exist_ok=True)
+        path_part = os.path.join(self.path, f"part-{time.time_ns()}.parquet")
+        messages.to_parquet(f"{path_part}.tmp", index=False)
+        os.replace(f"{path_part}.tmp", path_part)
+
+        watermark = self.watermark()
+        newest = messages.timestamp.max()
+        ids = messages.id[messages.timestamp == newest].tolist()
+        if watermark["timestamp"] is not None and pd.Timestamp(watermark["timestamp"]) == newest:
+            ids += watermark["ids"]
+
+        with open(f"{self.path_watermark}.tmp", "w") as json_file:
+            json.dump({"timestamp": newest.isoformat(), "ids": ids}, json_file)
+        os.replace(f"{self.path_watermark}.tmp", self.path_watermark)
+
+    def refresh(self, read_fun: Callable, estimate_fun: Callable) -> pd.DataFrame:
+        """
+        Reads the messages of the source that are newer than the high-water mark, estimates and stores them.
+
+        Args:
+            read_fun: function returning the messages of the source, with the columns id, timestamp and text.
+                It is passed the timestamp of the high-water mark as `since`, so that it can skip older messages
+            estimate_fun: function returning the estimates (hours, match_type, confidence) of a series of texts
+
+        Returns:
+            messages: all the stored messages with their estimates
+        """
+        watermark = self.watermark()
+        messages = read_fun(since=watermark["timestamp"])
+        messages["id"] = messages.id.astype(str)
+
+        messages_new = self.select_new(messages).drop_duplicates("id").copy()
+        if not messages_new.empty:
+            print(f"Estimating {len(messages_new)} new {self.source} messages")
+            estimates = estimate_fun(messages_new.text)
+            messages_new["prediction"] = estimates.hours
+            messages_new["match_type"] = estimates.match_type
+            messages_new["confidence"] = estimates.confidence
+            self.append(messages_new)
+
+        return self.load()
@@ -1,15 +1,11 @@
-import os
-from glob import glob
 from datetime import datetime, timedelta, date, time
+from typing import List
 
 import numpy as np
 import pandas as pd
-import requests
-from pytrends.request import TrendReq
 
-# Replace 'YOUR_API_KEY' with your actual API key from WeatherAPI
-API_KEY = os.environ["WEATHER_API_KEY"]
-CHUNK_SIZE = 35
+from src.utils.weather_client import get_weather_client
+from src.utils.weather_store import get_weather_store
 
 
 # Sinusoid parameters
@@ -24,58 +20,20 @@ HOUR = 23
 
 
 def get_weather_data(city="Berlin", start_date: datetime = None, end_date: datetime = None) -> pd.DataFrame:
-    base_url = "http://api.weatherapi.com/v1/history.json"
-    weather_data = []
-
     start_date = datetime.combine(start_date, time(00, 00, 00))
 
     # If end date is equal to start date or not set, get the data for the whole day
     if start_date == end_date or end_date is None:
         end_date = datetime.combine(start_date, time(23, 59, 59))
+    elif not isinstance(end_date, datetime):
+        end_date = datetime.combine(end_date, time(23, 59, 59))
 
-    # TODO: fix this logic
     # Load saved data for historical training
-    if start_date < date.today() - timedelta(2):
-        weather_df = pd.concat([pd.read_csv(file, parse_dates=["time"]) for file in glob("data/wetter_berlin/*.csv")])
-        weather_df.rename(
-            columns={"time": "date", "precipitation (mm)": "precipitation", "temperature_2m (°C)": "temperature"},
-            inplace=True,
-        )
-        weather_df = weather_df[
-            (weather_df.date >= pd.to_datetime(start_date)) & (weather_df.date <= pd.to_datetime(end_date))
-        ]
-
-        weather_data = {}
-        for _, row in weather_df.iterrows():
-            day_str = row["date"].strftime("%Y-%m-%d")
-            hour_str = row["date"].hour
-            if day_str not in weather_data:
-                weather_data[day_str] = {"hour": {}}
-            weather_data[day_str]["hour"][hour_str] = {
-                "precip_mm": row["precipitation"],
-                "temp_c": row["temperature"],
-            }
-
-    # Get newer data from API
-    else:
-        while start_date <= end_date:
-            # Calculate the end date for the current chunk
-            chunk_end_date = min(end_date, start_date + pd.Timedelta(days=CHUNK_SIZE - 1))
-
-            params = {
-                "key": API_KEY,
-                "q": city,
-                "dt": start_date.strftime("%Y-%m-%d"),
-                "end_dt": chunk_end_date.strftime("%Y-%m-%d"),
-            }
-
-            response = requests.get(base_url, params=params)
-
-            if response.status_code == 200:
-                data = response.json()
-                weather_data.extend(data["forecast"]["forecastday"])
-
-            start_date += pd.Timedelta(days=CHUNK_SIZE)
+    if start_date.date() < date.today() - timedelta(2):
+        return get_weather_store().night_features(start_date, end_date, hours=[HOUR])
+
+    # Get newer data from the API, cached per day
+    weather_data = get_weather_client().get_days(city, start_date, end_date)
 
     weather_data_by_date = [
         {
@@ -86,10 +44,10 @@ def get_weather_data(city="Berlin", start_date: datetime = None, end_date: datet
         for day in weather_data
         if len(day["hour"]) > 0
     ]
-    weather_data_by_date = pd.DataFrame(weather_data_by_date)
+    weather_data_by_date = pd.DataFrame(weather_data_by_date, columns=["date", "precipitation", "temperature"])
 
     weather_data_by_date = weather_data_by_date[
-        (weather_data_by_date["date"] <= start_date.date()) & (weather_data_by_date["date"] >= end_date.date())
+        (weather_data_by_date["date"] >= start_date.date()) & (weather_data_by_date["date"] <= end_date.date())
     ]
 
     weather_data_grouped = weather_data_by_date.groupby("date")["temperature"].min().reset_index()
@@ -100,7 +58,40 @@ def get_weather_data(city="Berlin", start_date: datetime = None, end_date: datet
     return weather_data_grouped
 
 
+def get_important_dates(years_list: List):
+    """Returns list of dates that have a high affluence."""
+    important_dates_csd = ["2021-7-24", "2022-7-23", "2023-7-22"]
+    important_dates_easter = [
+        "2021-4-2",
+        "2021-4-3",
+        "2021-4-4",
+        "2021-4-5",
+        "2022-4-15",
+        "2022-4-16",
+        "2022-4-17",
+        "2022-4-18",
+        "2023-4-7",
+        "2023-4-8",
+        "2023-4-9",
+        "2023-4-10",
+    ]
+
+    important_dates = important_dates_csd + important_dates_easter
+    important_dates = [datetime.strptime(date, "%Y-%m-%d") for date in important_dates]
+
+    nye = [datetime.strptime(f"{year}-12-31", "%Y-%m-%d") for year in years_list]
+    christmas = [datetime.strptime(f"{year}-12-24", "%Y-%m-%d") for year in years_list]
+
+    important_dates += nye
+    important_dates += christmas
+
+    return important_dates
+
+
 def get_google_trends_data(keyword, timeframe="today 12-m", geo="", gprop=""):
+    # Imported here, the trends are not needed to compute the features
+    from pytrends.request import TrendReq
+
     pytrends = TrendReq(hl="en-US", tz=360)
     pytrends.build_payload([keyword], timeframe=timeframe, geo=geo, gprop=gprop)
     trends_data = pytrends.interest_over_time()
@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+# Access times of the memory hits are written to disk in batches of this size, or before the next eviction
+ACCESS_BATCH_SIZE = 256
+
+
+class PersistentCache:
+    """
+    Two-tier key-value cache: an in-memory LRU in front of a SQLite table on disk.
+
+    Values are stored as JSON together with the time they were fetched and their expiry time.
+    The disk tier is bounded to `max_entries` rows, the least recently used rows are evicted first.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = 7 * 24 * 3600, max_entries: int = 50000, memory_size: int = 2048):
+        """
+        Args:
+            path: location of the SQLite file
+            ttl: default time to live of an entry in seconds. None means that entries never expire
+            max_entries: maximum number of entries kept on disk
+            memory_size: maximum number of entries kept in memory
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_size = memory_size
+
+        self._memory = OrderedDict()
+        # Access times of the memory hits not written to disk yet
+        self._accessed = {}
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, "
+            "value TEXT, "
+            "fetched_at REAL, "
+            "expires_at REAL, "
+            "accessed_at REAL)"
+        )
+        self._con.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON cache (accessed_at)")
+        self._con.commit()
+
+    @staticmethod
+    def _is_expired(expires_at: Optional[float], now: float) -> bool:
+        return expires_at is not None and expires_at <= now
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value, or None if the key is missing or expired."""
+        entry = self.get_entry(key)
+        return None if entry is None else entry["value"]
+
+    def get_entry(self, key: str) -> Optional[dict]:
+        """Returns the cached value together with its fetch timestamp, or None if missing or expired."""
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._is_expired(entry["expires_at"], now):
+                    self._memory.move_to_end(key)
+                    # Also recorded on disk, otherwise the hottest keys would look unused to the eviction
+                    self._accessed[key] = now
+                    if len(self._accessed) >= ACCESS_BATCH_SIZE:
+                        self._write_accessed()
+                        self._con.commit()
+                    return entry
+                del self._memory[key]
+
+            row = self._con.execute(
+                "SELECT value, fetched_at, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            value, fetched_at, expires_at = row
+            if self._is_expired(expires_at, now):
+                self._con.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._con.commit()
+                return None
+
+            self._accessed.pop(key, None)
+            self._con.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._con.commit()
+
+            entry = {"value": json.loads(value), "fetched_at": fetched_at, "expires_at": expires_at}
+            self._remember(key, entry)
+            return entry
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = -1):
+        """
+        Stores a value.
+
+        Args:
+            key: cache key
+            value: JSON serializable value
+            ttl: time to live in seconds for this entry. If not set the default ttl is used, None never expires
+        """
+        ttl = self.ttl if ttl == -1 else ttl
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        entry = {"value": value, "fetched_at": now, "expires_at": expires_at}
+
+        with self._lock:
+            self._remember(key, entry)
+            self._accessed.pop(key, None)
+            self._con.execute(
+                "INSERT OR REPLACE INTO cache (key, value, fetched_at, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value), now, expires_at, now),
+            )
+            self._evict()
+            self._con.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._accessed.pop(key, None)
+            self._con.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._con.commit()
+
+    def _remember(self, key: str, entry: dict):
+        """Puts an entry in the memory tier, evicting the least recently used one if needed"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _write_accessed(self):
+        """Writes the access times of the memory hits to disk"""
+        if self._accessed:
+            self._con.executemany(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", [(at, key) for key, at in self._accessed.items()]
+            )
+            self._accessed.clear()
+
+    def _evict(self):
+        """Removes expired rows and the least recently used rows beyond max_entries"""
+        self._write_accessed()
+        self._con.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        self._con.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
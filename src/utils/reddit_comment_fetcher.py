@@ -0,0 +1,106 @@
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, Tuple
+
+import prawcore
+
+from src.utils.rate_limit import TokenBucket
+
+# The Reddit API allows 100 requests per minute to OAuth clients, some margin is kept for the listing requests
+REQUESTS_PER_MINUTE = 90
+
+
+class RateLimitedRequestor(prawcore.Requestor):
+    """Requestor of praw that takes a token from the rate limiter before every HTTP request"""
+
+    def __init__(self, *args, rate_limiter: TokenBucket, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+
+    def request(self, *args, **kwargs):
+        self.rate_limiter.acquire()
+        return super().request(*args, **kwargs)
+
+
+class CommentTreeFetcher:
+    """
+    Downloads the comment trees of many submissions in parallel, within a budget of API requests.
+
+    The budget is a token bucket shared by the praw instances of the workers, every request they make takes one token
+    (see RateLimitedRequestor), so a submission costs exactly the requests it needs.
+
+    praw is not thread safe, so every worker thread has its own praw.Reddit instance and loads the submissions it
+    works on by id. Only the praw interface is used (`reddit.submission`, `comments`, `comments.replace_more` and
+    `comments.list`), so it can be run against a stub of praw.
+    """
+
+    def __init__(
+        self,
+        reddit_factory: Callable[[TokenBucket], object],
+        max_workers: int = 8,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        max_more_comments: int = 10,
+        rate_limiter: TokenBucket = None,
+    ):
+        """
+        Args:
+            reddit_factory: creates a new praw.Reddit instance whose requests take tokens from the given limiter,
+                called once per worker thread
+            max_workers: number of submissions whose comments are downloaded at the same time
+            requests_per_minute: API requests per minute shared by all workers
+            max_more_comments: number of "load more comments" links expanded per submission, each one costs a request.
+                The ones left over are dropped
+            rate_limiter: limiter to share with other API users, if not set a new one is created
+        """
+        self.reddit_factory = reddit_factory
+        self.max_workers = max_workers
+        self.max_more_comments = max_more_comments
+        if rate_limiter is None:
+            rate_limiter = TokenBucket(rate=requests_per_minute / 60, capacity=max(1, max_workers))
+        self.rate_limiter = rate_limiter
+        self._local = threading.local()
+
+    def _reddit(self):
+        """praw.Reddit instance of the current thread"""
+        if not hasattr(self._local, "reddit"):
+            self._local.reddit = self.reddit_factory(self.rate_limiter)
+        return self._local.reddit
+
+    def fetch_comments(self, submission) -> list:
+        """Downloads the whole comment tree of a submission and returns it flattened"""
+        # The submission of the listing belongs to the instance of another thread, it is loaded again by id on the one
+        # of this thread. Accessing its comments fetches the submission with its first comments
+        comments = self._reddit().submission(id=submission.id).comments
+
+        # replace_more expands up to `limit` links, including the nested ones it finds, and drops the rest. It makes
+        # one request per expanded link, each one waits for its token in the requestor
+        comments.replace_more(limit=self.max_more_comments)
+        return comments.list()
+
+    def fetch(self, submissions: Iterable) -> Iterator[Tuple[object, list]]:
+        """
+        Downloads the comments of the submissions concurrently.
+        The submissions are consumed lazily, so this can be fed directly from a listing.
+
+        Yields:
+            (submission, comments) as soon as the comments of a submission are downloaded
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            for submission in submissions:
+                pending[executor.submit(self.fetch_comments, submission)] = submission
+
+                # Bounds the number of submissions held in memory
+                if len(pending) >= 2 * self.max_workers:
+                    yield from self._collect(pending, wait(pending, return_when=FIRST_COMPLETED).done)
+
+            yield from self._collect(pending, wait(pending).done)
+
+    @staticmethod
+    def _collect(pending: dict, done: set) -> Iterator[Tuple[object, list]]:
+        for future in done:
+            submission = pending.pop(future)
+            try:
+                yield submission, future.result()
+            except Exception as e:
+                print(f"Could not fetch the comments of {submission.id}: {e}")
@@ -7,16 +7,20 @@ import praw
 import pandas as pd
 import sqlalchemy as sa
 import pytz
+from sqlalchemy.dialects import mysql, sqlite
 
-from src.db.create_db_connection import load_db_config, create_connection
+from src.db.create_db_connection import get_engine, session_scope
+from src.utils.rate_limit import TokenBucket
+from src.utils.reddit_comment_fetcher import REQUESTS_PER_MINUTE, CommentTreeFetcher, RateLimitedRequestor
 
 
-def setup_reddit_api(config_file):
+def setup_reddit_api(config_file, rate_limiter: TokenBucket = None):
     """
     Set up a Reddit bot using provided credentials and parse submissions from a subreddit.
 
     Parameters:
         config_file (str): Path to the JSON file containing Reddit API credentials.
+        rate_limiter (TokenBucket): Limiter every request of the bot takes a token from, None for no limit.
         date_starting (datetime): Starting date for subreddit submissions.
         date_ending (datetime): Ending date for subreddit submissions.
     
@@ -27,13 +31,18 @@ def setup_reddit_api(config_file):
     with open(config_file, 'r') as file:
         input_data = json.load(file)
     
+    requestor = {}
+    if rate_limiter is not None:
+        requestor = {"requestor_class": RateLimitedRequestor, "requestor_kwargs": {"rate_limiter": rate_limiter}}
+
     # Set up reddit bot
     reddit = praw.Reddit(
         client_id=input_data["client_id"],
         client_secret=input_data["client_secret"],
         username=input_data["username"],
         password=input_data["password"],
-        user_agent=input_data["user_agent"]
+        user_agent=input_data["user_agent"],
+        **requestor
     )
 
     return reddit
@@ -50,43 +59,221 @@ class DataDownloaderReddit:
 
         # Read login data for reddit
 
-        self.reddit = setup_reddit_api(config_file="config/reddit_config.json")
-        config_path = "config/db_config.json"
-        config = load_db_config(config_path)
-        self.engine = create_connection(config)
+        # Budget of API requests shared by the listing and the comment downloads
+        self.rate_limiter = TokenBucket(rate=REQUESTS_PER_MINUTE / 60, capacity=8)
+        self.reddit = setup_reddit_api(config_file="config/reddit_config.json", rate_limiter=self.rate_limiter)
+        # Pooled engine shared by the whole process
+        self.engine = get_engine("config/db_config.json")
 
         table_inspector = sa.inspect(self.engine)
-        self.reddit_table_names = table_inspector.get_table_names()
+        self.reddit_table_names = table_inspector.get_table_names(schema="clubs")
 
         self.berlin_timezone = pytz.timezone('Europe/Berlin')
 
+        # Reflected tables, used to build the upsert statements
+        self.tables = {}
+        # Number of rows that are written to the database at once
+        self.batch_size = 500
+        # Downloads the comment trees of the submissions in parallel, within the API quota
+        # praw is not thread safe, every worker of the fetcher gets its own instance
+        self.comment_fetcher = CommentTreeFetcher(
+            lambda rate_limiter: setup_reddit_api("config/reddit_config.json", rate_limiter=rate_limiter),
+            max_workers=8,
+            max_more_comments=10,
+            rate_limiter=self.rate_limiter,
+        )
+
     @staticmethod
     def create_table_name(symbol: str):
         return f"{symbol}"
 
+    @staticmethod
+    def datetime_index_name(table_name: str) -> str:
+        # Index names are global to the database in SQLite, so they contain the table name
+        return f"idx_{table_name}_datetime"
+
+    @staticmethod
+    def unique_id_index_name(table_name: str) -> str:
+        return f"uq_{table_name}_id"
+
     def create_table(self, table_name: str):
         """In case the table for a specific table_name does not exist, it is created."""
 
-        with self.engine.connect() as con:
-            table_name = self.create_table_name(table_name)
-            q = (
-                f"CREATE TABLE clubs.{table_name} ("
-                "body LONGTEXT, "
-                "datetime DATETIME, "
-                "ups INT, "
-                "downs INT, "
-                "type VARCHAR(255), "
-                "id VARCHAR(255), "
-                "parent VARCHAR(255))"
-            )
+        table_name = self.create_table_name(table_name)
+        table = sa.Table(
+            table_name,
+            sa.MetaData(),
+            sa.Column("body", sa.Text().with_variant(mysql.LONGTEXT(), "mysql")),
+            sa.Column("datetime", sa.DateTime),
+            sa.Column("ups", sa.Integer),
+            sa.Column("downs", sa.Integer),
+            sa.Column("type", sa.String(255)),
+            sa.Column("id", sa.String(255)),
+            sa.Column("parent", sa.String(255)),
+            sa.Index(self.unique_id_index_name(table_name), "id", unique=True),
+            sa.Index(self.datetime_index_name(table_name), "datetime"),
+            schema="clubs",
+        )
 
-            con.execute(sa.text(q))
+        with session_scope(self.engine) as con:
+            table.create(con)
 
         self.reddit_table_names.append(table_name)
 
+    def ensure_indexes(self, table: sa.Table):
+        """Adds the index on the datetime and the unique key on the id to tables created without them."""
+        index_names = [index["name"] for index in sa.inspect(self.engine).get_indexes(table.name, schema="clubs")]
+        datetime_index = self.datetime_index_name(table.name)
+        unique_id_index = self.unique_id_index_name(table.name)
+
+        # MySQL tables indexed before the names contained the table name have "idx_datetime" and "uq_id"
+        if datetime_index not in index_names and "idx_datetime" not in index_names:
+            with session_scope(self.engine) as con:
+                sa.Index(datetime_index, table.c.datetime).create(con)
+        if unique_id_index not in index_names and "uq_id" not in index_names:
+            try:
+                with session_scope(self.engine) as con:
+                    sa.Index(unique_id_index, table.c.id, unique=True).create(con)
+            except sa.exc.DBAPIError as e:
+                print(f"Could not add unique key on id, duplicated rows have to be removed first: {e}")
+
+    def prepare_table(self, table_name: str):
+        """Creates the table if it does not exist, otherwise makes sure it has the required indexes"""
+        if table_name in self.tables:
+            return
+
+        table_exists = table_name in self.reddit_table_names
+        if not table_exists:
+            self.create_table(table_name)
+
+        table = sa.Table(table_name, sa.MetaData(), schema="clubs", autoload_with=self.engine)
+        if table_exists:
+            self.ensure_indexes(table)
+
+        self.tables[table_name] = table
+
+    def write_rows(self, table_name: str, rows: list):
+        """
+        Writes the rows to the table in one batch. Rows whose id already exists are updated instead.
+
+        Args:
+            - table_name: name of the table
+            - rows: list of dicts with the columns of the table
+        """
+        if not rows:
+            return
+
+        # Deduplicate on the id within the batch, the last version of a row wins
+        rows = list({row["id"]: row for row in rows}.values())
+
+        table = self.tables[table_name]
+        if self.engine.dialect.name == "mysql":
+            statement = mysql.insert(table)
+            statement = statement.on_duplicate_key_update(
+                body=statement.inserted.body, ups=statement.inserted.ups, downs=statement.inserted.downs
+            )
+        elif self.engine.dialect.name == "sqlite":
+            statement = sqlite.insert(table)
+            excluded = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=["id"], set_={"body": excluded.body, "ups": excluded.ups, "downs": excluded.downs}
+            )
+        else:
+            statement = table.insert()
+
+        with session_scope(self.engine) as con:
+            con.execute(statement, rows)
+
+        print(f"Written {len(rows)} rows to table")
+
+    def get_data_stats(self, table_name: str, start: datetime = None, end: datetime = None) -> dict:
+        """
+        Computes the oldest and newest datetime and the number of distinct days with data in the database.
+
+        Args:
+            - table_name: name of the table
+            - start: if set, only the rows from this time on are considered
+            - end: if set, only the rows up to this time are considered
+
+        Returns:
+            - stats: dict with the keys oldest, newest and days
+        """
+        query, params = self._range_query(
+            f"SELECT MIN(datetime), MAX(datetime), COUNT(DISTINCT DATE(datetime)) FROM clubs.{table_name}", start, end
+        )
+        with session_scope(self.engine) as con:
+            oldest, newest, days = con.execute(sa.text(query), params).one()
+
+        return {"oldest": pd.to_datetime(oldest), "newest": pd.to_datetime(newest), "days": days}
+
+    def get_data_in_range(
+        self, start: datetime = None, end: datetime = None, subreddit_name: str = "Berghain_Community"
+    ) -> pd.DataFrame:
+        """
+        Returns the data of the subreddit between start and end, as stored in the database.
+
+        Args:
+            - start: if set, only the rows from this time on are returned
+            - end: if set, only the rows up to this time are returned
+            - subreddit_name: name of the subreddit
+        """
+        table_name = f"reddit_{subreddit_name}"
+        self.prepare_table(table_name)
+
+        query, params = self._range_query(f"SELECT * FROM clubs.{table_name}", start, end)
+        with session_scope(self.engine) as con:
+            data = pd.read_sql(sa.text(query + " ORDER BY datetime"), con=con, params=params)
+
+        return data
+
+    @staticmethod
+    def _range_query(query: str, start: datetime = None, end: datetime = None):
+        """Adds the date predicates to the query. Timezone aware datetimes are compared in Berlin time."""
+        predicates = []
+        params = {}
+        if start is not None:
+            predicates.append("datetime >= :start")
+            params["start"] = start.replace(tzinfo=None)
+        if end is not None:
+            predicates.append("datetime <= :end")
+            params["end"] = end.replace(tzinfo=None)
+
+        if predicates:
+            query += " WHERE " + " AND ".join(predicates)
+        return query, params
+
+
+    def to_berlin_time(self, created_utc: float) -> datetime:
+        """Localize the UTC time of a submission or comment and then convert it to Berlin time"""
+        utc_time = pytz.utc.localize(datetime.utcfromtimestamp(created_utc))
+        return utc_time.astimezone(self.berlin_timezone)
+
+    def comment_row(self, comment) -> dict:
+        """Returns the database row of a comment, None if the comment is not relevant"""
+        # Skip empty comments of comments with a little amount of upvotes (10) --> Not relevant input
+        if (
+            any(string in comment.body for string in self.blacklist)
+            or comment.body == ""
+            or "used to indicate a person  thing  idea  state  event" in comment.body
+        ):
+            return None
+
+        return {
+            "datetime": self.to_berlin_time(comment.created_utc).replace(tzinfo=None),
+            "type": "comment",
+            "body": comment.body,
+            "ups": comment.ups,
+            "downs": comment.downs,
+            "id": comment.id,
+            "parent": comment.parent_id,
+        }
 
     def get_reddit_data(
-        self, time_oldest_requested: datetime = None, subreddit_name: str = "Berghain_Community", skip_ranges: dict = None
+        self,
+        time_oldest_requested: datetime = None,
+        subreddit_name: str = "Berghain_Community",
+        skip_ranges: dict = None,
+        refresh: bool = False,
     ) -> pd.DataFrame:
         """Looks for the data from the requested subreddit.
         If it is available, it returns it from the database, otherwise it downloads it, then returns it.
@@ -94,6 +281,7 @@ class DataDownloaderReddit:
         Args:
             - time_oldest_requested: does not return data older than this
             - subreddit_name: name of the subreddit
+            - refresh: if set, the posts newer than the stored ones are downloaded even if every day has data already
 
         Returns:
             - dataframe of reddit data, either downloaded or from database
@@ -103,134 +291,94 @@ class DataDownloaderReddit:
         time_oldest_requested = self.berlin_timezone.localize(time_oldest_requested)
 
         subreddit_table_name = f"reddit_{subreddit_name}"
+        self.prepare_table(subreddit_table_name)
 
-        symbol_table_exists = any(
-            [self.create_table_name(subreddit_table_name) == table for table in self.reddit_table_names]
-        )
-
-        if not symbol_table_exists:
-            self.create_table(subreddit_table_name)
-
-        query_data = f"SELECT * FROM clubs.{subreddit_table_name}"
-        data_in_table = pd.read_sql(sa.text(query_data), con=self.engine.connect())
+        stats = self.get_data_stats(subreddit_table_name)
 
-        time_reddit_newest = pd.to_datetime(data_in_table.datetime.max())
+        time_reddit_newest = stats["newest"]
         if pd.isna(time_reddit_newest):
             time_reddit_newest = datetime.now() - timedelta(30)
 
         # Localize the naive datetime object to the Berlin timezone
         time_reddit_newest = self.berlin_timezone.localize(time_reddit_newest)
 
-
-        time_reddit_oldest = pd.to_datetime(data_in_table.datetime.min())
+        time_reddit_oldest = stats["oldest"]
         if pd.isna(time_reddit_oldest):
             time_reddit_oldest = datetime.now() - timedelta(31)
 
         # Localize the naive datetime object to the Berlin timezone
         time_reddit_oldest = self.berlin_timezone.localize(time_reddit_oldest)
 
-        if pd.isna(time_reddit_oldest):
-            time_reddit_oldest = datetime.now() - timedelta(30)
-
         # If data is up-to-date return it as is, no need to download
-        existing_relevant = data_in_table[
-            (data_in_table.datetime >= time_oldest_requested.date()) & (data_in_table.datetime <= datetime.now().date())
-        ]
+        stats_relevant = self.get_data_stats(
+            subreddit_table_name,
+            start=datetime.combine(time_oldest_requested.date(), datetime.min.time()),
+            end=datetime.combine(datetime.now().date(), datetime.max.time()),
+        )
 
         # If there is no data, or if there are gaps, I need to get said data
-        if len(existing_relevant.datetime.unique()) == (datetime.now().date() - time_oldest_requested.date()).days:
-            return data_in_table
+        if not refresh and stats_relevant["days"] == (datetime.now().date() - time_oldest_requested.date()).days:
+            return self.get_data_in_range(start=time_oldest_requested, subreddit_name=subreddit_name)
 
         gen = self.reddit.subreddit(subreddit_name).new(limit=10000)
 
         # Keeping track of the initiated hours
-        time_list = []
-        submissions_all = []
-
-        # Iterate over posts. Assuming the data starts from the newest to the oldest
-        for submission in gen:
-            submissions = []
-
-            # Localize the UTC time and then convert to Berlin time
-            utc_time = pytz.utc.localize(datetime.utcfromtimestamp(submission.created_utc))
-            time_stamp = utc_time.astimezone(self.berlin_timezone)
-
-            if skip_ranges and any(
-                [
-                    time_stamp.date() >= skip_range["earliest"] and time_stamp.date() <= skip_range["latest"]
-                    for skip_range in skip_ranges
-                ]
-            ):
-                continue
-
-            if not time_stamp in time_list:
-                time_list.append(time_stamp)
-                print(f"Analyzing new hour: {time_stamp}", end="\r")
-
-            # Filtering out non related posts or irrelevant submissions
-            if not "queue" in submission.title.lower():
-                continue
-            # If the data I am getting is older than the newest I already have in the database, then I can quit
-            elif time_stamp < time_reddit_newest and time_stamp > time_reddit_oldest:
-                continue
-            # Data not older than this tate
-            elif time_stamp < time_oldest_requested:
-                break
-
-            # Reading the title and the upvotes and write them to file
-            title_data = {
-                "datetime": time_stamp,
-                "type": "title",
-                "body": submission.title,
-                "ups": submission.ups,
-                "downs": submission.downs,
-                "id": submission.id,
-                "parent": None,
-            }
-
-            submissions.append(title_data)
-            submissions_all.append(title_data)
-
-            # Iterating over comments in the current post
-            for comment in submission.comments:
-                # Skipping the end of readeable comments
-                if "MoreComments" in str(type(comment)):
-                    break
-
-                # Skip empty comments of comments with a little amount of upvotes (10) --> Not relevant input
-                if (
-                    any(string in comment.body for string in self.blacklist)
-                    or comment.body == ""
-                    or "used to indicate a person  thing  idea  state  event" in comment.body
+        time_list = set()
+        rows_batch = []
+
+        def relevant_submissions():
+            """Yields the submissions whose comments are needed, their titles are added to the batch"""
+            # Iterate over posts. Assuming the data starts from the newest to the oldest
+            for submission in gen:
+                time_stamp = self.to_berlin_time(submission.created_utc)
+
+                if skip_ranges and any(
+                    [
+                        time_stamp.date() >= skip_range["earliest"] and time_stamp.date() <= skip_range["latest"]
+                        for skip_range in skip_ranges
+                    ]
                 ):
                     continue
 
-                # Localize the UTC time and then convert to Berlin time
-                utc_time = pytz.utc.localize(datetime.utcfromtimestamp(comment.created_utc))
-                time_stamp = utc_time.astimezone(self.berlin_timezone)
-
-                comment_data = {
-                    "datetime": time_stamp,
-                    "type": "comment",
-                    "body": comment.body,
-                    "ups": comment.ups,
-                    "downs": comment.downs,
-                    "id": comment.id,
-                    "parent": comment.parent_id,
+                if not time_stamp in time_list:
+                    time_list.add(time_stamp)
+                    print(f"Analyzing new hour: {time_stamp}", end="\r")
+
+                # Filtering out non related posts or irrelevant submissions
+                if not "queue" in submission.title.lower():
+                    continue
+                # If the data I am getting is older than the newest I already have in the database, then I can quit
+                elif time_stamp < time_reddit_newest and time_stamp > time_reddit_oldest:
+                    continue
+                # Data not older than this tate
+                elif time_stamp < time_oldest_requested:
+                    break
+
+                # Reading the title and the upvotes and write them to file
+                title_data = {
+                    "datetime": time_stamp.replace(tzinfo=None),
+                    "type": "title",
+                    "body": submission.title,
+                    "ups": submission.ups,
+                    "downs": submission.downs,
+                    "id": submission.id,
+                    "parent": None,
                 }
 
-                submissions.append(comment_data)
-                submissions_all.append(comment_data)
+                rows_batch.append(title_data)
+                yield submission
 
-            data = pd.DataFrame(submissions)
-            print(f"Written {data.shape[0]} rows to table")
-            data.to_sql(name=subreddit_table_name, con=self.engine, if_exists="append", index=False)
+        # The comment trees are downloaded concurrently while the listing is being read
+        for submission, comments in self.comment_fetcher.fetch(relevant_submissions()):
+            rows_batch += [row for row in map(self.comment_row, comments) if row is not None]
 
-        data_new = pd.DataFrame(submissions_all)
-        data_all = pd.concat([data_in_table, data_new], ignore_index=True)
-        data_all = data_all[(data_all.datetime >= time_oldest_requested)]
+            if len(rows_batch) >= self.batch_size:
+                self.write_rows(subreddit_table_name, rows_batch)
+                rows_batch = []
 
-        return data_all
+        self.write_rows(subreddit_table_name, rows_batch)
+
+        return self.get_data_in_range(start=time_oldest_requested, subreddit_name=subreddit_name)
 
     def get_saved_data_reddit(self) -> pd.DataFrame:
         """
@@ -242,20 +390,7 @@ class DataDownloaderReddit:
             - data_reddit: dataframe with the reddit comments and titles
         """
 
-        subreddit_table_name = f"reddit_Berghain_Community"
-        query_data = f"SELECT * FROM clubs.{subreddit_table_name}"
-
-        symbol_table_exists = any(
-            [self.create_table_name(subreddit_table_name) == table for table in self.reddit_table_names]
-        )
-
-        if not symbol_table_exists:
-            self.create_table(subreddit_table_name)
-
-        data = pd.read_sql(sa.text(query_data), con=self.engine.connect())
-
-        data.sort_values("datetime", inplace=True)
-        return data
+        return self.get_data_in_range(subreddit_name="Berghain_Community")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+from datetime import date, datetime
+from typing import Optional
+
+
+class ScrapeManifest:
+    """
+    Keeps track of the archive months that were already scraped.
+
+    For every month it records when it was fetched, the hash of the archive page and the number of rows.
+    A month is final once it was fetched after its last day: the program of past months does not change
+    anymore, so these are not fetched again.
+    The manifest is written to disk after every update, so an interrupted backfill can be resumed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r") as json_file:
+                self.months = json.load(json_file)
+        else:
+            self.months = {}
+
+    @staticmethod
+    def month_key(year: int, month: int) -> str:
+        return f"{year}_{str(month).zfill(2)}"
+
+    @staticmethod
+    def month_end(year: int, month: int) -> date:
+        """First day after the given month"""
+        return date(int(year) + int(month) // 12, int(month) % 12 + 1, 1)
+
+    def get(self, year: int, month: int) -> Optional[dict]:
+        return self.months.get(self.month_key(year, month))
+
+    def is_final(self, year: int, month: int) -> bool:
+        entry = self.get(year, month)
+        return entry is not None and entry["final"]
+
+    def record(self, year: int, month: int, content_hash: str, rows: int, fetched_at: datetime = None):
+        """Records a fetched month and checkpoints the manifest"""
+        fetched_at = datetime.now() if fetched_at is None else fetched_at
+
+        with self._lock:
+            self.months[self.month_key(year, month)] = {
+                "fetched_at": fetched_at.isoformat(timespec="seconds"),
+                "content_hash": content_hash,
+                "rows": rows,
+                "final": fetched_at.date() >= self.month_end(year, month),
+            }
+            self._save()
+
+    def _save(self):
+        """Writes the manifest atomically, a crash while writing leaves the previous version in place"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        path_tmp = f"{self.path}.tmp"
+        with open(path_tmp, "w") as json_file:
+            json.dump(self.months, json_file, indent=2, sort_keys=True)
+        os.replace(path_tmp, self.path)
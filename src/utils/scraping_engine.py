@@ -0,0 +1,112 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional
+from urllib.parse import urlparse, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.utils.rate_limit import TokenBucket
+
+# Maximum number of simultaneous requests to the same host
+MAX_REQUESTS_PER_HOST = 4
+# Sustained request rate per host [requests/s] and the burst that is allowed on top of it
+REQUESTS_PER_SECOND = 2.0
+BURST = 4
+MAX_RETRIES = 4
+BACKOFF_FACTOR = 0.5  # [s], doubled at every retry
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ScrapingEngine:
+    """
+    Concurrent HTTP client used by the club parsers.
+
+    Requests share a pooled keep-alive session, are limited per host both in concurrency and in rate,
+    and are retried with exponential backoff on connection errors and transient HTTP errors.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        max_requests_per_host: int = MAX_REQUESTS_PER_HOST,
+        requests_per_second: float = REQUESTS_PER_SECOND,
+        burst: float = BURST,
+        max_retries: int = MAX_RETRIES,
+        backoff_factor: float = BACKOFF_FACTOR,
+        timeout: float = 20,
+    ):
+        self.max_workers = max_workers
+        self.max_requests_per_host = max_requests_per_host
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(max_workers, max_requests_per_host))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._host_semaphores = {}
+        self._host_buckets = {}
+        self._host_lock = threading.Lock()
+
+    def _host_limits(self, url: str):
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_requests_per_host)
+                self._host_buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+            return self._host_semaphores[host], self._host_buckets[host]
+
+    def get(self, url: str, params: dict = None) -> Optional[requests.Response]:
+        """
+        Requests the url, retrying on failures.
+
+        Args:
+            url: url to request
+            params: query parameters of the request
+
+        Returns:
+            response: the response, or None if the request failed after all retries
+        """
+        semaphore, bucket = self._host_limits(url)
+
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                with semaphore:
+                    response = self.session.get(url, params=params, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    if response.status_code >= 400:
+                        # Client errors (e.g. 404) are not going to change on a retry
+                        print(f"Error fetching content from {_without_query(url)}: HTTP {response.status_code}")
+                        return None
+                    return response
+                error = f"HTTP {response.status_code}"
+            except requests.exceptions.RequestException as e:
+                # Not the message of the exception, it contains the url with the query, e.g. an API key
+                error = type(e).__name__
+
+            if attempt < self.max_retries:
+                time.sleep(self.backoff_factor * 2**attempt)
+
+        print(f"Error fetching content from {_without_query(url)}: {error}")
+        return None
+
+    def map(self, function: Callable, items: Iterable) -> List:
+        """Applies the function to all items concurrently, the results are returned in the order of the items"""
+        items = list(items)
+        if len(items) <= 1:
+            return [function(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            return list(executor.map(function, items))
+
+
+def _without_query(url: str) -> str:
+    """The url without its query parameters, which can hold secrets, for logging"""
+    return urlsplit(url)._replace(query="").geturl()
@@ -1,12 +1,17 @@
 import matplotlib.pyplot as plt
-from bs4 import BeautifulSoup
 import glob
+import hashlib
 import pandas as pd
 import os
 import re
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta, datetime
+from typing import Iterator
 
+from lxml import etree
+
+from src.utils.message_store import MessageStore
 from src.utils.reddit_data_parser import DataDownloaderReddit
 
 # List of number words
@@ -108,67 +113,136 @@ relative_queue_friday = {
 }
 
 
-def parse_telegram_chat_export(file_path: str) -> pd.DataFrame:
-    """Parses telegram messages and returns them as a dataframe"""
+# Version of the parsed message format, the cache of the parsed export files is invalidated when it changes
+TELEGRAM_PARSER_VERSION = 2
+
+
+def _find_div(element, class_name: str):
+    """Returns the first div below the element that has the given class"""
+    for div in element.iter("div"):
+        if class_name in div.get("class", "").split():
+            return div
+    return None
+
+
+def iter_telegram_messages(file_path: str) -> Iterator[dict]:
+    """
+    Streams the messages of a telegram chat export.
+
+    The file is parsed incrementally and every message is freed once it was read, together with the ones before it,
+    so the memory used does not depend on the size of the export.
+    """
     date_format = "%d.%m.%Y %H:%M:%S"
-    messages_list = []
 
-    with open(file_path, "r", encoding="utf-8") as file:
-        chat_html = file.read()
+    for _, message in etree.iterparse(file_path, events=("end",), tag="div", html=True, encoding="utf-8"):
+        if "message" not in message.get("class", "").split():
+            continue
+
+        sender = _find_div(message, "from_name")
+        text = _find_div(message, "text")
+        timestamp = _find_div(message, "date")
+
+        if sender is not None and text is not None and timestamp is not None:
+            message_id = message.get("id", "").replace("message", "")
+            sender = "".join(sender.itertext())
+            sender = sender.replace("\n", "")
+            text = "".join(text.itertext())
+            text = text.replace("\n", "")
+            text = text.replace("       ", "")
+            timestamp = datetime.strptime(timestamp.get("title")[0:19], date_format)
+            yield {"id": message_id, "sender": sender, "text": text, "timestamp": timestamp}
+
+        message.clear()
+        while message.getprevious() is not None:
+            del message.getparent()[0]
 
-        soup = BeautifulSoup(chat_html, "html.parser")
 
-        messages = soup.find_all("div", class_="message")
-        for message in messages:
-            sender = message.find("div", class_="from_name")
-            text = message.find("div", class_="text")
-            timestamp = message.find("div", class_="date")
+def parse_telegram_chat_export(file_path: str) -> pd.DataFrame:
+    """Parses telegram messages and returns them as a dataframe"""
+    messages = pd.DataFrame(iter_telegram_messages(file_path), columns=["id", "sender", "text", "timestamp"])
+    messages["timestamp"] = pd.to_datetime(messages.timestamp)
+    return messages
 
-            if sender and text and timestamp:
-                sender = sender.text
-                sender = sender.replace("\n", "")
-                text = text.text
-                text = text.replace("\n", "")
-                text = text.replace("       ", "")
-                timestamp = pd.to_datetime(timestamp["title"][0:19], format=date_format)
-                messages_list.append({"sender": sender, "text": text, "timestamp": timestamp})
 
-    return pd.DataFrame(messages_list)
+def file_hash(file_path: str) -> str:
+    """Returns the sha256 hash of the file's content"""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
 
 
-def read_all_msgs_reddit() -> pd.DataFrame:
+def read_all_msgs_reddit(since: datetime = None) -> pd.DataFrame:
     """Reads and returns the messages from the subreddit.
-    If the data is not already stored in the database, it is downloaded"""
+    If the data is not already stored in the database, it is downloaded
+
+    Args:
+        since: if set, only the messages from this time on are returned, after the posts newer than the stored ones
+            are downloaded
+    """
 
     subreddit = "Berghain_Community"
     downloader = DataDownloaderReddit([subreddit])
-    data = downloader.get_saved_data_reddit()
-    oldest = datetime.now() - timedelta(365 * 4)
-    if data.empty:
-        data = downloader.get_reddit_data(oldest)
+    if since is not None:
+        # The new posts are appended to the database, then the ones from `since` on are read from it
+        data = downloader.get_reddit_data(pd.Timestamp(since).to_pydatetime(), subreddit_name=subreddit, refresh=True)
+    else:
+        data = downloader.get_saved_data_reddit()
+        oldest = datetime.now() - timedelta(365 * 4)
+        if data.empty:
+            data = downloader.get_reddit_data(oldest)
 
     # Make data compatible with telegram one
-    data.rename(columns={"date": "timestamp"}, inplace=True)
+    data.rename(columns={"datetime": "timestamp", "body": "text"}, inplace=True)
+    data["timestamp"] = pd.to_datetime(data.timestamp)
     return data
 
 
-def read_all_msgs_telegram() -> pd.DataFrame:
-    """Reads formats and returns the downloaded data from the telegram group."""
+def read_all_msgs_telegram(max_workers: int = None, since: datetime = None) -> pd.DataFrame:
+    """Reads formats and returns the downloaded data from the telegram group.
 
-    messages = []
+    The parsed messages of every export file are cached by the hash of its content, so only new export files are
+    parsed. These are parsed in parallel in a process pool.
+
+    Args:
+        max_workers: number of processes parsing the new export files
+        since: if set, only the messages from this time on are returned
+    """
+
+    path_cache = "data/berghain/telegram/cache"
+    os.makedirs(path_cache, exist_ok=True)
 
     paths = glob.glob("data/berghain/telegram/*.html")
     paths.sort()
-    for path in paths:
-        msg = parse_telegram_chat_export(path)
-        messages.append(msg)
+    paths_cached = [os.path.join(path_cache, f"{file_hash(path)}.v{TELEGRAM_PARSER_VERSION}.parquet") for path in paths]
+
+    paths_new = [path for path, path_cached in zip(paths, paths_cached) if not os.path.exists(path_cached)]
+    if paths_new:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for path, msg in zip(paths_new, executor.map(parse_telegram_chat_export, paths_new)):
+                path_cached = paths_cached[paths.index(path)]
+                msg.to_parquet(f"{path_cached}.tmp")
+                os.replace(f"{path_cached}.tmp", path_cached)
+
+    messages = [pd.read_parquet(path_cached) for path_cached in paths_cached]
 
     messages = pd.concat(messages)
+    if since is not None:
+        messages = messages[messages.timestamp >= since]
     messages.sort_values("timestamp", inplace=True)
     messages.reset_index(inplace=True, drop=True)
     return messages
 
 
+# Landmarks the queue length is reported against, in order of precedence, mapped to their LOCATION_TIME key
+LANDMARKS = {"kiosk": ["kiosk", "späti", "spati"], "hellweg": ["hellweg"], "wriezener": ["wriezener", "karree"]}
+
+PATTERN_NUMBER = re.compile(r"\d+")
+PATTERN_DECIMAL = re.compile(r"\d+\.\d+")
+PATTERN_METERS = re.compile(r"(\d+)\s*m")  # Also matches "meters"
+
+
 def infer_duration_from_location(location: str, text: str) -> float:
     """Returns the estimate of the duration in hours.
     The length of the queue is often reported in reference to specific landmarks.
@@ -179,10 +253,8 @@ def infer_duration_from_location(location: str, text: str) -> float:
 
     queue_duration = LOCATION_TIME[location]
 
-    match_meters = re.search(r"(\d+)\s*meters", text)
-    match_m = re.search(r"(\d+)\s*m", text)
-    if match_m or match_meters:
-        distance = np.average([int(dist) for dist in re.findall(r"\d+", text)])
+    if PATTERN_METERS.search(text):
+        distance = np.average([int(dist) for dist in PATTERN_NUMBER.findall(text)])
     else:
         distance = 0
 
@@ -191,55 +263,124 @@ def infer_duration_from_location(location: str, text: str) -> float:
     return queue_duration
 
 
-def queue_estimate_from_text(text: str) -> int:
-    """Estimates the queue length in hours from the text messages"""
-    if not isinstance(text, str):
-        return 0
+class KeywordMatcher:
+    """
+    Finds all the keywords contained in a text in a single scan, in the spirit of Aho-Corasick.
 
-    text = text.lower()
+    The keywords are compiled into one alternation, longest first, so that the longest keyword starting at a position
+    is matched. The keywords contained in it (e.g. "four" in "fourteen") are added from a precomputed table, the
+    equivalent of the automaton's output links. The scan resumes right after the start of every match, so that
+    overlapping keywords are found as well.
+    """
 
-    # Combine the keywords into a single regex pattern
-    keyword_pattern_h = "|".join(KEYWORDS_HOURS)
-    pattern_h = rf"(\d+)\s*({keyword_pattern_h})"
-    match_hours = re.search(pattern_h, text)
+    def __init__(self, keywords: list):
+        keywords = sorted(set(keywords), key=len, reverse=True)
+        self.pattern = re.compile("|".join(re.escape(keyword) for keyword in keywords))
+        self.contained = {keyword: {other for other in keywords if other in keyword} for keyword in keywords}
 
-    keyword_pattern_m = "|".join(KEYWORDS_MINUTES)
-    pattern_m = rf"(\d+)\s*({keyword_pattern_m})"
-    match_minutes = re.search(pattern_m, text)
+    def find(self, text: str) -> set:
+        """Returns the set of keywords that are substrings of the text"""
+        found = set()
+        match = self.pattern.search(text)
+        while match is not None:
+            found |= self.contained[match.group()]
+            match = self.pattern.search(text, match.start() + 1)
+        return found
 
-    # Filter out reports for other clubs
-    keyword_pattern_c = "|".join(KEYWORDS_CLUBS)
-    pattern_c = rf"(\d+)\s*({keyword_pattern_c})"
-    match_other_clubs = re.search(pattern_c, text)
 
-    if match_hours and not match_other_clubs:
-        list_hours = re.findall(r"\d+", text)
-        list_hours += re.findall(r"\d+\.\d+", text)
+class QueueTextExtractor:
+    """
+    Precompiled extractor of the queue length reported in a text message.
 
-        # Filters out unlikely reports
-        list_hours = [float(hour) for hour in list_hours if float(hour) < 8]
+    Reports in hours, in minutes and reports for other clubs are detected in a single pass by one regex with a named
+    group per kind, number words and landmarks by a KeywordMatcher.
+    """
 
-        list_hours += [number_int for number_str, number_int in words_hours.items() if number_str in text]
-        avg_hour = max(0, np.mean(list_hours))
-        return avg_hour
+    def __init__(self):
+        keyword_pattern_h = "|".join(KEYWORDS_HOURS)
+        keyword_pattern_m = "|".join(KEYWORDS_MINUTES)
+        keyword_pattern_c = "|".join(KEYWORDS_CLUBS)
+        self.pattern_units = re.compile(
+            rf"\d+\s*(?:(?P<hours>{keyword_pattern_h})|(?P<minutes>{keyword_pattern_m})|(?P<club>{keyword_pattern_c}))"
+        )
 
-    elif match_minutes and not match_other_clubs:
-        list_minutes = [int(minutes) for minutes in re.findall(r"\d+", text)]
-        list_minutes += [number_int for number_str, number_int in words_minutes.items() if number_str in text]
-        avg_hour = max(0, np.mean(list_minutes) / 60)
-        return avg_hour
+        landmark_words = [word for words in LANDMARKS.values() for word in words]
+        self.word_matcher = KeywordMatcher(list(words_hours) + list(words_minutes) + landmark_words)
 
-    elif any(loc in text for loc in ["kiosk", "späti", "spati"]):
-        return infer_duration_from_location("kiosk", text)
+    def extract(self, text: str) -> tuple:
+        """
+        Estimates the queue length in hours from a text message.
 
-    elif any(loc in text for loc in ["hellweg"]):
-        return infer_duration_from_location("hellweg", text)
+        Returns:
+            hours: estimated queue length in hours, 0 if there is no estimate
+            match_type: what the estimate is based on: "hours", "minutes", "landmark" or "none"
+            confidence: 1 for a single reported value, decreasing with the number of distinct values that are
+                averaged. Estimates from landmarks have a confidence of 0.5
+        """
+        if not isinstance(text, str):
+            return 0, "none", 0.0
 
-    elif any(loc in text for loc in ["wriezener", "karree"]):
-        return infer_duration_from_location("wriezener", text)
+        text = text.lower()
 
-    else:
-        return 0
+        units = {match.lastgroup for match in self.pattern_units.finditer(text)}
+        words = self.word_matcher.find(text)
+
+        # Reports for other clubs are filtered out
+        if "hours" in units and "club" not in units:
+            list_hours = PATTERN_NUMBER.findall(text)
+            list_hours += PATTERN_DECIMAL.findall(text)
+
+            # Filters out unlikely reports
+            list_hours = [float(hour) for hour in list_hours if float(hour) < 8]
+
+            list_hours += [number_int for number_str, number_int in words_hours.items() if number_str in words]
+            if not list_hours:
+                return 0, "none", 0.0
+            return max(0, sum(list_hours) / len(list_hours)), "hours", 1 / len(set(list_hours))
+
+        elif "minutes" in units and "club" not in units:
+            list_minutes = [int(minutes) for minutes in PATTERN_NUMBER.findall(text)]
+            list_minutes += [number_int for number_str, number_int in words_minutes.items() if number_str in words]
+            return max(0, sum(list_minutes) / len(list_minutes) / 60), "minutes", 1 / len(set(list_minutes))
+
+        for location, landmarks in LANDMARKS.items():
+            if any(landmark in words for landmark in landmarks):
+                return infer_duration_from_location(location, text), "landmark", 0.5
+
+        return 0, "none", 0.0
+
+    def extract_batch(self, texts) -> pd.DataFrame:
+        """
+        Estimates the queue length for a list or series of texts. Every distinct text is only processed once.
+
+        Returns:
+            estimates: dataframe with the columns hours, match_type and confidence, with the index of the texts
+        """
+        texts = pd.Series(texts) if not isinstance(texts, pd.Series) else texts
+
+        # Missing texts get the code -1, which picks the last entry: the estimate for a missing text
+        codes, unique_texts = pd.factorize(texts)
+        unique_estimates = [self.extract(text) for text in unique_texts] + [self.extract(None)]
+
+        estimates = pd.DataFrame(
+            [unique_estimates[code] for code in codes], columns=["hours", "match_type", "confidence"], index=texts.index
+        )
+        estimates["hours"] = estimates["hours"].astype(float)
+        return estimates
+
+
+queue_text_extractor = QueueTextExtractor()
+
+
+def queue_estimate_from_text(text: str) -> int:
+    """Estimates the queue length in hours from the text messages"""
+    return queue_text_extractor.extract(text)[0]
+
+
+def queue_estimates_from_texts(texts) -> pd.DataFrame:
+    """Estimates the queue length in hours from a list or series of text messages.
+    See QueueTextExtractor.extract_batch"""
+    return queue_text_extractor.extract_batch(texts)
 
 
 def event_date(ts):
@@ -267,6 +408,23 @@ def scale_prediction(row):
         return min(row.prediction / relative_queue_friday[row.hours_since_opening], MAX_WAITING_TIME)
 
 
+# Lookup array of the scaling factors, indexed by the hours since opening. Hours without a factor are nan
+_relative_queue_lookup = np.full(max(relative_queue_friday) + 1, np.nan)
+_relative_queue_lookup[list(relative_queue_friday)] = list(relative_queue_friday.values())
+
+
+def scale_predictions(predictions: np.ndarray, hours_since_opening: np.ndarray) -> np.ndarray:
+    """Vectorized version of scale_prediction, applied to arrays of estimates and hours since opening"""
+    hours_since_opening = np.asarray(hours_since_opening, dtype=int)
+    in_range = (hours_since_opening >= 0) & (hours_since_opening < len(_relative_queue_lookup))
+
+    factors = np.full(len(hours_since_opening), np.nan)
+    factors[in_range] = _relative_queue_lookup[hours_since_opening[in_range]]
+
+    scaled = np.minimum(predictions / np.where(np.isnan(factors), 1, factors), MAX_WAITING_TIME)
+    return np.where(np.isnan(factors), predictions, scaled)
+
+
 def queue_estimates(estimate_type: str = None, log=False) -> pd.DataFrame:
     """Estimates the waiting times from text data sources.
     The waiting time is expressed as the maximal waiting time. To get this,
@@ -277,63 +435,40 @@ def queue_estimates(estimate_type: str = None, log=False) -> pd.DataFrame:
         estimate_type: can be "telegram" or "reddit"
     """
 
-    path_telegram = "data/berghain/telegram/data.csv"
-    path_reddit = "data/berghain/reddit/data.csv"
+    read_functions = {"telegram": read_all_msgs_telegram, "reddit": read_all_msgs_reddit}
+    sources = list(read_functions) if estimate_type is None else [estimate_type]
 
-    telegram_dict = {"path": path_telegram, "read_fun": read_all_msgs_telegram}
-    reddit_dict = {"path": path_reddit, "read_fun": read_all_msgs_reddit}
-    estimate_data = []
+    # Only the messages that are new since the last run are read and estimated
+    messages = []
+    for source in sources:
+        store = MessageStore(source)
+        messages.append(store.refresh(read_functions[source], queue_estimates_from_texts))
+    messages = pd.concat(messages, ignore_index=True)
+    messages["timestamp"] = pd.to_datetime(messages.timestamp)
 
-    if estimate_type == None:
-        estimate_data.append(telegram_dict)
-        estimate_data.append(reddit_dict)
+    timestamps = messages.timestamp.dt
+    messages_time = messages.loc[timestamps.weekday >= 4].copy()
+    timestamps = messages_time.timestamp.dt
 
-    elif estimate_type == "reddit":
-        estimate_data.append(reddit_dict)
-    elif estimate_type == "telegram":
-        estimate_data.append(telegram_dict)
+    # Needed for the scaling
+    messages_time["hours_since_opening"] = (timestamps.weekday - 4) * 24 + timestamps.hour
 
-    messages = []
-    for estimate in estimate_data:
-        path = estimate["path"]
-        if not os.path.exists(path):
-            data = estimate["read_fun"]()
-            data.to_csv(path)
-            messages.append(data)
-        else:
-            messages.append(pd.read_csv(path, index_col=0, parse_dates=["timestamp"]))
-    messages = pd.concat(messages)
+    calendar = timestamps.isocalendar()
+    messages_time["calendar_week"] = calendar.week.astype(int)
+    messages_time["calendar_year"] = calendar.year.astype(int)
 
-    condition_weekend = messages.timestamp.apply(lambda x: x.weekday() >= 4)
-    messages_time = messages.loc[condition_weekend, :]
+    messages_time["max_waiting_time"] = scale_predictions(
+        messages_time.prediction.to_numpy(), messages_time.hours_since_opening.to_numpy()
+    )
 
-    # Actual estimate from the text messages
-    messages_time["prediction"] = messages_time.text.apply(lambda x: queue_estimate_from_text(x))
+    # Averaging the duration estimates over the weekend, identified by the date of its Friday.
+    # Monday is considered part of the weekend... welcome to Berlin
+    weekend_start = timestamps.normalize() - pd.to_timedelta((timestamps.weekday - 4) % 7, unit="D")
+    messages_time["max_waiting_time"] = messages_time.groupby(weekend_start).max_waiting_time.transform("mean")
 
-    # Needed for the scaling
-    messages_time["hours_since_opening"] = messages_time.timestamp.apply(lambda x: hour_since_opening(x))
-
-    messages_time["calendar_week"] = messages_time.timestamp.apply(lambda x: x.isocalendar().week)
-    messages_time["calendar_year"] = messages_time.timestamp.apply(lambda x: x.isocalendar().year)
-
-    messages_time["max_waiting_time"] = messages_time.apply(lambda x: scale_prediction(x), axis=1)
-
-    # Averaging the duration estimates
-    for year in messages_time["calendar_year"].unique():
-        messages_year = messages_time[messages_time["calendar_year"] == year]
-        for week in messages_year.calendar_week.unique():
-            # Monday is considered part of the weekend... welcome to Berlin
-            is_monday = messages_year.timestamp.apply(lambda x: x.weekday() == 0)
-            current_week_not_monday = (messages_year.calendar_week == week) & (~is_monday)
-            next_week_monday = (messages_year.calendar_week == (week + 1)) & (is_monday)
-            messages_year[(current_week_not_monday) | (next_week_monday)].max_waiting_time = messages_year[
-                (current_week_not_monday) | (next_week_monday)
-            ].max_waiting_time.mean()
-
-    dates = []
-    for i, row in messages_time.iterrows():
-        dates.append(event_date(row.timestamp))
-    messages_time["date"] = dates
+    # Messages after midnight belong to the event of the previous day
+    event_timestamps = messages_time.timestamp.where(timestamps.hour == 0, messages_time.timestamp - timedelta(days=1))
+    messages_time["date"] = event_timestamps.dt.date
 
     if log is True:
         for i, row in messages_time[messages_time.prediction > 0].iterrows():
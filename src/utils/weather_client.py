@@ -0,0 +1,161 @@
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import List, Union
+
+from src.utils.persistent_cache import PersistentCache
+from src.utils.scraping_engine import ScrapingEngine
+
+WEATHER_API_URL = "http://api.weatherapi.com/v1"
+CHUNK_SIZE = 35  # Days requested at once from the history endpoint
+FORECAST_DAYS = 14  # Days the forecast endpoint reaches into the future, today included
+
+# Time to live of the cached days [s]. Past days do not change anymore, today and the forecast are updated
+# during the day
+PAST_TTL = 30 * 24 * 3600
+TODAY_TTL = 3600
+FORECAST_TTL = 3 * 3600
+
+# Clients of the current process, keyed on the API url
+_weather_clients = {}
+_weather_clients_lock = threading.Lock()
+
+
+class WeatherClient:
+    """
+    Client of the WeatherAPI history and forecast endpoints.
+
+    The hourly data is cached on disk per city and day, with a time to live depending on whether the day is past,
+    today or in the future. Only the days that are missing from the cache are requested: past days from the history
+    endpoint in chunks of CHUNK_SIZE days, today and the following days from the forecast endpoint. The chunks are
+    requested concurrently over the pooled session of a ScrapingEngine.
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = WEATHER_API_URL,
+        cache: PersistentCache = None,
+        engine: ScrapingEngine = None,
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        """
+        Args:
+            api_key: WeatherAPI key, if not set it is read from the environment variable WEATHER_API_KEY on the first
+                request
+            base_url: url of the API, e.g. of a local server for tests
+            cache: cache of the days, by default in data/weather/weather_api_cache.sqlite
+            engine: engine used for the requests, by default a new one
+            chunk_size: maximum number of days per request to the history endpoint
+        """
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.cache = (
+            cache
+            if cache is not None
+            else PersistentCache(os.path.join("data", "weather", "weather_api_cache.sqlite"), ttl=PAST_TTL)
+        )
+        self.engine = engine if engine is not None else ScrapingEngine(requests_per_second=5, burst=8)
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def cache_key(city: str, day: date) -> str:
+        return f"{city.lower()}/{day.isoformat()}"
+
+    @staticmethod
+    def ttl(day: date, today: date) -> float:
+        if day < today:
+            return PAST_TTL
+        if day == today:
+            return TODAY_TTL
+        return FORECAST_TTL
+
+    def get_days(self, city: str, start_date: Union[date, datetime], end_date: Union[date, datetime]) -> List[dict]:
+        """
+        Returns the hourly weather of the days between start_date and end_date, both included.
+
+        Returns:
+            days: one dict per day with the keys `date` and `hour`, the list of the hours with `temp_c` and
+                `precip_mm`, in the format of the API. Days the API has no data for are missing
+        """
+        today = date.today()
+        start_date, end_date = _to_date(start_date), _to_date(end_date)
+        days = [start_date + timedelta(n) for n in range((end_date - start_date).days + 1)]
+
+        cached, missing = {}, []
+        for day in days:
+            entry = self.cache.get_entry(self.cache_key(city, day))
+            # A past day that was cached before it was over is incomplete
+            if entry is None or (day < today and datetime.fromtimestamp(entry["fetched_at"]).date() <= day):
+                missing.append(day)
+            else:
+                cached[day] = entry["value"]
+
+        if missing:
+            planned = self._plan_requests(missing, today)
+            for response_days in self.engine.map(lambda request: self._request(city, *request), planned):
+                for day_data in response_days:
+                    day = date.fromisoformat(day_data["date"])
+                    if day in cached or day not in missing:
+                        continue
+                    cached[day] = day_data
+                    self.cache.set(self.cache_key(city, day), day_data, ttl=self.ttl(day, today))
+
+        return [cached[day] for day in days if day in cached]
+
+    def _plan_requests(self, missing: List[date], today: date) -> List[tuple]:
+        """Groups the missing days into (endpoint, first day, last day) requests"""
+        requests = []
+        past = [day for day in missing if day < today]
+        for day in past:
+            endpoint, first, last = requests[-1] if requests else (None, None, None)
+            if endpoint == "history" and (day - first).days < self.chunk_size:
+                requests[-1] = ("history", first, day)
+            else:
+                requests.append(("history", day, day))
+
+        upcoming = [day for day in missing if today <= day < today + timedelta(FORECAST_DAYS)]
+        if upcoming:
+            requests.append(("forecast", today, max(upcoming)))
+        return requests
+
+    def _request(self, city: str, endpoint: str, first: date, last: date) -> List[dict]:
+        if self.api_key is None:
+            self.api_key = os.environ["WEATHER_API_KEY"]
+
+        params = {"key": self.api_key, "q": city}
+        if endpoint == "history":
+            params.update({"dt": first.isoformat(), "end_dt": last.isoformat()})
+        else:
+            params["days"] = (last - first).days + 1
+
+        response = self.engine.get(f"{self.base_url}/{endpoint}.json", params=params)
+        if response is None:
+            return []
+
+        return [
+            {
+                "date": day["date"],
+                "hour": [
+                    {"time": hour.get("time"), "temp_c": hour["temp_c"], "precip_mm": hour["precip_mm"]}
+                    for hour in day["hour"]
+                ],
+            }
+            for day in response.json()["forecast"]["forecastday"]
+        ]
+
+
+def _to_date(day: Union[date, datetime]) -> date:
+    return day.date() if isinstance(day, datetime) else day
+
+
+def get_weather_client(base_url: str = None) -> WeatherClient:
+    """
+    Returns the weather client of the process for the API url, so that its cache and session are shared.
+    If base_url is not set, the environment variable WEATHER_API_URL or the url of WeatherAPI is used.
+    """
+    base_url = base_url or os.environ.get("WEATHER_API_URL", WEATHER_API_URL)
+    with _weather_clients_lock:
+        if base_url not in _weather_clients:
+            _weather_clients[base_url] = WeatherClient(base_url=base_url)
+        return _weather_clients[base_url]
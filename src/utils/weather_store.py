@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+import warnings
+from datetime import date, datetime
+from glob import glob
+from typing import Iterable, Union
+
+import numpy as np
+import pandas as pd
+
+# Columns of the Open-Meteo hourly exports and their names in the store
+COLUMNS = {"temperature_2m (°C)": "temperature", "precipitation (mm)": "precipitation"}
+VARIABLES = list(COLUMNS.values())
+
+# Version of the on-disk array, to be increased when its layout changes
+WEATHER_STORE_VERSION = 1
+
+# Stores of the current process, keyed on the data folder
+_weather_stores = {}
+_weather_stores_lock = threading.Lock()
+
+
+class WeatherStore:
+    """
+    Hourly weather data of the Open-Meteo csv exports, loaded once into an array indexed by day and hour.
+
+    The array has the shape (days, 24, variables) and starts at `first_day`, hours without data are NaN.
+    It is built from the csv files the first time and saved next to them, later loads memory map the saved array
+    as long as the csv files did not change.
+    Queries are slices of the array, no per-row work is done.
+    """
+
+    def __init__(self, path: str = os.path.join("data", "wetter_berlin")):
+        self.path = path
+        self.path_cache = os.path.join(path, "cache")
+        self.key = self.cache_key()
+        self.first_day, self.values = self.load()
+
+    def files(self):
+        return sorted(glob(os.path.join(self.path, "*.csv")))
+
+    def cache_key(self) -> str:
+        files = [(path, os.path.getmtime(path)) for path in self.files()]
+        return hashlib.sha256(json.dumps([WEATHER_STORE_VERSION, files]).encode()).hexdigest()[:16]
+
+    def load(self):
+        """
+        Returns the first day and the hourly array, memory mapped from disk if the csv files did not change since
+        it was saved.
+        """
+        path_values = os.path.join(self.path_cache, f"hourly_{self.key}.npy")
+        path_meta = os.path.join(self.path_cache, f"hourly_{self.key}.json")
+
+        if os.path.exists(path_values) and os.path.exists(path_meta):
+            with open(path_meta, "r") as json_file:
+                first_day = np.datetime64(json.load(json_file)["first_day"], "D")
+            return first_day, np.load(path_values, mmap_mode="r")
+
+        first_day, values = self.parse_files(self.files())
+
+        os.makedirs(self.path_cache, exist_ok=True)
+        for path_old in glob(os.path.join(self.path_cache, "hourly_*")):
+            os.remove(path_old)
+        np.save(f"{path_values}.tmp.npy", values)
+        os.replace(f"{path_values}.tmp.npy", path_values)
+        with open(path_meta, "w") as json_file:
+            json.dump({"first_day": str(first_day)}, json_file)
+
+        return first_day, np.load(path_values, mmap_mode="r")
+
+    @staticmethod
+    def parse_files(files: list):
+        """
+        Reads the csv files into the hourly array.
+
+        Returns:
+            first_day: first day of the array as numpy datetime64[D]
+            values: float32 array of shape (days, 24, variables)
+        """
+        if not files:
+            return np.datetime64("1970-01-01", "D"), np.full((0, 24, len(VARIABLES)), np.nan, dtype=np.float32)
+
+        data = pd.concat(
+            [pd.read_csv(file, usecols=["time", *COLUMNS], parse_dates=["time"]) for file in files], ignore_index=True
+        )
+        data = data.rename(columns=COLUMNS).dropna(subset=["time"])
+
+        hours = data.time.values.astype("datetime64[h]")
+        first_day = hours.min().astype("datetime64[D]")
+        last_day = hours.max().astype("datetime64[D]")
+
+        # Position of each row in the flattened (day, hour) axis, later files overwrite earlier ones
+        positions = (hours - first_day.astype("datetime64[h]")).astype(np.int64)
+        values = np.full((int((last_day - first_day).astype(int)) + 1) * 24 * len(VARIABLES), np.nan, np.float32)
+        values = values.reshape(-1, len(VARIABLES))
+        values[positions] = data[VARIABLES].to_numpy(dtype=np.float32)
+
+        return first_day, values.reshape(-1, 24, len(VARIABLES))
+
+    @property
+    def last_day(self) -> np.datetime64:
+        return self.first_day + len(self.values) - 1
+
+    def day_index(self, day: Union[date, datetime]) -> int:
+        return int((np.datetime64(pd.Timestamp(day).date(), "D") - self.first_day).astype(int))
+
+    def covers(self, start_date: Union[date, datetime], end_date: Union[date, datetime]) -> bool:
+        """Whether all the days between start_date and end_date are in the store"""
+        return len(self.values) > 0 and self.day_index(start_date) >= 0 and self.day_index(end_date) < len(self.values)
+
+    def at(self, timestamp: datetime) -> dict:
+        """Returns the weather at the hour of the timestamp, with NaN if it is not in the store"""
+        index = self.day_index(timestamp)
+        if not 0 <= index < len(self.values):
+            return {variable: np.nan for variable in VARIABLES}
+        return dict(zip(VARIABLES, self.values[index, timestamp.hour].tolist()))
+
+    def hourly(self, start_date: Union[date, datetime], end_date: Union[date, datetime]) -> pd.DataFrame:
+        """Returns the hourly data of the days between start_date and end_date, both included"""
+        start = max(self.day_index(start_date), 0)
+        end = min(self.day_index(end_date) + 1, len(self.values))
+        if start >= end:
+            return pd.DataFrame(columns=["date", *VARIABLES])
+
+        values = self.values[start:end].reshape(-1, len(VARIABLES))
+        hours = (self.first_day + start).astype("datetime64[h]") + np.arange(len(values))
+        data = pd.DataFrame(values, columns=VARIABLES)
+        data.insert(0, "date", hours)
+        return data
+
+    def night_features(
+        self, start_date: Union[date, datetime], end_date: Union[date, datetime], hours: Iterable[int] = (23,)
+    ) -> pd.DataFrame:
+        """
+        Aggregates the weather of each night between start_date and end_date, both included.
+
+        Args:
+            start_date: first night
+            end_date: last night
+            hours: hours of the night that are aggregated. Hours from 24 on belong to the next day, e.g.
+                range(22, 30) is the window from 22:00 to 05:00
+
+        Returns:
+            weather: one row per night with data, with the minimum temperature and maximum precipitation of the window
+        """
+        hours = np.asarray(list(hours))
+        days = np.arange(self.day_index(start_date), self.day_index(end_date) + 1)
+
+        # Positions of the window of every night in the flattened (day, hour) axis
+        positions = (days[:, None] * 24 + hours[None, :]).ravel()
+        flat = self.values.reshape(-1, len(VARIABLES))
+        valid = (positions >= 0) & (positions < len(flat))
+        window = np.full((len(positions), len(VARIABLES)), np.nan, np.float32)
+        window[valid] = flat[positions[valid]]
+        window = window.reshape(len(days), len(hours), len(VARIABLES))
+
+        has_data = ~np.isnan(window).all(axis=(1, 2))
+        window = window[has_data]
+        # Nights with only one of the variables give an all-NaN slice for the other one, which is fine
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            weather = pd.DataFrame(
+                {
+                    "date": (self.first_day + days[has_data]).astype(object),
+                    "temperature": np.nanmin(window[:, :, VARIABLES.index("temperature")], axis=1),
+                    "precipitation": np.nanmax(window[:, :, VARIABLES.index("precipitation")], axis=1),
+                }
+            )
+        return weather
+
+
+def get_weather_store(path: str = os.path.join("data", "wetter_berlin")) -> WeatherStore:
+    """Returns the weather store of the process for the data folder, it is reloaded if the csv files changed"""
+    with _weather_stores_lock:
+        store = _weather_stores.get(path)
+        if store is None or store.key != store.cache_key():
+            store = WeatherStore(path)
+            _weather_stores[path] = store
+        return store
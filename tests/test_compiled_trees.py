@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import StandardScaler
+
+from src.inference.compiled_trees import CompiledTreeEnsemble, compile_artifact
+from src.inference.model_artifact import ModelArtifact
+
+FEATURES = ["followers", "temperature", "hour", "weekday"]
+
+
+def make_data(n_rows: int, seed: int, missing: float = 0.0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(
+        {
+            "followers": rng.lognormal(8, 1.5, n_rows),
+            "temperature": rng.normal(12, 8, n_rows),
+            "hour": rng.integers(0, 24, n_rows).astype(float),
+            "weekday": rng.integers(0, 7, n_rows).astype(float),
+        }
+    )
+    if missing:
+        X = X.mask(rng.random(X.shape) < missing)
+    return X
+
+
+def target(X: pd.DataFrame) -> np.ndarray:
+    return (
+        np.log1p(X.followers.fillna(0)) * 0.5
+        + np.sin(X.hour.fillna(0) / 24 * 2 * np.pi)
+        - 0.05 * X.temperature.fillna(10)
+        + 0.2 * X.weekday.fillna(3)
+    ).to_numpy()
+
+
+@pytest.fixture(scope="module")
+def train():
+    X = make_data(400, seed=0, missing=0.05)
+    return X, target(X)
+
+
+@pytest.fixture(scope="module")
+def rows_with_nans() -> pd.DataFrame:
+    X = make_data(200, seed=1)
+    # Some rows with a single feature missing, some with all of them
+    X.iloc[::7, 0] = np.nan
+    X.iloc[1::7, 1] = np.nan
+    X.iloc[2::7, 2] = np.nan
+    X.iloc[3::11] = np.nan
+    return X
+
+
+def fit_artifact(estimator, X: pd.DataFrame, y: np.ndarray, scaled: bool) -> ModelArtifact:
+    X = X[FEATURES].to_numpy()
+    transform = StandardScaler().fit(X) if scaled else None
+    estimator.fit(transform.transform(X) if scaled else X, y)
+    return ModelArtifact.from_estimator(estimator, FEATURES, transform)
+
+
+def native_predict(artifact: ModelArtifact, X: pd.DataFrame) -> np.ndarray:
+    """Predictions of the library the estimator comes from"""
+    X = X[FEATURES].to_numpy(dtype=float)
+    if len(artifact.pipeline.steps) > 1:
+        X = artifact.pipeline.steps[0][1].transform(X)
+    estimator = artifact.estimator
+    if isinstance(estimator, xgb.XGBRegressor):
+        return estimator.get_booster().inplace_predict(X)
+    return estimator.predict(X)
+
+
+@pytest.mark.parametrize("scaled", [False, True], ids=["raw", "scaled"])
+def test_xgboost_matches_the_booster(train, rows_with_nans, scaled):
+    X, y = train
+    artifact = fit_artifact(xgb.XGBRegressor(n_estimators=60, max_depth=4, learning_rate=0.2), X, y, scaled)
+
+    compiled = compile_artifact(artifact)
+
+    expected = native_predict(artifact, rows_with_nans)
+    np.testing.assert_allclose(compiled.predict(rows_with_nans), expected, atol=1e-5)
+    assert compiled.check_parity(artifact, rows_with_nans) <= 1e-5
+
+
+@pytest.mark.parametrize("scaled", [False, True], ids=["raw", "scaled"])
+def test_random_forest_matches_the_estimator(train, rows_with_nans, scaled):
+    X, y = train
+    artifact = fit_artifact(RandomForestRegressor(n_estimators=20, max_depth=6, random_state=0), X, y, scaled)
+
+    compiled = compile_artifact(artifact)
+
+    expected = native_predict(artifact, rows_with_nans)
+    np.testing.assert_allclose(compiled.predict(rows_with_nans), expected, atol=1e-5)
+    assert compiled.check_parity(artifact, rows_with_nans) <= 1e-5
+
+
+def test_save_and_load_round_trip(train, rows_with_nans, tmp_path):
+    X, y = train
+    artifact = fit_artifact(xgb.XGBRegressor(n_estimators=30, max_depth=3), X, y, scaled=True)
+    compiled = compile_artifact(artifact)
+    path = str(tmp_path / "compiled.npz")
+
+    compiled.save(path)
+    loaded = CompiledTreeEnsemble.load(path)
+
+    assert loaded.features == FEATURES
+    np.testing.assert_array_equal(loaded.predict(rows_with_nans), compiled.predict(rows_with_nans))
+    np.testing.assert_allclose(loaded.predict(rows_with_nans), native_predict(artifact, rows_with_nans), atol=1e-5)
+
+
+def test_parity_check_fails_on_a_different_model(train, rows_with_nans):
+    X, y = train
+    artifact = fit_artifact(xgb.XGBRegressor(n_estimators=30, max_depth=3), X, y, scaled=False)
+    other = fit_artifact(xgb.XGBRegressor(n_estimators=5, max_depth=2), X, y, scaled=False)
+
+    with pytest.raises(ValueError):
+        compile_artifact(artifact).check_parity(other, rows_with_nans)
+
+
+def test_unsupported_model_is_rejected(train):
+    X, y = train
+    artifact = fit_artifact(LinearRegression(), X.fillna(0), y, scaled=False)
+
+    with pytest.raises(TypeError):
+        compile_artifact(artifact)
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import telebot
+
+from src.bot import publisher
+from src.bot.dispatcher import CLOSED, QUEUE_FULL, QUEUED, RATE_LIMITED, Dispatcher
+
+SLOW_CHAT = 1
+REPLY = "Tonight: 2 h"
+
+
+class TelegramAPIHandler(BaseHTTPRequestHandler):
+    """
+    Fake Telegram Bot API, which records the messages sent. The messages to SLOW_CHAT are answered only once the
+    `release` event is set
+    """
+
+    sent = []
+    release = threading.Event()
+    lock = threading.Lock()
+
+    def _handle(self):
+        url = urlparse(self.path)
+        params = {key: value[0] for key, value in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update({key: value[0] for key, value in parse_qs(self.rfile.read(length).decode()).items()})
+
+        if not url.path.endswith("/sendMessage"):
+            self.send_error(404)
+            return
+
+        chat_id = int(params["chat_id"])
+        if chat_id == SLOW_CHAT:
+            self.release.wait(10)
+        with self.lock:
+            self.sent.append((chat_id, params["text"]))
+
+        message = {
+            "message_id": len(self.sent),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params["text"],
+        }
+        content = json.dumps({"ok": True, "result": message}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+def sent_to(chat_id) -> list:
+    with TelegramAPIHandler.lock:
+        return [text for chat, text in TelegramAPIHandler.sent if chat == chat_id]
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def telegram(monkeypatch):
+    """Points the bot of the publisher to a local fake Telegram API, the replies do not run a prediction"""
+    TelegramAPIHandler.sent = []
+    TelegramAPIHandler.release = threading.Event()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TelegramAPIHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setenv("TELEGRAM_API_URL", f"http://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}")
+    monkeypatch.setenv("BOT_TOKEN", "123:test")
+    # Restored after the test, get_bot sets it globally
+    monkeypatch.setattr(telebot.apihelper, "API_URL", telebot.apihelper.API_URL)
+    monkeypatch.setattr(publisher, "_bot", None)
+    monkeypatch.setattr(publisher, "prediction_service", SimpleNamespace(get_reply=lambda day: REPLY))
+
+    yield server
+    TelegramAPIHandler.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def test_slow_chat_does_not_block_other_chats(telegram):
+    dispatcher = Dispatcher(publisher.send_prediction, workers=2)
+    dispatcher.start()
+
+    assert dispatcher.submit(SLOW_CHAT) == QUEUED
+    assert dispatcher.submit(2) == QUEUED
+
+    assert wait_for(lambda: sent_to(2) == [REPLY])
+    assert sent_to(SLOW_CHAT) == []
+
+    TelegramAPIHandler.release.set()
+    dispatcher.shutdown(timeout=5)
+    assert sent_to(SLOW_CHAT) == [REPLY]
+
+
+def test_chat_over_its_rate_is_rejected(telegram):
+    dispatcher = Dispatcher(publisher.send_prediction, workers=2, messages_per_minute=1, burst=2)
+    dispatcher.start()
+
+    assert [dispatcher.submit(3) for _ in range(3)] == [QUEUED, QUEUED, RATE_LIMITED]
+    # Other chats have their own budget
+    assert dispatcher.submit(4) == QUEUED
+
+    dispatcher.shutdown(timeout=5)
+    assert sent_to(3) == [REPLY, REPLY]
+    assert sent_to(4) == [REPLY]
+    assert dispatcher.get_metrics()["rate_limited"] == 1
+
+
+def test_full_queue_rejects_and_replies(telegram, monkeypatch):
+    dispatcher = Dispatcher(publisher.send_prediction, workers=1, max_queue_size=1, enqueue_timeout=0.05)
+    monkeypatch.setattr(publisher, "dispatcher", dispatcher)
+    dispatcher.start()
+
+    # The worker is busy with the slow chat, the next job fills the queue
+    assert dispatcher.submit(SLOW_CHAT) == QUEUED
+    assert wait_for(lambda: dispatcher.queue_depth() == 0)
+    assert dispatcher.submit(5) == QUEUED
+
+    assert dispatcher.submit(6) == QUEUE_FULL
+    # A message of a user is answered right away that the bot is busy
+    message = telebot.types.Message.de_json(
+        {"message_id": 1, "date": int(time.time()), "chat": {"id": 7, "type": "private"}, "text": "queue?"}
+    )
+    publisher.handle_message(message)
+    assert sent_to(7) == ["Too many requests right now, please try again in a minute."]
+
+    TelegramAPIHandler.release.set()
+    dispatcher.shutdown(timeout=5)
+    assert sent_to(5) == [REPLY]
+    assert sent_to(6) == []
+    assert dispatcher.get_metrics()["queue_full"] == 2
+
+
+def test_shutdown_finishes_the_queued_jobs(telegram):
+    TelegramAPIHandler.release.set()
+    dispatcher = Dispatcher(publisher.send_prediction, workers=2)
+    dispatcher.start()
+
+    chats = list(range(10, 30))
+    assert all(dispatcher.submit(chat) == QUEUED for chat in chats)
+    dispatcher.shutdown(timeout=10)
+
+    assert all(sent_to(chat) == [REPLY] for chat in chats)
+    assert dispatcher.submit(10) == CLOSED
+    assert dispatcher.queue_depth() == 0
+    assert dispatcher.get_metrics()["processed"] == len(chats)
+    assert not any(thread.is_alive() for thread in dispatcher._threads)
@@ -0,0 +1,123 @@
+import os
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from src.features import feature_store
+from src.features.feature_store import FeatureStore
+from src.utils import metadata_utils
+
+NIGHT = date(2024, 6, 14)
+
+
+class Parser:
+    """Stub of a club parser, whose lineups are set by the test"""
+
+    def __init__(self):
+        self.followers = {}
+        self.scrapes = 0
+
+    def get_followers_at_date(self, date_selected: date):
+        self.scrapes += 1
+
+    def gather_artist_data(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            [
+                {
+                    "date": night,
+                    "followers": followers,
+                    "followers_max": followers,
+                    "followers_mean": followers / 2,
+                    "artists": 2,
+                    "followers_top3": followers,
+                }
+                for night, followers in self.followers.items()
+            ],
+            columns=["date", "followers", "followers_max", "followers_mean", "artists", "followers_top3"],
+        )
+
+
+def weather(city: str, start_date: date, end_date: date) -> pd.DataFrame:
+    days = pd.date_range(start_date, end_date)
+    return pd.DataFrame({"date": days, "temperature": 15.0, "precipitation": 0.0})
+
+
+@pytest.fixture(autouse=True)
+def sources(monkeypatch):
+    monkeypatch.setattr(metadata_utils, "get_weather_data", weather)
+    monkeypatch.setattr(metadata_utils, "get_important_dates", lambda years: [datetime(2024, 12, 24)])
+    monkeypatch.setattr(metadata_utils, "temperature_on_day", lambda day: 10)
+
+
+@pytest.fixture
+def store(tmp_path) -> FeatureStore:
+    parser = Parser()
+    parser.followers = {NIGHT - timedelta(days=7): 1000.0, NIGHT - timedelta(days=1): 2000.0}
+    store = FeatureStore(root=str(tmp_path), parser=parser)
+    store.refresh(labels=False)
+    return store
+
+
+def test_night_without_lineup_is_checked_once_per_interval(store, monkeypatch):
+    mtime = os.path.getmtime(store.path_features)
+
+    for _ in range(3):
+        row = store.get_night(NIGHT)
+        assert row is not None and pd.isna(row["followers"])
+    assert store.parser.scrapes == 1
+    # The night is new to the store, only its row is written
+    assert os.path.getmtime(store.path_features) == mtime
+    path_night = os.path.join(store.path_nights, f"{NIGHT.isoformat()}.parquet")
+    assert os.listdir(store.path_nights) == [os.path.basename(path_night)]
+    mtime_night = os.path.getmtime(path_night)
+
+    # Once the interval is over, the night is looked up again
+    monkeypatch.setattr(feature_store, "MISSING_NIGHT_CHECK_INTERVAL", 0)
+    assert pd.isna(store.get_night(NIGHT)["followers"])
+    assert store.parser.scrapes == 2
+    # Still no lineup, nothing is written
+    assert os.path.getmtime(path_night) == mtime_night
+    assert os.path.getmtime(store.path_features) == mtime
+
+
+def test_new_lineup_is_written_as_a_single_night(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(feature_store, "MISSING_NIGHT_CHECK_INTERVAL", 0)
+    store.get_night(NIGHT)
+    mtime = os.path.getmtime(store.path_features)
+
+    store.parser.followers[NIGHT] = 5000.0
+    row = store.get_night(NIGHT)
+
+    assert row["followers"] == 5000.0
+    assert store.get_night(NIGHT)["followers"] == 5000.0
+    assert store.parser.scrapes == 2
+    # Only the night is written, the features file is not rewritten
+    assert os.path.getmtime(store.path_features) == mtime
+    assert os.listdir(store.path_nights) == [f"{NIGHT.isoformat()}.parquet"]
+
+    # Read back by a new process, together with the other nights
+    reloaded = FeatureStore(root=str(tmp_path), parser=Parser())
+    assert reloaded.get_night(NIGHT, compute_missing=False)["followers"] == 5000.0
+    assert len(reloaded.read()) == 3
+
+
+def test_refresh_merges_the_single_nights(store):
+    store.parser.followers[NIGHT] = 5000.0
+    store.get_night(NIGHT)
+
+    store.refresh(labels=False)
+
+    assert os.listdir(store.path_nights) == []
+    features = pd.read_parquet(store.path_features)
+    assert len(features) == 3
+    assert features.followers.tolist() == [1000.0, 2000.0, 5000.0]
+
+
+def test_first_night_of_an_empty_store(tmp_path):
+    parser = Parser()
+    parser.followers = {NIGHT: 3000.0}
+    store = FeatureStore(root=str(tmp_path), parser=parser)
+
+    assert store.get_night(NIGHT)["followers"] == 3000.0
+    assert FeatureStore(root=str(tmp_path), parser=Parser()).get_night(NIGHT, compute_missing=False) is not None
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils import persistent_cache
+from src.utils.persistent_cache import PersistentCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Clock of the cache, which moves one second forward on every read"""
+    now = [1_000_000.0]
+
+    def time():
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr(persistent_cache, "time", SimpleNamespace(time=time))
+    return now
+
+
+def test_memory_hits_protect_keys_from_eviction(tmp_path, clock):
+    cache = PersistentCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Served from the memory tier
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+
+    assert PersistentCache(str(tmp_path / "cache.sqlite")).get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_access_times_of_memory_hits_are_written_in_batches(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(persistent_cache, "ACCESS_BATCH_SIZE", 2)
+    path = str(tmp_path / "cache.sqlite")
+    cache = PersistentCache(path)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    def accessed_at(key: str) -> float:
+        return cache._con.execute("SELECT accessed_at FROM cache WHERE key = ?", (key,)).fetchone()[0]
+
+    written = accessed_at("a")
+    cache.get("a")
+    assert accessed_at("a") == written
+
+    cache.get("b")
+    assert accessed_at("a") > written
+    assert accessed_at("b") > accessed_at("a")
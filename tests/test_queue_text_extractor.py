@@ -0,0 +1,174 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.telegram_data_parser import (
+    DISTANCE_TIME_FACTOR,
+    KEYWORDS_CLUBS,
+    KEYWORDS_HOURS,
+    KEYWORDS_MINUTES,
+    LOCATION_TIME,
+    QueueTextExtractor,
+    queue_estimate_from_text,
+    queue_estimates_from_texts,
+    words_hours,
+    words_minutes,
+)
+
+
+# Frozen copies of the extraction before QueueTextExtractor, the reference its estimates have to match
+def reference_infer_duration_from_location(location: str, text: str) -> float:
+    queue_duration = LOCATION_TIME[location]
+
+    match_meters = re.search(r"(\d+)\s*meters", text)
+    match_m = re.search(r"(\d+)\s*m", text)
+    if match_m or match_meters:
+        distance = np.average([int(dist) for dist in re.findall(r"\d+", text)])
+    else:
+        distance = 0
+
+    queue_duration += distance * DISTANCE_TIME_FACTOR
+
+    return queue_duration
+
+
+def reference_queue_estimate_from_text(text: str) -> int:
+    if not isinstance(text, str):
+        return 0
+
+    text = text.lower()
+
+    keyword_pattern_h = "|".join(KEYWORDS_HOURS)
+    pattern_h = rf"(\d+)\s*({keyword_pattern_h})"
+    match_hours = re.search(pattern_h, text)
+
+    keyword_pattern_m = "|".join(KEYWORDS_MINUTES)
+    pattern_m = rf"(\d+)\s*({keyword_pattern_m})"
+    match_minutes = re.search(pattern_m, text)
+
+    keyword_pattern_c = "|".join(KEYWORDS_CLUBS)
+    pattern_c = rf"(\d+)\s*({keyword_pattern_c})"
+    match_other_clubs = re.search(pattern_c, text)
+
+    if match_hours and not match_other_clubs:
+        list_hours = re.findall(r"\d+", text)
+        list_hours += re.findall(r"\d+\.\d+", text)
+
+        list_hours = [float(hour) for hour in list_hours if float(hour) < 8]
+
+        list_hours += [number_int for number_str, number_int in words_hours.items() if number_str in text]
+        avg_hour = max(0, np.mean(list_hours))
+        return avg_hour
+
+    elif match_minutes and not match_other_clubs:
+        list_minutes = [int(minutes) for minutes in re.findall(r"\d+", text)]
+        list_minutes += [number_int for number_str, number_int in words_minutes.items() if number_str in text]
+        avg_hour = max(0, np.mean(list_minutes) / 60)
+        return avg_hour
+
+    elif any(loc in text for loc in ["kiosk", "späti", "spati"]):
+        return reference_infer_duration_from_location("kiosk", text)
+
+    elif any(loc in text for loc in ["hellweg"]):
+        return reference_infer_duration_from_location("hellweg", text)
+
+    elif any(loc in text for loc in ["wriezener", "karree"]):
+        return reference_infer_duration_from_location("wriezener", text)
+
+    else:
+        return 0
+
+
+CORPUS = [
+    # Hours
+    "2 hours",
+    "Queue is about 3h right now",
+    "1.5 hrs wait",
+    "waited 2 hours, maybe 3",
+    "10 hours?? no way, more like 2 h",
+    "ZWEI STUNDEN, also 2 stunden",
+    "two hours and a half, 2 h",
+    "4h at 1am",
+    # Minutes
+    "30 minutes",
+    "45 mins from the corner",
+    "about twenty minutes, 20 mins",
+    "15 minuten",
+    "in after 90 mins",
+    # Landmarks
+    "queue to the kiosk",
+    "line reaches the späti",
+    "until the spati plus 50 m",
+    "past the kiosk by 100 meters",
+    "queue at hellweg",
+    "hellweg +20m",
+    "all the way to wriezener",
+    "around the karree",
+    # Other clubs
+    "2 hours at kitkat",
+    "3h at 2 sisyphos",
+    "30 mins at 1 tresor",
+    "45 minutes at rso, 2 rso",
+    # Number words only or nothing to extract
+    "one two three",
+    "someone said it is long",
+    "no queue at all",
+    "",
+    "Berghain tonight?",
+    # Not text
+    None,
+    float("nan"),
+    42,
+]
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_same_estimate_as_reference(text):
+    hours, match_type, confidence = QueueTextExtractor().extract(text)
+
+    assert hours == pytest.approx(reference_queue_estimate_from_text(text))
+    assert match_type in {"hours", "minutes", "landmark", "none"}
+    assert 0 <= confidence <= 1
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_module_function_same_as_reference(text):
+    assert queue_estimate_from_text(text) == pytest.approx(reference_queue_estimate_from_text(text))
+
+
+# With repeated texts, which are only extracted once, and missing ones
+BATCH = CORPUS + ["2 hours", "queue to the kiosk", None, float("nan"), "", "30 minutes"]
+
+
+@pytest.mark.parametrize("as_series", [True, False], ids=["series", "list"])
+def test_batch_same_as_reference_row_by_row(as_series):
+    extractor = QueueTextExtractor()
+    texts = pd.Series(BATCH, index=range(100, 100 + len(BATCH))) if as_series else list(BATCH)
+
+    estimates = extractor.extract_batch(texts)
+
+    assert list(estimates.columns) == ["hours", "match_type", "confidence"]
+    assert estimates["hours"].dtype == float
+    assert list(estimates.index) == (list(texts.index) if as_series else list(range(len(BATCH))))
+    for text, (_, row) in zip(BATCH, estimates.iterrows()):
+        assert row["hours"] == pytest.approx(reference_queue_estimate_from_text(text))
+        assert row["hours"] == pytest.approx(queue_estimate_from_text(text))
+        hours, match_type, confidence = extractor.extract(text)
+        assert (row["match_type"], row["confidence"]) == (match_type, pytest.approx(confidence))
+
+
+def test_batch_of_missing_and_empty_texts():
+    estimates = queue_estimates_from_texts(pd.Series([None, np.nan, "", None]))
+
+    assert estimates["hours"].tolist() == [0.0, 0.0, 0.0, 0.0]
+    assert estimates["match_type"].tolist() == ["none"] * 4
+    assert estimates["confidence"].tolist() == [0.0] * 4
+
+
+def test_empty_batch():
+    estimates = queue_estimates_from_texts([])
+
+    assert estimates.empty
+    assert list(estimates.columns) == ["hours", "match_type", "confidence"]
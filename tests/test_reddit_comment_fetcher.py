@@ -0,0 +1,190 @@
+import threading
+
+from src.utils.rate_limit import TokenBucket
+from src.utils.reddit_comment_fetcher import CommentTreeFetcher, RateLimitedRequestor
+
+
+class Comment:
+    def __init__(self, body: str):
+        self.body = body
+
+
+class MoreComments:
+    """Link to more comments, which can contain further links"""
+
+    def __init__(self, children: list):
+        self.children = children
+
+
+class CommentForest:
+    """
+    Stub of praw's CommentForest. As in praw, replace_more expands at most `limit` links, including the nested ones
+    it finds, and removes all the other ones from the forest.
+    """
+
+    def __init__(self, items: list):
+        self.items = items
+        self.requests = 0
+        self.reddit = None
+
+    def replace_more(self, limit: int = 32) -> list:
+        skipped = []
+        while any(isinstance(item, MoreComments) for item in self.items):
+            index = next(i for i, item in enumerate(self.items) if isinstance(item, MoreComments))
+            more = self.items.pop(index)
+            if limit is not None and self.requests >= limit:
+                skipped.append(more)
+                continue
+            self.requests += 1
+            self.reddit.request()
+            self.items[index:index] = more.children
+        return skipped
+
+    def list(self) -> list:
+        return list(self.items)
+
+
+class Submission:
+    def __init__(self, id: str, items: list):
+        self.id = id
+        self.comments = CommentForest(items)
+
+
+class Reddit:
+    """
+    Stub of praw.Reddit, which records the threads it is used from. As with a RateLimitedRequestor, every request
+    takes a token from the limiter
+    """
+
+    def __init__(self, submissions: dict, rate_limiter: TokenBucket):
+        self.submissions = submissions
+        self.rate_limiter = rate_limiter
+        self.threads = set()
+        self.requests = 0
+
+    def request(self):
+        self.requests += 1
+        self.rate_limiter.acquire()
+
+    def submission(self, id: str) -> Submission:
+        self.threads.add(threading.get_ident())
+        # Loading the submission with its first comments
+        self.request()
+        submission = self.submissions[id]
+        submission.comments.reddit = self
+        return submission
+
+
+class RedditFactory:
+    def __init__(self, submissions: list):
+        self.submissions = {submission.id: submission for submission in submissions}
+        self.instances = []
+        self._lock = threading.Lock()
+
+    def __call__(self, rate_limiter: TokenBucket) -> Reddit:
+        reddit = Reddit(self.submissions, rate_limiter)
+        with self._lock:
+            self.instances.append(reddit)
+        return reddit
+
+
+class CountingBucket(TokenBucket):
+    def __init__(self):
+        super().__init__(rate=1e6, capacity=1e6)
+        self.acquired = 0
+
+    def acquire(self, tokens: float = 1):
+        self.acquired += tokens
+        super().acquire(tokens)
+
+
+def make_submission(id: str, links: int) -> Submission:
+    """Submission with one comment and `links` links to more comments, the last one nested in the one before"""
+    nested = [Comment(f"{id} nested")]
+    items = [Comment(f"{id} top")]
+    for i in range(links - 1):
+        items.append(MoreComments([Comment(f"{id} more {i}")]))
+    items.append(MoreComments([Comment(f"{id} outer"), MoreComments(nested)]))
+    return Submission(id, items)
+
+
+def test_expands_all_links_up_to_the_limit():
+    limiter = CountingBucket()
+    submission = make_submission("a", links=5)
+    fetcher = CommentTreeFetcher(RedditFactory([submission]), max_workers=2, max_more_comments=10, rate_limiter=limiter)
+
+    comments = fetcher.fetch_comments(submission)
+
+    # 5 links at the top level and one nested in them
+    assert submission.comments.requests == 6
+    assert len(comments) == 1 + 5 + 1
+    assert all(isinstance(comment, Comment) for comment in comments)
+    # One token per request: the submission itself and every expanded link
+    assert limiter.acquired == 1 + 6
+
+
+def test_drops_the_links_over_the_limit():
+    limiter = CountingBucket()
+    submission = make_submission("b", links=5)
+    fetcher = CommentTreeFetcher(RedditFactory([submission]), max_workers=2, max_more_comments=3, rate_limiter=limiter)
+
+    comments = fetcher.fetch_comments(submission)
+
+    assert submission.comments.requests == 3
+    assert limiter.acquired == 1 + 3
+    assert len(comments) == 1 + 3
+    assert all(isinstance(comment, Comment) for comment in comments)
+
+
+def test_no_request_without_links():
+    limiter = CountingBucket()
+    submission = Submission("c", [Comment("only")])
+    fetcher = CommentTreeFetcher(RedditFactory([submission]), max_workers=2, rate_limiter=limiter)
+
+    assert [comment.body for comment in fetcher.fetch_comments(submission)] == ["only"]
+    assert submission.comments.requests == 0
+    assert limiter.acquired == 1
+
+
+def test_fetch_yields_every_submission():
+    submissions = [make_submission(str(i), links=i % 4 + 1) for i in range(20)]
+    factory = RedditFactory(submissions)
+    limiter = CountingBucket()
+    fetcher = CommentTreeFetcher(factory, max_workers=3, rate_limiter=limiter)
+
+    fetched = dict((submission.id, comments) for submission, comments in fetcher.fetch(iter(submissions)))
+
+    assert sorted(fetched) == sorted(submission.id for submission in submissions)
+    for i in range(20):
+        assert len(fetched[str(i)]) == 1 + (i % 4 + 1) + 1
+
+    assert limiter.acquired == sum(1 + submission.comments.requests for submission in submissions)
+    assert limiter.acquired == sum(reddit.requests for reddit in factory.instances)
+    # One praw instance per worker thread, never shared between threads
+    assert 1 <= len(factory.instances) <= 3
+    assert all(len(reddit.threads) == 1 for reddit in factory.instances)
+    assert len(set().union(*(reddit.threads for reddit in factory.instances))) == len(factory.instances)
+
+
+class Session:
+    """Stub of the requests session of prawcore"""
+
+    def __init__(self):
+        self.headers = {}
+        self.requests = []
+
+    def request(self, method: str, url: str, **kwargs):
+        self.requests.append((method, url))
+        return "response"
+
+
+def test_requestor_takes_a_token_per_request():
+    limiter = CountingBucket()
+    session = Session()
+    requestor = RateLimitedRequestor(user_agent="comment fetcher test", session=session, rate_limiter=limiter)
+
+    for i in range(3):
+        assert requestor.request("GET", f"https://oauth.reddit.com/api/morechildren/{i}") == "response"
+
+    assert len(session.requests) == 3
+    assert limiter.acquired == 3
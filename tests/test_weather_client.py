@@ -0,0 +1,177 @@
+import json
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from src.utils.persistent_cache import PersistentCache
+from src.utils.scraping_engine import ScrapingEngine
+from src.utils.weather_client import FORECAST_TTL, PAST_TTL, TODAY_TTL, WeatherClient
+
+BAD_KEY = "secret-bad-key"
+
+
+class WeatherAPIHandler(BaseHTTPRequestHandler):
+    """Fake WeatherAPI, which returns one hour per day for the days asked for and records the requests"""
+
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: value[0] for key, value in parse_qs(url.query).items()}
+        self.requests.append((url.path, params))
+
+        if params.get("key") == BAD_KEY:
+            content = json.dumps({"error": {"code": 2006, "message": "API key is invalid."}}).encode()
+            self.send_response(400)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+
+        if url.path == "/history.json":
+            first, last = date.fromisoformat(params["dt"]), date.fromisoformat(params["end_dt"])
+        elif url.path == "/forecast.json":
+            first = date.today()
+            last = first + timedelta(int(params["days"]) - 1)
+        else:
+            self.send_error(404)
+            return
+
+        days = [first + timedelta(n) for n in range((last - first).days + 1)]
+        body = {
+            "forecast": {
+                "forecastday": [
+                    {"date": day.isoformat(), "hour": [{"time": f"{day} 00:00", "temp_c": 10.0, "precip_mm": 0.0}]}
+                    for day in days
+                ]
+            }
+        }
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    WeatherAPIHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WeatherAPIHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    return make_client(f"http://127.0.0.1:{server.server_address[1]}", tmp_path)
+
+
+def make_client(base_url: str, tmp_path, api_key: str = "key") -> WeatherClient:
+    return WeatherClient(
+        api_key=api_key,
+        base_url=base_url,
+        cache=PersistentCache(str(tmp_path / "weather.sqlite"), ttl=PAST_TTL),
+        engine=ScrapingEngine(requests_per_second=1000, burst=1000, max_retries=0, timeout=5),
+        chunk_size=4,
+    )
+
+
+def history_ranges() -> list:
+    return sorted(
+        (params["dt"], params["end_dt"]) for path, params in WeatherAPIHandler.requests if path == "/history.json"
+    )
+
+
+def test_history_is_requested_in_chunks(client):
+    start = date.today() - timedelta(20)
+    days = client.get_days("Berlin", start, start + timedelta(9))
+
+    assert [day["date"] for day in days] == [(start + timedelta(n)).isoformat() for n in range(10)]
+    expected = [(0, 3), (4, 7), (8, 9)]
+    assert history_ranges() == [
+        ((start + timedelta(first)).isoformat(), (start + timedelta(last)).isoformat()) for first, last in expected
+    ]
+    assert all(params["key"] == "key" and params["q"] == "Berlin" for _, params in WeatherAPIHandler.requests)
+
+
+def test_only_missing_days_are_requested(client):
+    start = date.today() - timedelta(20)
+    client.get_days("Berlin", start + timedelta(3), start + timedelta(4))
+    WeatherAPIHandler.requests.clear()
+
+    client.get_days("Berlin", start, start + timedelta(9))
+
+    # Days 3 and 4 are cached, so the days before and after them are requested separately
+    expected = [(0, 2), (5, 8), (9, 9)]
+    assert history_ranges() == [
+        ((start + timedelta(first)).isoformat(), (start + timedelta(last)).isoformat()) for first, last in expected
+    ]
+
+
+def test_cache_hit_makes_no_request(client):
+    today = date.today()
+    first = client.get_days("Berlin", today - timedelta(5), today + timedelta(2))
+    requests = len(WeatherAPIHandler.requests)
+    assert requests > 0
+
+    second = client.get_days("Berlin", today - timedelta(5), today + timedelta(2))
+
+    assert second == first
+    assert len(WeatherAPIHandler.requests) == requests
+
+
+def test_past_today_and_forecast_days_are_cached_with_their_ttl(client):
+    today = date.today()
+    client.get_days("Berlin", today - timedelta(2), today + timedelta(2))
+
+    forecast = [params for path, params in WeatherAPIHandler.requests if path == "/forecast.json"]
+    assert forecast == [{"key": "key", "q": "Berlin", "days": "3"}]
+
+    for offset, ttl in [(-2, PAST_TTL), (-1, PAST_TTL), (0, TODAY_TTL), (1, FORECAST_TTL), (2, FORECAST_TTL)]:
+        entry = client.cache.get_entry(client.cache_key("Berlin", today + timedelta(offset)))
+        assert entry["expires_at"] - entry["fetched_at"] == pytest.approx(ttl)
+
+
+def test_client_error_does_not_log_the_api_key(server, tmp_path, capsys):
+    client = make_client(f"http://127.0.0.1:{server.server_address[1]}", tmp_path, api_key=BAD_KEY)
+    today = date.today()
+
+    assert client.get_days("Berlin", today - timedelta(2), today) == []
+
+    output = capsys.readouterr().out
+    assert "HTTP 400" in output
+    assert BAD_KEY not in output
+    # Nothing is cached, so the days are requested again once the key is fixed
+    assert client.cache.get(client.cache_key("Berlin", today)) is None
+
+
+def test_connection_error_does_not_log_the_api_key(tmp_path, capsys):
+    # Nothing listens on the port of a closed server
+    closed = ThreadingHTTPServer(("127.0.0.1", 0), WeatherAPIHandler)
+    port = closed.server_address[1]
+    closed.server_close()
+    client = make_client(f"http://127.0.0.1:{port}", tmp_path, api_key=BAD_KEY)
+
+    assert client.get_days("Berlin", date.today(), date.today()) == []
+
+    output = capsys.readouterr().out
+    assert "Error fetching content" in output
+    assert BAD_KEY not in output
+
+
+def test_ttl():
+    today = date(2024, 6, 15)
+    assert WeatherClient.ttl(date(2024, 6, 14), today) == PAST_TTL
+    assert WeatherClient.ttl(today, today) == TODAY_TTL
+    assert WeatherClient.ttl(date(2024, 6, 16), today) == FORECAST_TTL